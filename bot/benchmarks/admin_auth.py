@@ -0,0 +1,98 @@
+"""
+قياس كلفة مزخرفات المصادقة على مسارات /admin/api قبل وبعد توحيدها مع هوية الطلب
+الاستخدام (من مجلد المشروع): python benchmarks/admin_auth.py [عدد التكرارات]
+"""
+
+import os
+import sys
+import time
+import traceback
+from functools import wraps
+
+# مجلد المشروع الذي يحتوي الحزمة bot، مقدماً على أي حزمة أخرى بنفس الاسم
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+try:
+    import jwt
+    from flask import g, request, session, jsonify, current_app
+    from sqlalchemy import event
+    from werkzeug.security import generate_password_hash
+    from bot import create_app, db
+    from bot.main import admin_required
+    from bot.models import User
+    from bot.utils import create_token
+
+    def legacy_before_request():
+        """نسخة before_request السابقة: فك التوكن وجلب المستخدم في كل طلب"""
+        g.current_user = None
+        token = session.get('auth_token')
+        if not token and request.headers.get('Authorization', '').startswith('Bearer '):
+            token = request.headers['Authorization'].split(' ')[1]
+        if token:
+            data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
+            g.current_user = User.query.get(data['user_id'])
+
+    def legacy_admin_required(f):
+        """نسخة admin_required السابقة: فك التوكن وجلب المستخدم مرة ثانية"""
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            token = request.headers['Authorization'].split(' ')[1]
+            data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
+            current_user = User.query.get(data['user_id'])
+            if not current_user or not current_user.is_admin:
+                return jsonify({'success': False}), 403
+            return f(current_user, *args, **kwargs)
+        return decorated
+
+    def handler(current_user, user_id):
+        return current_user.id
+
+    app = create_app()
+    if app is None:
+        print("خطأ: create_app() أرجعت None")
+        sys.exit(1)
+    # الطلبات المحاكاة لا تحمل رمز CSRF، والقياس يخص المصادقة فقط
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    with app.app_context():
+        db.create_all()
+        admin = User(
+            email='benchmark-admin@example.com',
+            password=generate_password_hash('benchmark'),
+            name='benchmark admin',
+            is_admin=True,
+            is_verified=True
+        )
+        db.session.add(admin)
+        db.session.commit()
+
+        headers = {'Authorization': f'Bearer {create_token(admin.id, True)}'}
+        path = f'/admin/api/users/{admin.id}/ban'
+
+        query_count = [0]
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def count_queries(*args):
+            query_count[0] += 1
+
+        def run(label, before, decorated):
+            query_count[0] = 0
+            started = time.perf_counter()
+            for _ in range(iterations):
+                with app.test_request_context(path, method='POST', headers=headers):
+                    before()
+                    decorated(user_id=admin.id)
+                db.session.remove()
+            elapsed = time.perf_counter() - started
+            print(f"{label}: {elapsed / iterations * 1e6:.1f} µs/طلب، {query_count[0] / iterations:.2f} استعلام/طلب")
+
+        run('قبل', legacy_before_request, legacy_admin_required(handler))
+        run('بعد', app.preprocess_request, admin_required(handler))
+
+except Exception as e:
+    print(f"خطأ: {str(e)}")
+    traceback.print_exc()
+    sys.exit(1)
@@ -0,0 +1,164 @@
+"""
+قياس الاستدعاء (recall) والدقة (precision) وسرعة التوحيد لمجموعة عناوين عربية بأشكال كتابة مختلفة
+الاستخدام (من مجلد المشروع): python benchmarks/arabic_search.py [عدد التكرارات]
+"""
+
+import os
+import sys
+import time
+
+# مجلد المشروع الذي يحتوي الحزمة bot، مقدماً على أي حزمة أخرى بنفس الاسم
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bot.text_normalization import build_search_text, tokenize
+
+
+CORPUS = [
+    'سيارة كيا ريو موديل 2015 للبيع',
+    'سياره هيونداي النترا بحالة ممتازة',
+    'السيّارة مستعملة نظيفة جداً',
+    'ســيـارة تويوتا كامري',
+    'وسيارة شيفروليه مع إطارات جديدة',
+    'اطارات ميشلان مقاس 16',
+    'إطار احتياطي أصلي',
+    'آيفون ١٣ برو ماكس بحالة الجديد',
+    'ايفون 13 مستعمل',
+    'أيفون 11 للبيع بسعر مغري',
+    'لابتوب ديل إنسبايرون',
+    'لابتوب لينوفو ثينك باد',
+    'اللابتوب أبل ماك بوك اير',
+    'غسالة سامسونج أوتوماتيك',
+    'الغسالة ال جي 8 كيلو',
+    'غساله اتوماتيك نصف عمر',
+    'ثلاجة كبيرة نوفروست',
+    'الثلاجه سامسونج بابين',
+    'مكيف سبليت ١٨ ألف وحدة',
+    'مكيّف شباك مستعمل',
+    'شقة للإيجار في دمشق',
+    'شقه للبيع في حلب',
+    'الشقة مفروشة في اللاذقية',
+    'أرض زراعية في حمص',
+    'ارض سكنية للبيع',
+    'كرسي مكتب مريح',
+    'الكراسي البلاستيكية للحديقة',
+    'طاولة سفرة خشب زان',
+    'الطاولة المستديرة مع كراسي',
+    'دراجة نارية ياماها',
+    'الدراجة الهوائية للأطفال',
+    'درّاجة رياضية جبلية',
+    'مصحف شريف طبعة فاخرة',
+    'كتب جامعية هندسة',
+    'الكتاب المدرسي للصف التاسع',
+    'هاتف سامسونج جالكسي إس 22',
+    'الهاتف الأرضي باناسونيك',
+    'تلفزيون إل جي 55 بوصة',
+    'التلفاز سوني ذكي',
+    'كاميرا كانون احترافية',
+    'بالون هواء للحفلات',
+    'ونش سحب للسيارات المعطلة',
+    'باقة الوردة الحمراء',
+    'وردة صناعية للزينة',
+    'هدية للوالد في عيد الأب',
+    'الدليل الشامل لتعلم البرمجة',
+]
+
+# كل استعلام مع فهارس العناوين المتوقع ظهورها في النتائج
+QUERIES = [
+    ('سيارة', {0, 1, 2, 3, 4}),
+    ('السياره', {0, 1, 2, 3, 4}),
+    ('إطارات', {4, 5}),
+    ('آيفون 13', {7, 8}),
+    ('ايفون', {7, 8, 9}),
+    ('لابتوب', {10, 11, 12}),
+    ('غسالة', {13, 14, 15}),
+    ('ثلاجة', {16, 17}),
+    ('مكيف', {18, 19}),
+    ('شقة', {20, 21, 22}),
+    ('أرض', {23, 24}),
+    ('طاولة', {27, 28}),
+    ('دراجة', {29, 30, 31}),
+    ('الهاتف', {35, 36}),
+    ('مكيف ١٨', {18}),
+    ('بالون', {40}),
+    ('وردة', {42, 43}),
+    ('الوردة', {42, 43}),
+    ('والد', {44}),
+    ('دليل', {45}),
+]
+
+# استعلامات الدقة: العناوين غير المرتبطة التي يجب ألا تظهر (تجذيع زائد يقطع من أصل الكلمة)
+EXCLUSIONS = [
+    ('بالون', {41}),
+    ('فالون', {41}),
+    ('والد', {45}),
+    ('وردة', set(range(40))),
+]
+
+
+def naive_match(title, search_query):
+    """محاكاة شرط ilike('%q%') السابق"""
+    return search_query.casefold() in title.casefold()
+
+
+def normalized_match(search_text, search_query):
+    """مطابقة كل كلمة موحدة من الاستعلام كبادئة لكلمة في النص الموحد المخزن، كما في \"term\"* في FTS5"""
+    terms = tokenize(search_query)
+    tokens = search_text.split()
+    return bool(terms) and all(any(token.startswith(term) for token in tokens) for term in terms)
+
+
+def recall(match, documents):
+    found = expected_total = 0
+    for search_query, expected in QUERIES:
+        matched = {i for i, document in enumerate(documents) if match(document, search_query)}
+        found += len(matched & expected)
+        expected_total += len(expected)
+    return found / expected_total
+
+
+def precision(match, documents):
+    """نسبة النتائج الصحيحة من كل النتائج المطابقة"""
+    correct = matched_total = 0
+    for search_query, expected in QUERIES:
+        matched = {i for i, document in enumerate(documents) if match(document, search_query)}
+        correct += len(matched & expected)
+        matched_total += len(matched)
+    return correct / matched_total if matched_total else 1.0
+
+
+def false_matches(match, documents):
+    """العناوين غير المرتبطة التي ظهرت في نتائج استعلامات الدقة"""
+    return [
+        (search_query, i)
+        for search_query, excluded in EXCLUSIONS
+        for i in sorted(excluded)
+        if match(documents[i], search_query)
+    ]
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    search_texts = [build_search_text(title) for title in CORPUS]
+
+    print(f"عدد العناوين: {len(CORPUS)}، عدد الاستعلامات: {len(QUERIES)}")
+    print(f"الاستدعاء باستخدام ilike: {recall(naive_match, CORPUS):.1%}")
+    print(f"الاستدعاء بعد التوحيد: {recall(normalized_match, search_texts):.1%}")
+    print(f"الدقة باستخدام ilike: {precision(naive_match, CORPUS):.1%}")
+    print(f"الدقة بعد التوحيد: {precision(normalized_match, search_texts):.1%}")
+
+    unrelated = false_matches(normalized_match, search_texts)
+    for search_query, i in unrelated:
+        print(f"مطابقة خاطئة: '{search_query}' ← {CORPUS[i]}")
+    print(f"المطابقات الخاطئة في استعلامات الدقة: {len(unrelated)}")
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for title in CORPUS:
+            build_search_text(title)
+    elapsed = time.perf_counter() - started
+    print(f"سرعة التوحيد: {iterations * len(CORPUS) / elapsed:,.0f} عنوان/ثانية")
+
+
+if __name__ == '__main__':
+    main()
@@ -16,6 +16,12 @@ db = SQLAlchemy()
 migrate = Migrate()
 csrf = CSRFProtect()
 
+try:
+    from flask_socketio import SocketIO
+    socketio = SocketIO()
+except ImportError:
+    socketio = None
+
 def create_app():
     try:
         print("بدء إنشاء تطبيق Flask...")
@@ -31,7 +37,18 @@ def create_app():
         app.config['CLOUDFLARE_CONFIG'] = {
             'account_id': os.getenv('CLOUDFLARE_ACCOUNT_ID'),
             'api_token': os.getenv('CLOUDFLARE_API_TOKEN'),
-            'image_delivery_url': os.getenv('CLOUDFLARE_IMAGE_DELIVERY_URL')
+            'image_delivery_url': os.getenv('CLOUDFLARE_IMAGE_DELIVERY_URL'),
+            'api_url': os.getenv('CLOUDFLARE_API_URL', 'https://api.cloudflare.com/client/v4'),
+            'connect_timeout': float(os.getenv('CLOUDFLARE_CONNECT_TIMEOUT', 5)),
+            'read_timeout': float(os.getenv('CLOUDFLARE_READ_TIMEOUT', 30)),
+            'max_retries': int(os.getenv('CLOUDFLARE_MAX_RETRIES', 3)),
+            'max_backoff': float(os.getenv('CLOUDFLARE_MAX_BACKOFF', 30)),
+            # أسماء variants المعرفة في حساب Cloudflare Images لكل مقاس
+            'variants': {
+                'thumbnail': os.getenv('CLOUDFLARE_VARIANT_THUMBNAIL', 'public'),
+                'card': os.getenv('CLOUDFLARE_VARIANT_CARD', 'public'),
+                'full': os.getenv('CLOUDFLARE_VARIANT_FULL', 'public')
+            }
         }
 
    
@@ -40,6 +57,7 @@ def create_app():
             'default_avatar': '/static/images/users/default-avatar.png',
             'default_product': '/static/images/products/product-placeholder.jpg',
             'allowed_extensions': ['jpg', 'jpeg', 'png', 'gif'],
+            'upload_workers': int(os.getenv('IMAGE_UPLOAD_WORKERS', 4)),
         }
 
         app.config['EMAIL_CONFIG'] = {
@@ -50,6 +68,38 @@ def create_app():
             'sender_name': os.getenv('EMAIL_SENDER_NAME', 'نقطة وصل')
         }
 
+        app.config['AUTH_CACHE_CONFIG'] = {
+            'ttl': int(os.getenv('AUTH_CACHE_TTL', 30)),
+            'max_size': int(os.getenv('AUTH_CACHE_MAX_SIZE', 10000))
+        }
+
+        app.config['SEARCH_BACKEND'] = os.getenv('SEARCH_BACKEND', 'auto')
+
+        app.config['HOMEPAGE_CACHE_CONFIG'] = {
+            'ttl': int(os.getenv('HOMEPAGE_CACHE_TTL', 300))
+        }
+
+        app.config['IMAGE_QUEUE_CONFIG'] = {
+            'poll_interval': float(os.getenv('IMAGE_QUEUE_POLL_INTERVAL', 30)),
+            'batch_size': int(os.getenv('IMAGE_QUEUE_BATCH_SIZE', 20)),
+            'max_attempts': int(os.getenv('IMAGE_QUEUE_MAX_ATTEMPTS', 8)),
+            'retry_delay': int(os.getenv('IMAGE_QUEUE_RETRY_DELAY', 60))
+        }
+
+        app.config['REALTIME_CONFIG'] = {
+            # local: داخل العملية فقط، أو رابط طابور رسائل (مثل redis://localhost:6379/0) عند تشغيل عدة عمليات
+            'message_queue': os.getenv('SOCKETIO_MESSAGE_QUEUE', 'local'),
+            'channel': os.getenv('SOCKETIO_CHANNEL', 'flask-socketio'),
+            'async_mode': os.getenv('SOCKETIO_ASYNC_MODE'),
+            'cors_allowed_origins': os.getenv('SOCKETIO_CORS_ORIGINS')
+        }
+
+        app.config['VIEW_COUNTER_CONFIG'] = {
+            'flush_interval': float(os.getenv('VIEW_COUNTER_FLUSH_INTERVAL', 5)),
+            'dedup_window': int(os.getenv('VIEW_COUNTER_DEDUP_WINDOW', 1800)),
+            'max_viewers': int(os.getenv('VIEW_COUNTER_MAX_VIEWERS', 100000))
+        }
+
 
         if not app.debug:
             handler = logging.StreamHandler()
@@ -100,6 +150,20 @@ def create_app():
         migrate.init_app(app, db)
         csrf.init_app(app)
 
+        from . import identity, homepage, counters
+        identity.init_app(app)
+        homepage.init_app(app)
+        counters.init_app(app)
+
+        from .view_counter import view_counter
+        view_counter.init_app(app)
+
+        from .image_queue import image_queue
+        image_queue.init_app(app)
+
+        from .realtime import init_realtime
+        init_realtime(app)
+
 
         from .context_processors import format_price, time_since, get_condition_name, format_date, action_badge_class, action_name, entity_type_name
         app.jinja_env.filters['format_price'] = format_price
@@ -114,7 +178,7 @@ def create_app():
         from .image_service import ImageService
         
         @app.template_filter('image_url')
-        def image_url_filter(image_id, default=None, folder='uploads'):
+        def image_url_filter(image_id, default=None, folder='uploads', size=None):
             """مرشح لعرض روابط الصور في القوالب"""
             if not default:
                 if folder == 'users':
@@ -123,6 +187,12 @@ def create_app():
                     default = app.config['IMAGES_CONFIG']['default_product']
             
 
+            # المسار السريع: كائن ProductImage أو User يحمل الرابط المخزن عند الرفع
+            if image_id is not None and not isinstance(image_id, str):
+                stored_url, image_id = ImageService.stored_image_url(image_id)
+                if stored_url and (not size or not image_id):
+                    return stored_url
+
             if not image_id:
                 app.logger.debug(f"image_url_filter: معرف صورة فارغ، استخدام الافتراضي: {default}")
                 return default
@@ -135,7 +205,7 @@ def create_app():
                 return image_id
             
          
-            url = ImageService.get_image_url(image_id, default, folder)
+            url = ImageService.get_image_url(image_id, default, folder, size)
             app.logger.debug(f"image_url_filter: URL الناتج: {url}")
             return url
         
@@ -154,6 +224,18 @@ def create_app():
 
             db.create_all()
 
+            from .search import init_search
+            init_search(app)
+
+            from .ratings import init_ratings
+            init_ratings(app)
+
+            from .conversations import init_conversations
+            init_conversations(app)
+
+            from .unread import init_unread
+            init_unread(app)
+
             from .routes import register_blueprints
             register_blueprints(app)
 
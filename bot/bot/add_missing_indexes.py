@@ -0,0 +1,47 @@
+import os
+import sys
+import traceback
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+try:
+
+    from bot import create_app, db
+    from sqlalchemy import inspect
+
+    print("إنشاء تطبيق Flask...")
+    app = create_app()
+
+    if app is None:
+        print("خطأ: create_app() أرجعت None")
+        sys.exit(1)
+
+    with app.app_context():
+        # db.create_all() لا يضيف الفهارس الجديدة إلى الجداول الموجودة مسبقاً، مثل
+        # product_image.cloudflare_id و user.profile_image و ix_message_conversation
+        inspector = inspect(db.engine)
+        existing_tables = set(inspector.get_table_names())
+        created = 0
+
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in sorted(table.indexes, key=lambda index: index.name):
+                if index.name in existing_indexes:
+                    continue
+
+                print(f"إنشاء الفهرس {index.name} على جدول {table.name}...")
+                index.create(db.engine, checkfirst=True)
+                created += 1
+
+        if created:
+            print(f"تم إنشاء {created} فهرس بنجاح!")
+        else:
+            print("كل الفهارس موجودة بالفعل، لا حاجة للإضافة.")
+
+except Exception as e:
+    print(f"خطأ: {str(e)}")
+    traceback.print_exc()
+    sys.exit(1)
@@ -0,0 +1,44 @@
+import os
+import sys
+import traceback
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+try:
+
+    from bot import create_app, db
+    from sqlalchemy import inspect, text
+
+    print("إنشاء تطبيق Flask...")
+    app = create_app()
+
+    if app is None:
+        print("خطأ: create_app() أرجعت None")
+        sys.exit(1)
+
+    with app.app_context():
+        inspector = inspect(db.engine)
+
+        for table_name in ('product', 'user'):
+            column_names = [col['name'] for col in inspector.get_columns(table_name)]
+
+            if 'search_text' in column_names:
+                print(f"العمود search_text موجود بالفعل في جدول {table_name}، لا حاجة للإضافة.")
+                continue
+
+            print(f"إضافة عمود search_text إلى جدول {table_name}...")
+            with db.engine.begin() as connection:
+                connection.execute(text(f'ALTER TABLE "{table_name}" ADD COLUMN search_text TEXT'))
+            print("تم إضافة العمود بنجاح!")
+
+        from bot.search import init_search, rebuild_search_index
+
+        print("حساب النصوص الموحدة وإعادة بناء فهرس البحث...")
+        init_search(app)
+        rebuild_search_index()
+        print("تم تحديث فهرس البحث بنجاح.")
+
+except Exception as e:
+    print(f"خطأ: {str(e)}")
+    traceback.print_exc()
+    sys.exit(1)
@@ -0,0 +1,274 @@
+import io
+import json
+import os
+import random
+import threading
+import time
+import uuid
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app
+
+
+# رموز الحالة التي تستحق إعادة المحاولة: تجاوز الحد وأخطاء الخادم المؤقتة
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# رموز الحالة التي تضمن أن الخادم لم ينفذ الطلب، فتصلح لإعادة الطلبات غير المتكررة الأثر (مثل الرفع)
+NOT_PROCESSED_STATUSES = {429}
+
+
+class MultipartFileStream:
+    """جسم multipart/form-data يُقرأ من الملف على أجزاء أثناء الإرسال بدلاً من بنائه كاملاً في الذاكرة"""
+
+    def __init__(self, fileobj, filename, content_type, fields=None):
+        boundary = uuid.uuid4().hex
+        head = b''.join(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8')
+            for name, value in (fields or {}).items()
+        )
+        head += (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'
+        ).encode('utf-8')
+        tail = f'\r\n--{boundary}--\r\n'.encode('utf-8')
+
+        fileobj.seek(0, os.SEEK_END)
+        file_size = fileobj.tell()
+
+        self.content_type = f'multipart/form-data; boundary={boundary}'
+        self._parts = [io.BytesIO(head), fileobj, io.BytesIO(tail)]
+        self._length = len(head) + file_size + len(tail)
+        self.rewind()
+
+    def __len__(self):
+        return self._length
+
+    def rewind(self):
+        """العودة إلى بداية الجسم لإعادة إرساله في محاولة جديدة"""
+        for part in self._parts:
+            part.seek(0)
+        self._current = 0
+
+    def read(self, size=-1):
+        chunks = []
+        while self._current < len(self._parts) and size != 0:
+            chunk = self._parts[self._current].read(size)
+            if not chunk:
+                self._current += 1
+                continue
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b''.join(chunks)
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(64 * 1024)
+            if not chunk:
+                return
+            yield chunk
+
+
+class CloudflareImagesClient:
+    """عميل Cloudflare Images بجلسة HTTP مشتركة (keep-alive)، مع مهلة لكل طلب وإعادة محاولة ومقاييس"""
+
+    def __init__(self, account_id, api_token, base_url='https://api.cloudflare.com/client/v4',
+                 connect_timeout=5, read_timeout=30, max_retries=3, backoff=0.5, max_backoff=30,
+                 pool_size=10, logger=None):
+        self.account_id = account_id
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.logger = logger
+
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = f'Bearer {api_token}'
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._metrics = {}
+        self._metrics_lock = threading.Lock()
+
+    @property
+    def images_url(self):
+        return f'{self.base_url}/accounts/{self.account_id}/images/v1'
+
+    def _record(self, operation, latency, error=False, retry=False):
+        with self._metrics_lock:
+            metrics = self._metrics.setdefault(operation, {
+                'calls': 0, 'errors': 0, 'retries': 0, 'total_latency': 0.0, 'max_latency': 0.0
+            })
+            metrics['calls'] += 1
+            metrics['errors'] += int(error)
+            metrics['retries'] += int(retry)
+            metrics['total_latency'] += latency
+            metrics['max_latency'] = max(metrics['max_latency'], latency)
+
+    def metrics(self):
+        """ملخص المقاييس لكل عملية: عدد الطلبات ونسبة الأخطاء ومتوسط وأقصى زمن استجابة (بالثواني)"""
+        with self._metrics_lock:
+            return {
+                operation: {
+                    'calls': metrics['calls'],
+                    'errors': metrics['errors'],
+                    'retries': metrics['retries'],
+                    'error_rate': metrics['errors'] / metrics['calls'] if metrics['calls'] else 0,
+                    'avg_latency': metrics['total_latency'] / metrics['calls'] if metrics['calls'] else 0,
+                    'max_latency': metrics['max_latency'],
+                }
+                for operation, metrics in self._metrics.items()
+            }
+
+    def _delay(self, attempt, response=None):
+        """مهلة الانتظار قبل المحاولة التالية: Retry-After إن وجد، وإلا تراجع أسي مع عشوائية كاملة، وبحد أقصى max_backoff"""
+        if response is not None and response.headers.get('Retry-After'):
+            try:
+                return min(max(float(response.headers['Retry-After']), 0), self.max_backoff)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff * (2 ** attempt), self.max_backoff))
+
+    @staticmethod
+    def _should_retry(response, exception, idempotent):
+        """هل تصلح إعادة الطلب؟ الطلبات غير المتكررة الأثر لا تُعاد إلا إذا كان مؤكداً أن الخادم لم ينفذها"""
+        if idempotent:
+            return response is None or response.status_code in RETRY_STATUSES
+        if response is None:
+            # ReadTimeout يعني أن الطلب ربما وصل ونُفذ؛ فشل الاتصال نفسه يعني أنه لم يُرسل
+            return isinstance(exception, requests.ConnectionError)
+        return response.status_code in NOT_PROCESSED_STATUSES
+
+    def request(self, operation, method, url, rewind=None, idempotent=True, **kwargs):
+        """تنفيذ طلب مع إعادة المحاولة عند أخطاء الاتصال أو 429/5xx، وإرجاع الاستجابة الأخيرة أو None
+
+        rewind: دالة تُستدعى قبل كل محاولة لإرجاع جسم الطلب المتدفق إلى بدايته.
+        idempotent: False للطلبات التي قد تُنفذ مرتين عند إعادتها (مثل الرفع)، فلا تُعاد بعد انتهاء مهلة
+        القراءة أو أخطاء 5xx، بل فقط عند فشل الاتصال أو 429.
+        """
+        response = None
+
+        for attempt in range(self.max_retries + 1):
+            if rewind is not None:
+                rewind()
+            started = time.perf_counter()
+            exception = None
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+                error = response.status_code >= 400
+            except requests.RequestException as e:
+                response, error, exception = None, True, e
+                if self.logger:
+                    self.logger.warning(f"خطأ اتصال مع Cloudflare ({operation}): {str(e)}")
+
+            retry = attempt < self.max_retries and self._should_retry(response, exception, idempotent)
+            self._record(operation, time.perf_counter() - started, error=error, retry=retry)
+
+            if not retry:
+                return response
+
+            time.sleep(self._delay(attempt, response))
+
+        return response
+
+    def upload(self, image_id, file_data, filename=None, content_type='image/jpeg'):
+        """رفع صورة وإرجاع نتيجة Cloudflare (result) أو None"""
+        response = self.request(
+            'upload', 'POST', self.images_url,
+            idempotent=False,
+            files={'file': (filename or f'{image_id}.jpg', file_data, content_type)},
+            data={'metadata': json.dumps({'id': image_id})}
+        )
+        return self._upload_result(response)
+
+    def upload_stream(self, image_id, stream, filename, content_type='image/jpeg'):
+        """رفع صورة من ملف مفتوح على أجزاء، دون تحميل محتواه في الذاكرة"""
+        body = MultipartFileStream(stream, filename, content_type, {'metadata': json.dumps({'id': image_id})})
+        response = self.request(
+            'upload', 'POST', self.images_url,
+            rewind=body.rewind,
+            idempotent=False,
+            data=body,
+            headers={'Content-Type': body.content_type}
+        )
+        return self._upload_result(response)
+
+    def _upload_result(self, response):
+        """نتيجة Cloudflare (result) من استجابة الرفع أو None"""
+        if response is None or response.status_code != 200:
+            if self.logger and response is not None:
+                self.logger.error(f"استجابة Cloudflare غير ناجحة للرفع: {response.status_code} - {response.text}")
+            return None
+
+        result = response.json()
+        if not result.get('success'):
+            if self.logger:
+                self.logger.error(f"استجابة Cloudflare غير ناجحة: {result}")
+            return None
+
+        return result.get('result', {})
+
+    def delete(self, image_id):
+        """حذف صورة، مع اعتبار الصورة غير الموجودة (404) محذوفة"""
+        response = self.request('delete', 'DELETE', f'{self.images_url}/{image_id}')
+
+        if response is None:
+            return False
+        if response.status_code == 404:
+            return True
+        if response.status_code != 200:
+            if self.logger:
+                self.logger.warning(f"استجابة Cloudflare حذف الصورة: {response.status_code} - {response.text}")
+            return False
+
+        return bool(response.json().get('success'))
+
+    def list_images(self, per_page=1000):
+        """كل الصور في الحساب، مقروءة صفحة بصفحة باستخدام continuation_token"""
+        url = f'{self.base_url}/accounts/{self.account_id}/images/v2'
+        params = {'per_page': per_page}
+
+        while True:
+            response = self.request('list', 'GET', url, params=params)
+            if response is None or response.status_code != 200:
+                raise RuntimeError(
+                    f"تعذر قراءة قائمة صور Cloudflare: {response.status_code if response is not None else 'no response'}"
+                )
+
+            result = response.json().get('result') or {}
+            yield from result.get('images', [])
+
+            token = result.get('continuation_token')
+            if not token:
+                return
+            params = {'per_page': per_page, 'continuation_token': token}
+
+    def exists(self, image_url):
+        """التحقق من توفر الصورة على رابط التوزيع، وإرجاع None عند تعذر الاتصال"""
+        response = self.request('head', 'HEAD', image_url)
+        return None if response is None else response.status_code == 200
+
+
+def get_cloudflare_client(app=None):
+    """العميل المشترك للتطبيق، أو None إذا لم يكن Cloudflare مكوّناً"""
+    app = app or current_app._get_current_object()
+
+    if 'cloudflare_client' not in app.extensions:
+        config = app.config.get('CLOUDFLARE_CONFIG', {})
+        client = None
+        if config.get('account_id') and config.get('api_token'):
+            client = CloudflareImagesClient(
+                config['account_id'],
+                config['api_token'],
+                base_url=config.get('api_url') or 'https://api.cloudflare.com/client/v4',
+                connect_timeout=config.get('connect_timeout', 5),
+                read_timeout=config.get('read_timeout', 30),
+                max_retries=config.get('max_retries', 3),
+                max_backoff=config.get('max_backoff', 30),
+                logger=app.logger
+            )
+        app.extensions['cloudflare_client'] = client
+
+    return app.extensions['cloudflare_client']
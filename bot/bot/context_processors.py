@@ -184,46 +184,9 @@ def entity_type_name(entity_type):
 def inject_common_data():
     """حقن البيانات المشتركة لجميع القوالب"""
 
-    if not hasattr(g, 'current_user'):
-        token = None
-        if 'auth_token' in session:
-            token = session['auth_token']
-        elif 'Authorization' in request.headers:
-            auth_header = request.headers['Authorization']
-            if auth_header.startswith('Bearer '):
-                token = auth_header.split(' ')[1]
-        
-        if token:
-            try:
-                import jwt
-                from .models import User
-                data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
-                user = User.query.get(data['user_id'])
-                
-                if user and not user.is_banned:
-                    g.current_user = user
-                    return {
-                        'now': datetime.utcnow(),
-                        'request': request,
-                        'current_user': user,
-                        'format_price': format_price,
-                        'time_since': time_since,
-                        'get_condition_name': get_condition_name,
-                        'format_date': format_date,
-                        'url_for_with_args': url_for_with_args
-                    }
-            except:
-                pass
-        
-
-        g.current_user = type('AnonymousUser', (), {
-            'is_authenticated': False,
-            'id': None,
-            'is_admin': False,
-            'name': 'زائر',
-            'profile_image': None,
-            'location': None
-        })()
+    if not hasattr(g, 'current_user') or g.current_user is None:
+        from .identity import load_current_user
+        g.current_user = load_current_user()
     
     return {
         'now': datetime.utcnow(),
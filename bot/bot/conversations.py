@@ -0,0 +1,188 @@
+from sqlalchemy import case, event, func, or_
+from sqlalchemy.orm import Session, joinedload
+from . import db
+from .upsert import upsert
+
+
+def conversation_key(user_id, other_user_id, product_id=None):
+    """مفتاح المحادثة (user_low_id, user_high_id, product_key) بغض النظر عن اتجاه الرسالة"""
+    return min(user_id, other_user_id), max(user_id, other_user_id), product_id or 0
+
+
+def upsert_conversation(connection, key, values, insert_values=None):
+    """تحديث صف المحادثة بالقيم المعطاة، أو إنشاؤه بـ insert_values (أو values) إذا لم يكن موجوداً"""
+    from .models import Conversation
+
+    user_low_id, user_high_id, product_key = key
+    upsert(
+        connection, Conversation.__table__,
+        {'user_low_id': user_low_id, 'user_high_id': user_high_id, 'product_key': product_key},
+        values, insert_values
+    )
+
+
+def _message_key(message):
+    return conversation_key(message.sender_id, message.receiver_id, message.product_id)
+
+
+@event.listens_for(Session, 'before_flush')
+def remove_deleted_users_conversations(session, flush_context, instances):
+    """يجب حذف محادثات المستخدم قبل حذف المستخدم نفسه بسبب المفتاح الأجنبي"""
+    from .models import Conversation, User
+
+    deleted_users = {obj.id for obj in session.deleted if isinstance(obj, User)}
+    if not deleted_users:
+        return
+
+    table = Conversation.__table__
+    session.connection().execute(
+        table.delete().where(or_(table.c.user_low_id.in_(deleted_users), table.c.user_high_id.in_(deleted_users)))
+    )
+
+
+@event.listens_for(Session, 'after_flush')
+def track_last_messages(session, flush_context):
+    """تحديث آخر رسالة ووقت آخر نشاط للمحادثات التي أضيفت إليها رسائل أو حذفت منها"""
+    from .models import Conversation, Message, User
+
+    deleted_users = {obj.id for obj in session.deleted if isinstance(obj, User)}
+    latest = {}
+    removed = set()
+
+    for message in session.new:
+        if isinstance(message, Message):
+            key = _message_key(message)
+            if key[0] in deleted_users or key[1] in deleted_users:
+                continue
+            if key not in latest or message.id > latest[key].id:
+                latest[key] = message
+
+    for message in session.deleted:
+        if isinstance(message, Message):
+            key = _message_key(message)
+            if key[0] not in deleted_users and key[1] not in deleted_users:
+                removed.add(key)
+
+    if not latest and not removed:
+        return
+
+    table = Conversation.__table__
+    connection = session.connection()
+
+    for key, message in latest.items():
+        upsert_conversation(connection, key, {
+            'last_message_id': message.id,
+            'last_activity_at': message.created_at
+        })
+
+    # حذف رسائل من المحادثة: إعادة حساب آخر رسالة من الرسائل المتبقية
+    for key in removed - set(latest):
+        user_low_id, user_high_id, product_key = key
+        last = connection.execute(
+            db.select(Message.__table__.c.id, Message.__table__.c.created_at)
+            .where(_key_filter(Message.__table__, key))
+            .order_by(Message.__table__.c.id.desc())
+            .limit(1)
+        ).first()
+
+        where = (
+            (table.c.user_low_id == user_low_id)
+            & (table.c.user_high_id == user_high_id)
+            & (table.c.product_key == product_key)
+        )
+        if last is None:
+            connection.execute(table.delete().where(where))
+        else:
+            connection.execute(table.update().where(where).values(
+                last_message_id=last.id, last_activity_at=last.created_at
+            ))
+
+
+def _key_filter(message_table, key):
+    user_low_id, user_high_id, product_key = key
+    return (
+        or_(
+            (message_table.c.sender_id == user_low_id) & (message_table.c.receiver_id == user_high_id),
+            (message_table.c.sender_id == user_high_id) & (message_table.c.receiver_id == user_low_id)
+        )
+        & (func.coalesce(message_table.c.product_id, 0) == product_key)
+    )
+
+
+def get_inbox(user_id):
+    """محادثات المستخدم مرتبة حسب آخر نشاط، مع تحميل الطرف الآخر والمنتج وآخر رسالة مسبقاً"""
+    from .models import Conversation, Product
+
+    rows = Conversation.query.filter(
+        or_(Conversation.user_low_id == user_id, Conversation.user_high_id == user_id),
+        Conversation.last_message_id.isnot(None)
+    ).options(
+        joinedload(Conversation.user_low),
+        joinedload(Conversation.user_high),
+        joinedload(Conversation.last_message),
+        joinedload(Conversation.product).selectinload(Product.images)
+    ).order_by(Conversation.last_activity_at.desc()).all()
+
+    inbox = []
+    for conversation in rows:
+        is_low = conversation.user_low_id == user_id
+        inbox.append({
+            'other_user': conversation.user_high if is_low else conversation.user_low,
+            'last_message': conversation.last_message,
+            'unread_count': max(conversation.unread_low if is_low else conversation.unread_high, 0),
+            'product': conversation.product
+        })
+    return inbox
+
+
+def rebuild_conversations():
+    """إعادة بناء جدول المحادثات بالكامل من جدول الرسائل، مع إرجاع عدد المحادثات"""
+    from .models import Conversation, Message
+
+    user_low = func.min(Message.sender_id, Message.receiver_id)
+    user_high = func.max(Message.sender_id, Message.receiver_id)
+    if db.engine.dialect.name != 'sqlite':
+        user_low = func.least(Message.sender_id, Message.receiver_id)
+        user_high = func.greatest(Message.sender_id, Message.receiver_id)
+    product_key = func.coalesce(Message.product_id, 0)
+
+    grouped = db.session.query(
+        user_low.label('user_low_id'),
+        user_high.label('user_high_id'),
+        product_key.label('product_key'),
+        func.max(Message.id).label('last_message_id'),
+        func.sum(case(((Message.is_read == False) & (Message.receiver_id == user_low), 1), else_=0)),
+        func.sum(case(((Message.is_read == False) & (Message.receiver_id == user_high), 1), else_=0))
+    ).group_by(user_low, user_high, product_key).all()
+
+    last_ids = [row.last_message_id for row in grouped]
+    created_at = dict(
+        db.session.query(Message.id, Message.created_at).filter(Message.id.in_(last_ids))
+    ) if last_ids else {}
+
+    with db.engine.begin() as connection:
+        connection.execute(Conversation.__table__.delete())
+        if grouped:
+            connection.execute(Conversation.__table__.insert(), [
+                {
+                    'user_low_id': user_low_id,
+                    'user_high_id': user_high_id,
+                    'product_key': key,
+                    'last_message_id': last_message_id,
+                    'last_activity_at': created_at.get(last_message_id),
+                    'unread_low': int(unread_low or 0),
+                    'unread_high': int(unread_high or 0)
+                }
+                for user_low_id, user_high_id, key, last_message_id, unread_low, unread_high in grouped
+            ])
+
+    return len(grouped)
+
+
+def init_conversations(app):
+    """ملء جدول المحادثات عند أول تشغيل بعد إضافته إذا كانت هناك رسائل سابقة"""
+    from .models import Conversation, Message
+
+    if Conversation.query.first() is None and Message.query.first() is not None:
+        count = rebuild_conversations()
+        app.logger.info(f"تم بناء ملخص {count} محادثة")
@@ -0,0 +1,179 @@
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from . import db
+
+
+# كل عداد: اسم النموذج وشروط الحقول التي يجب أن يحققها الصف ليُحسب
+COUNTERS = {
+    'users': ('User', {}),
+    'online_users': ('User', {'is_online': True}),
+    'products': ('Product', {}),
+    'active_products': ('Product', {'is_active': True}),
+    'sold_products': ('Product', {'is_sold': True}),
+    'reports': ('Report', {}),
+    'pending_reports': ('Report', {'status': 'pending'}),
+}
+
+
+def _models():
+    from . import models
+    return {name: getattr(models, name) for name in {model for model, _ in COUNTERS.values()}}
+
+
+def _tracked_fields(model_name):
+    return {field for model, filters in COUNTERS.values() if model == model_name for field in filters}
+
+
+def _matches(values, filters):
+    return values is not None and all(values.get(field) == expected for field, expected in filters.items())
+
+
+def _committed_values(obj, fields):
+    """قيم الحقول كما هي في قاعدة البيانات قبل تعديلات هذه الجلسة"""
+    state = db.inspect(obj)
+    values = {}
+    for field in fields:
+        history = state.attrs[field].history
+        if history.has_changes():
+            values[field] = history.deleted[0] if history.deleted else None
+        else:
+            values[field] = state.dict.get(field)
+    return values
+
+
+def _current_values(obj, fields):
+    return {field: getattr(obj, field) for field in fields}
+
+
+def collect_deltas(session):
+    """حساب التغير في كل عداد من الكائنات المضافة والمحذوفة والمعدلة في الدفعة الحالية"""
+    models = _models()
+    deltas = {}
+
+    def count(model_name, before, after):
+        for name, (counter_model, filters) in COUNTERS.items():
+            if counter_model != model_name:
+                continue
+            delta = int(_matches(after, filters)) - int(_matches(before, filters))
+            if delta:
+                deltas[name] = deltas.get(name, 0) + delta
+
+    for objects, has_before, has_after in (
+        (session.new, False, True),
+        (session.deleted, True, False),
+        (session.dirty, True, True),
+    ):
+        for obj in objects:
+            model_name = type(obj).__name__
+            if model_name not in models:
+                continue
+
+            fields = _tracked_fields(model_name)
+            if has_before and has_after and not (fields and session.is_modified(obj)):
+                continue
+
+            count(
+                model_name,
+                _committed_values(obj, fields) if has_before else None,
+                _current_values(obj, fields) if has_after else None
+            )
+
+    return deltas
+
+
+@event.listens_for(Session, 'before_flush')
+def load_tracked_fields(session, flush_context, instances):
+    """تحميل الحقول المتتبعة غير المحملة (مثل المنتهية بعد commit) للكائنات المحذوفة والمعدلة قبل الحفظ
+
+    بعد الحفظ تكون الصفوف المحذوفة قد أزيلت، فلا يمكن معرفة قيمها السابقة عند حساب الفروق.
+    """
+    models = _models()
+    for obj in list(session.deleted) + list(session.dirty):
+        model_name = type(obj).__name__
+        if model_name not in models:
+            continue
+
+        state = db.inspect(obj)
+        if state.key is None:
+            continue
+        for field in _tracked_fields(model_name) & state.unloaded:
+            getattr(obj, field)
+
+
+@event.listens_for(Session, 'after_flush')
+def apply_counter_deltas(session, flush_context):
+    """تحديث العدادات داخل نفس المعاملة، فتُحفظ أو تُلغى مع التغيير الذي سببها"""
+    from .models import SiteCounter
+
+    deltas = collect_deltas(session)
+    if not deltas:
+        return
+
+    table = SiteCounter.__table__
+    connection = session.connection()
+    for name, delta in deltas.items():
+        connection.execute(
+            table.update()
+            .where(table.c.name == name)
+            .values(value=table.c.value + delta, updated_at=datetime.utcnow())
+        )
+
+
+def _noop(target, value, oldvalue, initiator):
+    pass
+
+
+def init_app(app):
+    """تفعيل active_history على الحقول المتتبعة لتكون قيمها السابقة معروفة دائماً عند التعديل"""
+    for model_name, model in _models().items():
+        for field in _tracked_fields(model_name):
+            attribute = getattr(model, field)
+            if not event.contains(attribute, 'set', _noop):
+                event.listen(attribute, 'set', _noop, active_history=True)
+
+
+def compute_counters():
+    """حساب كل العدادات من الجداول مباشرة"""
+    models = _models()
+    return {
+        name: models[model_name].query.filter_by(**filters).count()
+        for name, (model_name, filters) in COUNTERS.items()
+    }
+
+
+def rebuild_counters():
+    """إعادة حساب العدادات وكتابتها في جدول site_counter"""
+    from .models import SiteCounter
+
+    values = compute_counters()
+    table = SiteCounter.__table__
+    now = datetime.utcnow()
+
+    with db.engine.begin() as connection:
+        connection.execute(table.delete())
+        connection.execute(table.insert(), [
+            {'name': name, 'value': value, 'updated_at': now}
+            for name, value in values.items()
+        ])
+
+    return values
+
+
+def get_counters():
+    """قراءة العدادات المخزنة في استعلام واحد، مع بنائها عند أول استخدام"""
+    from .models import SiteCounter
+
+    counters = dict(db.session.query(SiteCounter.name, SiteCounter.value).all())
+
+    if any(name not in counters for name in COUNTERS):
+        current_app.logger.info("جدول العدادات غير مكتمل، جاري إعادة بنائه")
+        try:
+            counters = rebuild_counters()
+        except IntegrityError:
+            # عملية أخرى أعادت بناءه في نفس اللحظة
+            counters = dict(db.session.query(SiteCounter.name, SiteCounter.value).all())
+
+    return counters
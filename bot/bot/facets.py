@@ -0,0 +1,135 @@
+from sqlalchemy import func, case, and_
+from .cache import TTLCache
+
+
+# عدادات الفلاتر لكل استعلام بحث موحد، مشتركة بين الصفحة الرئيسية وصفحة البحث
+facet_cache = TTLCache(max_size=2000, ttl=60)
+
+# شرائح الأسعار بالليرة السورية (الحد الأدنى، الحد الأعلى)
+PRICE_BUCKETS = [
+    (0, 100000),
+    (100000, 500000),
+    (500000, 1000000),
+    (1000000, 5000000),
+    (5000000, 25000000),
+    (25000000, None),
+]
+
+
+def price_bucket_expression(price_column):
+    """عبارة CASE تعيد رقم شريحة السعر لكل منتج"""
+    whens = [
+        (price_column < upper, index)
+        for index, (lower, upper) in enumerate(PRICE_BUCKETS)
+        if upper is not None
+    ]
+    return case(*whens, else_=len(PRICE_BUCKETS) - 1)
+
+
+def facet_conditions(filters):
+    """شروط الفلاتر المختارة لكل عداد، بنفس الحدود المستخدمة في البحث (min_price <= السعر <= max_price)"""
+    from .models import Product
+
+    conditions = {}
+    if filters.get('category_id'):
+        conditions['categories'] = Product.category_id == filters['category_id']
+    if filters.get('location'):
+        conditions['locations'] = Product.location == filters['location']
+    if filters.get('condition'):
+        conditions['conditions'] = Product.condition.in_(filters['condition'])
+
+    price = []
+    if filters.get('min_price') is not None:
+        price.append(Product.price >= filters['min_price'])
+    if filters.get('max_price') is not None:
+        price.append(Product.price <= filters['max_price'])
+    if price:
+        conditions['price_buckets'] = and_(*price)
+
+    return conditions
+
+
+def apply_facet_filters(query, filters):
+    """تطبيق فلاتر التصنيف والموقع والحالة والسعر على استعلام البحث"""
+    return query.filter(*facet_conditions(filters).values())
+
+
+def facet_cache_key(filters):
+    """مفتاح موحد لفلاتر البحث بحيث تتشارك الاستعلامات المتكافئة نفس العدادات"""
+    from .text_normalization import build_search_text
+
+    key = []
+    for name, value in filters.items():
+        if name == 'q':
+            value = build_search_text(value or '')
+        elif isinstance(value, (list, tuple)):
+            value = tuple(sorted(str(item) for item in value))
+        elif value is not None and not isinstance(value, bool):
+            value = str(value)
+
+        if value not in (None, '', (), False):
+            key.append((name, value))
+
+    return tuple(sorted(key))
+
+
+def compute_facets(query, filters=None):
+    """حساب عدد المنتجات لكل تصنيف وموقع وحالة وشريحة سعر في استعلام مجمّع واحد
+
+    query هو استعلام البحث بدون فلاتر facet_conditions؛ كل عداد يُحسب مع باقي الفلاتر دون فلتره هو،
+    فتبقى خيارات نفس الفلتر ظاهرة بأعدادها بعد اختيار أحدها.
+    """
+    from .models import Product
+
+    conditions = facet_conditions(filters or {})
+    names = list(conditions)
+
+    bucket = price_bucket_expression(Product.price).label('price_bucket')
+    # السعر المساوي لحد أعلى يظهر أيضاً في رابط الشريحة السابقة (max_price شامل)، فيُحسب فيها كذلك
+    on_boundary = Product.price.in_([upper for lower, upper in PRICE_BUCKETS if upper is not None]).label('on_boundary')
+    flags = [condition.label(f'{name}_filter') for name, condition in conditions.items()]
+    columns = [Product.category_id, Product.location, Product.condition, bucket, on_boundary, *flags]
+
+    rows = query.order_by(None).with_entities(*columns, func.count(Product.id)).group_by(*columns).all()
+
+    facets = {
+        'total': 0,
+        'categories': {},
+        'locations': {},
+        'conditions': {},
+        'price_buckets': [
+            {'min_price': lower, 'max_price': upper, 'count': 0}
+            for lower, upper in PRICE_BUCKETS
+        ]
+    }
+
+    for category_id, location, condition, bucket_index, boundary, *row_flags, count in rows:
+        failed = {name for name, matched in zip(names, row_flags) if not matched}
+
+        if not failed:
+            facets['total'] += count
+        if not failed - {'categories'}:
+            facets['categories'][category_id] = facets['categories'].get(category_id, 0) + count
+        if not failed - {'locations'}:
+            facets['locations'][location] = facets['locations'].get(location, 0) + count
+        if not failed - {'conditions'}:
+            facets['conditions'][condition] = facets['conditions'].get(condition, 0) + count
+        if not failed - {'price_buckets'}:
+            facets['price_buckets'][bucket_index]['count'] += count
+            if boundary and bucket_index > 0:
+                facets['price_buckets'][bucket_index - 1]['count'] += count
+
+    return facets
+
+
+def get_facets(query, filters):
+    """إرجاع عدادات الفلاتر من الذاكرة المؤقتة أو حسابها مرة واحدة
+
+    query هو استعلام البحث قبل apply_facet_filters.
+    """
+    key = facet_cache_key(filters)
+    facets = facet_cache.get(key)
+    if facets is None:
+        facets = compute_facets(query, filters)
+        facet_cache.set(key, facets)
+    return facets
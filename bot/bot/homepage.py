@@ -0,0 +1,173 @@
+from sqlalchemy import event
+from sqlalchemy.orm import Session, selectinload
+from .cache import TTLCache
+
+
+# بيانات الصفحة الرئيسية (بدون أي بيانات خاصة بالمستخدم)، تُبنى مرة واحدة وتُلغى عند تغير المنتجات أو المستخدمين
+homepage_cache = TTLCache(max_size=1, ttl=300)
+HOMEPAGE_KEY = 'homepage'
+
+# يزداد مع كل إلغاء حتى لا تُخزن نسخة بُنيت قبل الإلغاء واكتملت بعده
+_generation = 0
+
+# الحقول الظاهرة في الصفحة الرئيسية، أي تعديل عليها يلغي النسخة المخزنة
+PRODUCT_FIELDS = ('title', 'price', 'currency', 'location', 'is_active', 'is_sold', 'is_featured', 'created_at')
+CATEGORY_FIELDS = ('name', 'slug', 'parent_id')
+
+SYRIAN_LOCATIONS = [
+    {'id': 'damascus', 'name': 'دمشق'},
+    {'id': 'aleppo', 'name': 'حلب'},
+    {'id': 'homs', 'name': 'حمص'},
+    {'id': 'latakia', 'name': 'اللاذقية'},
+    {'id': 'tartus', 'name': 'طرطوس'},
+    {'id': 'hama', 'name': 'حماة'},
+    {'id': 'daraa', 'name': 'درعا'},
+    {'id': 'idlib', 'name': 'إدلب'},
+    {'id': 'hasaka', 'name': 'الحسكة'},
+    {'id': 'suwayda', 'name': 'السويداء'},
+    {'id': 'deir-ez-zor', 'name': 'دير الزور'},
+    {'id': 'raqqa', 'name': 'الرقة'},
+    {'id': 'quneitra', 'name': 'القنيطرة'},
+    {'id': 'rif-dimashq', 'name': 'ريف دمشق'}
+]
+POPULAR_LOCATIONS_COUNT = 14
+
+
+def init_app(app):
+    """تهيئة مدة تخزين الصفحة الرئيسية من إعدادات التطبيق"""
+    config = app.config.get('HOMEPAGE_CACHE_CONFIG', {})
+    homepage_cache.configure(ttl=config.get('ttl'))
+
+
+def product_snapshot(product):
+    """نسخة مستقلة عن الجلسة من بيانات المنتج المعروضة في بطاقة الصفحة الرئيسية"""
+    return {
+        'id': product.id,
+        'title': product.title,
+        'price': product.price,
+        'currency': product.currency,
+        'location': product.location,
+        'created_at': product.created_at,
+        'images': [
+            {'cloudflare_id': image.cloudflare_id, 'url': image.url}
+            for image in product.images[:1]
+        ]
+    }
+
+
+def build_popular_locations(location_counts):
+    """أكثر المحافظات إعلاناً، مكملة بباقي المحافظات السورية حتى 14 محافظة"""
+    names = {location['id']: location['name'] for location in SYRIAN_LOCATIONS}
+
+    popular_locations = sorted(
+        [
+            {'id': location, 'name': names.get(location, location), 'count': count}
+            for location, count in location_counts.items()
+        ],
+        key=lambda location: location['count'],
+        reverse=True
+    )[:POPULAR_LOCATIONS_COUNT]
+
+    existing_locations = {location['id'] for location in popular_locations}
+    for location in SYRIAN_LOCATIONS:
+        if len(popular_locations) >= POPULAR_LOCATIONS_COUNT:
+            break
+        if location['id'] not in existing_locations:
+            popular_locations.append({
+                'id': location['id'],
+                'name': location['name'],
+                'count': location_counts.get(location['id'], 0)
+            })
+
+    return popular_locations
+
+
+def build_homepage_data():
+    """تحميل كل بيانات الصفحة الرئيسية من قاعدة البيانات"""
+    from .models import Category, Product
+    from .facets import compute_facets
+    from .counters import get_counters
+
+    categories = [
+        {'id': category.id, 'name': category.name, 'slug': category.slug}
+        for category in Category.query.filter_by(parent_id=None).all()
+    ]
+
+    available = Product.query.filter_by(is_active=True, is_sold=False)
+
+    featured_products = available.filter_by(is_featured=True).options(
+        selectinload(Product.images)
+    ).order_by(Product.created_at.desc()).limit(4).all()
+
+    latest_products = available.options(
+        selectinload(Product.images)
+    ).order_by(Product.created_at.desc()).limit(8).all()
+
+    location_counts = compute_facets(available)['locations']
+
+    counters = get_counters()
+    stats = {
+        'users_count': counters['users'],
+        'products_count': counters['active_products'],
+        'sales_count': counters['sold_products'],
+        'regions_count': Product.query.with_entities(Product.location).distinct().count()
+    }
+
+    return {
+        'categories': categories,
+        'featured_products': [product_snapshot(product) for product in featured_products],
+        'latest_products': [product_snapshot(product) for product in latest_products],
+        'popular_locations': build_popular_locations(location_counts),
+        'site_stats': stats
+    }
+
+
+def get_homepage_data():
+    """إرجاع بيانات الصفحة الرئيسية من الذاكرة أو بناؤها مرة واحدة"""
+    data = homepage_cache.get(HOMEPAGE_KEY)
+    if data is None:
+        generation = _generation
+        data = build_homepage_data()
+        if generation == _generation:
+            homepage_cache.set(HOMEPAGE_KEY, data)
+    return data
+
+
+def invalidate_homepage():
+    global _generation
+    _generation += 1
+    homepage_cache.clear()
+
+
+def _affects_homepage(session):
+    from .models import Category, Product, ProductImage, User, _fields_changed
+
+    for obj in session.new | session.deleted:
+        if isinstance(obj, (Category, Product, ProductImage, User)):
+            return True
+
+    for obj in session.dirty:
+        if isinstance(obj, Product) and _fields_changed(obj, *PRODUCT_FIELDS):
+            return True
+        if isinstance(obj, Category) and _fields_changed(obj, *CATEGORY_FIELDS):
+            return True
+
+    return False
+
+
+@event.listens_for(Session, 'before_flush')
+def mark_homepage_changes(session, flush_context, instances):
+    """تعليم الجلسة عند تغيير منتج أو تصنيف أو تسجيل مستخدم، ليتم الإلغاء بعد نجاح الحفظ"""
+    if not session.info.get('homepage_changed') and _affects_homepage(session):
+        session.info['homepage_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_homepage_after_commit(session):
+    if session.info.pop('homepage_changed', False):
+        invalidate_homepage()
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_homepage_changes(session):
+    session.info.pop('homepage_changed', None)
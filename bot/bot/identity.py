@@ -0,0 +1,175 @@
+import time
+import jwt
+from flask import session, request, current_app
+from .cache import TTLCache
+
+
+# التوكنات المفكوكة ولقطات المستخدمين المصادَق عليهم، مشتركة بين جميع الطلبات في العملية
+token_cache = TTLCache(max_size=10000, ttl=30)
+user_cache = TTLCache(max_size=10000, ttl=30)
+
+
+class AnonymousUser:
+    """المستخدم الزائر غير المسجل، مع سبب فشل المصادقة إن وجد"""
+    is_authenticated = False
+    id = None
+    is_admin = False
+    is_banned = False
+    name = 'زائر'
+    email = None
+    profile_image = None
+    profile_image_url = None
+    avatar_url = None
+    location = None
+
+    def __init__(self, auth_error='missing_token'):
+        self.auth_error = auth_error
+
+
+class CurrentUser:
+    """هوية المستخدم الحالي المبنية على لقطة مخزنة، مع تحميل كائن User عند الحاجة فقط"""
+
+    is_authenticated = True
+    auth_error = None
+
+    def __init__(self, snapshot, user=None):
+        object.__setattr__(self, '_snapshot', snapshot)
+        object.__setattr__(self, '_user', user)
+
+    def load(self):
+        """تحميل كائن User الكامل من قاعدة البيانات (مرة واحدة لكل طلب)"""
+        if self._user is None:
+            from .models import User
+            object.__setattr__(self, '_user', User.query.get(self._snapshot['id']))
+        return self._user
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        if self._user is None:
+            if name in self._snapshot:
+                return self._snapshot[name]
+
+            from .models import User
+            if not hasattr(User, name):
+                raise AttributeError(name)
+
+        return getattr(self.load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.load(), name, value)
+
+    def __repr__(self):
+        return f"<CurrentUser {self._snapshot['id']}>"
+
+
+def init_app(app):
+    """تهيئة ذاكرة الهوية من إعدادات التطبيق"""
+    config = app.config.get('AUTH_CACHE_CONFIG', {})
+    token_cache.configure(max_size=config.get('max_size'), ttl=config.get('ttl'))
+    user_cache.configure(max_size=config.get('max_size'), ttl=config.get('ttl'))
+
+
+def get_request_token():
+    """استخراج توكن المصادقة من الجلسة أو ترويسة Authorization"""
+    if 'auth_token' in session:
+        return session['auth_token']
+
+    auth_header = request.headers.get('Authorization', '')
+    if auth_header.startswith('Bearer '):
+        return auth_header.split(' ')[1]
+
+    return None
+
+
+def decode_token(token):
+    """فك التوكن مع تخزين النتيجة مؤقتاً حتى انتهاء صلاحيتها"""
+    data = token_cache.get(token)
+    if data is not None:
+        return data
+
+    try:
+        data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
+    except jwt.InvalidTokenError:
+        return None
+
+    ttl = token_cache.ttl
+    if data.get('exp'):
+        ttl = min(ttl, data['exp'] - time.time())
+    token_cache.set(token, data, ttl)
+
+    return data
+
+
+def make_user_snapshot(user):
+    """إنشاء لقطة خفيفة لبيانات المستخدم المستخدمة في كل طلب"""
+    from .image_service import ImageService
+
+    avatar_url = user.profile_image_url
+    if not avatar_url:
+        default_image = current_app.config['IMAGES_CONFIG']['default_avatar']
+        avatar_url = ImageService.get_image_url(user.profile_image, default_image, 'users')
+
+    return {
+        'id': user.id,
+        'name': user.name,
+        'email': user.email,
+        'location': user.location,
+        'is_admin': bool(user.is_admin),
+        'is_banned': bool(user.is_banned),
+        'profile_image': user.profile_image,
+        'profile_image_url': user.profile_image_url,
+        'avatar_url': avatar_url
+    }
+
+
+def get_user_snapshot(user_id):
+    """إرجاع لقطة المستخدم من الذاكرة المؤقتة، مع كائن User إذا تم تحميله الآن"""
+    snapshot = user_cache.get(user_id)
+    if snapshot is not None:
+        return snapshot, None
+
+    from .models import User
+    user = User.query.get(user_id)
+    if not user:
+        return None, None
+
+    snapshot = make_user_snapshot(user)
+    user_cache.set(user_id, snapshot)
+    return snapshot, user
+
+
+def load_current_user():
+    """تحديد هوية المستخدم الحالي من توكن الطلب"""
+    token = get_request_token()
+    if not token:
+        return AnonymousUser()
+
+    try:
+        data = decode_token(token)
+        if not data or not data.get('user_id'):
+            return AnonymousUser('invalid_token')
+
+        snapshot, user = get_user_snapshot(data['user_id'])
+        if not snapshot:
+            return AnonymousUser('user_not_found')
+        if snapshot['is_banned']:
+            return AnonymousUser('banned')
+
+        return CurrentUser(snapshot, user)
+    except Exception as e:
+        current_app.logger.warning(f"فشل في تحديد هوية المستخدم: {str(e)}")
+        return AnonymousUser('invalid_token')
+
+
+def invalidate_user(user_id):
+    """حذف لقطة المستخدم من الذاكرة المؤقتة بعد تغيير بياناته"""
+    if user_id:
+        user_cache.delete(user_id)
+
+
+def forget_token(token):
+    """حذف التوكن من الذاكرة المؤقتة عند تسجيل الخروج"""
+    if token:
+        token_cache.delete(token)
@@ -0,0 +1,161 @@
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+from flask import current_app
+from . import db
+from .image_service import ImageService, IMAGE_SIZES
+from .cloudflare_client import get_cloudflare_client
+
+
+# مجلدات الصور المرفوعة التي يفحصها جامع الصور اليتيمة
+GC_FOLDERS = ('products', 'users', 'uploads')
+
+
+def _image_id(value):
+    """معرف الصورة من القيمة المخزنة، سواء كانت معرفاً أو رابط توزيع Cloudflare بأي مقاس أو مساراً محلياً"""
+    if not value or '/' not in value:
+        return value.split('.', 1)[0] if value else value
+
+    parsed = urlparse(value)
+    parts = [part for part in parsed.path.split('/') if part]
+
+    # روابط التوزيع: imagedelivery.net/<hash>/<id>/<variant> أو <domain>/cdn-cgi/imagedelivery/<hash>/<id>/<variant>
+    start = None
+    if parsed.hostname == 'imagedelivery.net':
+        start = 0
+    elif 'imagedelivery' in parts:
+        start = parts.index('imagedelivery') + 1
+    if start is not None and len(parts) > start + 1:
+        return parts[start + 1]
+
+    # المسارات المحلية: /static/images/<folder>/<id>.<ext> أو نسخة مصغرة <id>_<size>.<ext>
+    return _base_id(parts[-1].split('.', 1)[0]) if parts else value
+
+
+def _base_id(stem):
+    """معرف الصورة الأصلية من اسم ملف مشتق مثل <id>_thumbnail"""
+    for size in IMAGE_SIZES:
+        suffix = f'_{size}'
+        if stem.endswith(suffix):
+            return stem[:-len(suffix)]
+    return stem
+
+
+def _is_upload_id(image_id):
+    """الصور المرفوعة فقط تحمل معرف UUID، أما الصور الافتراضية مثل default-avatar فلا تُمس"""
+    try:
+        uuid.UUID(image_id)
+        return True
+    except ValueError:
+        return False
+
+
+def collect_references(chunk_size=1000):
+    """كل معرفات الصور المستخدمة في قاعدة البيانات، مقروءة على دفعات"""
+    from .models import ImageDeletionJob, ProductImage, User
+
+    references = set()
+    for column in (ProductImage.cloudflare_id, User.profile_image, ImageDeletionJob.image_id):
+        for (value,) in db.session.query(column).filter(column.isnot(None)).yield_per(chunk_size):
+            references.add(_image_id(value))
+    return references
+
+
+def find_local_orphans(references, min_age=3600):
+    """الملفات في مجلدات الصور التي لا يشير إليها أي سجل، مجمعة حسب الصورة: [(folder, image_id, size_bytes)]"""
+    cutoff = time.time() - min_age
+    orphans = {}
+
+    for folder in GC_FOLDERS:
+        image_folder = ImageService.image_folder(folder)
+        if not os.path.isdir(image_folder):
+            continue
+
+        with os.scandir(image_folder) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+
+                stat = entry.stat()
+                # الملفات الحديثة قد تكون لرفع لم يُحفظ سجله بعد
+                if stat.st_mtime > cutoff:
+                    continue
+
+                if entry.name.startswith('.'):
+                    # ملف مؤقت متبقٍ من رفع انقطع
+                    orphans[(folder, entry.name)] = orphans.get((folder, entry.name), 0) + stat.st_size
+                    continue
+
+                image_id = _base_id(entry.name.split('.', 1)[0])
+                if _is_upload_id(image_id) and image_id not in references:
+                    orphans[(folder, image_id)] = orphans.get((folder, image_id), 0) + stat.st_size
+
+    return [(folder, image_id, size) for (folder, image_id), size in orphans.items()]
+
+
+def find_cloudflare_orphans(references, min_age=3600, per_page=1000):
+    """صور Cloudflare التي لا يشير إليها أي سجل، بقراءة القائمة صفحة بصفحة"""
+    client = get_cloudflare_client()
+    if client is None:
+        return
+
+    cutoff = datetime.utcnow() - timedelta(seconds=min_age)
+    for image in client.list_images(per_page=per_page):
+        image_id = image.get('id')
+        uploaded = image.get('uploaded')
+        if uploaded:
+            try:
+                if datetime.fromisoformat(uploaded.replace('Z', '+00:00')).replace(tzinfo=None) > cutoff:
+                    continue
+            except ValueError:
+                pass
+        if image_id and image_id not in references:
+            yield image_id
+
+
+def _batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def collect_garbage(dry_run=True, include_cloudflare=False, batch_size=100, min_age=3600, report=None):
+    """البحث عن الصور اليتيمة وحذفها على دفعات (أو الاكتفاء بعرضها في وضع dry_run)"""
+    report = report or (lambda line: None)
+    references = collect_references()
+    current_app.logger.info(f"عدد الصور المستخدمة في قاعدة البيانات: {len(references)}")
+
+    summary = {'local': 0, 'local_bytes': 0, 'cloudflare': 0, 'deleted': 0}
+
+    for batch in _batches(find_local_orphans(references, min_age), batch_size):
+        for folder, image_id, size in batch:
+            summary['local'] += 1
+            summary['local_bytes'] += size
+            report(f"{folder}/{image_id} ({size} بايت)")
+
+            if dry_run:
+                continue
+            if image_id.startswith('.'):
+                os.remove(os.path.join(ImageService.image_folder(folder), image_id))
+                summary['deleted'] += 1
+            elif ImageService.release_image(image_id, folder):
+                summary['deleted'] += 1
+
+    if include_cloudflare:
+        for batch in _batches(find_cloudflare_orphans(references, min_age), batch_size):
+            for image_id in batch:
+                summary['cloudflare'] += 1
+                report(f"cloudflare/{image_id}")
+
+                if not dry_run and ImageService.release_image(image_id):
+                    summary['deleted'] += 1
+
+    current_app.logger.info(f"نتيجة جمع الصور اليتيمة: {summary}")
+    return summary
@@ -0,0 +1,159 @@
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from . import db
+
+
+class ImageDeletionQueue:
+    """طابور حذف الصور: تُسجل المهام في جدول image_deletion_job مع تغييرات الطلب، ويحذفها خيط خلفي على دفعات"""
+
+    def __init__(self, poll_interval=30, batch_size=20, max_attempts=8, retry_delay=60, lease=300):
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease = lease
+        self.app = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def init_app(self, app):
+        config = app.config.get('IMAGE_QUEUE_CONFIG', {})
+        for name in ('poll_interval', 'batch_size', 'max_attempts', 'retry_delay', 'lease'):
+            if config.get(name) is not None:
+                setattr(self, name, config[name])
+        self.app = app
+
+        # المهام المتبقية من تشغيل سابق تُعالج مع أول طلب دون انتظار حذف جديد
+        app.before_request(self.ensure_worker)
+
+    def enqueue(self, image_id, folder='uploads'):
+        """إضافة مهمة حذف إلى الجلسة الحالية، فلا تُنفذ إلا إذا نجح حفظ التغيير الذي طلبها"""
+        from .models import ImageDeletionJob
+
+        if not image_id:
+            return None
+
+        job = ImageDeletionJob(image_id=image_id, folder=folder)
+        db.session.add(job)
+        db.session.info['image_jobs_queued'] = True
+        self.ensure_worker()
+        return job
+
+    def wake(self):
+        self._wake.set()
+
+    def ensure_worker(self):
+        if self.app is None or (self._thread is not None and self._thread.is_alive()):
+            return
+
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='image-deletion', daemon=True)
+                self._thread.start()
+
+    def _is_gone(self, job):
+        """صورة محلية غير موجودة أصلاً (بدون Cloudflare) لا تحتاج لإعادة المحاولة"""
+        from .cloudflare_client import get_cloudflare_client
+        from .image_service import ImageService
+
+        return get_cloudflare_client() is None and ImageService.find_local_image(job.image_id, job.folder) is None
+
+    def process_batch(self):
+        """حذف دفعة من الصور المستحقة، مع تأجيل الفاشلة بتراجع أسي، وإرجاع عدد المهام المعالجة"""
+        from .models import ImageDeletionJob
+        from .image_service import ImageService
+
+        now = datetime.utcnow()
+        ids = [row.id for row in db.session.query(ImageDeletionJob.id).filter(
+            ImageDeletionJob.next_attempt_at <= now,
+            ImageDeletionJob.attempts < self.max_attempts
+        ).order_by(ImageDeletionJob.id).limit(self.batch_size).with_for_update(skip_locked=True)]
+
+        if not ids:
+            return 0
+
+        # حجز المهام ذرياً حتى لا تعالجها عملية أخرى في نفس الوقت: المهمة التي حجزتها عملية أخرى
+        # بعد قراءتها هنا تغير next_attempt_at فلا يطابقها شرط UPDATE
+        lease_until = now + timedelta(seconds=self.lease)
+        table = ImageDeletionJob.__table__
+        claimed = db.session.execute(
+            table.update()
+            .where(table.c.id.in_(ids), table.c.next_attempt_at <= now)
+            .values(next_attempt_at=lease_until)
+        ).rowcount
+        db.session.commit()
+
+        if not claimed:
+            return 0
+
+        jobs = ImageDeletionJob.query.filter(
+            ImageDeletionJob.id.in_(ids),
+            ImageDeletionJob.next_attempt_at == lease_until
+        ).order_by(ImageDeletionJob.id).all()
+
+        for job in jobs:
+            if ImageService.reference_count(job.image_id):
+                # الصورة مشتركة (نفس المحتوى)، وستُضاف مهمة جديدة عند إزالة آخر مرجع لها
+                db.session.delete(job)
+                continue
+
+            reused_until = ImageService.reused_until(job.image_id)
+            if reused_until:
+                job.next_attempt_at = reused_until
+                continue
+
+            error = None
+            try:
+                deleted = ImageService.delete_image(job.image_id, job.folder) or self._is_gone(job)
+            except Exception as e:
+                deleted, error = False, str(e)
+
+            if deleted:
+                db.session.delete(job)
+                continue
+
+            job.attempts += 1
+            job.last_error = error or 'فشل الحذف'
+            job.next_attempt_at = datetime.utcnow() + timedelta(seconds=self.retry_delay * (2 ** (job.attempts - 1)))
+            if job.attempts >= self.max_attempts:
+                self.app.logger.error(f"توقف حذف الصورة {job.image_id} بعد {job.attempts} محاولات: {job.last_error}")
+
+        db.session.commit()
+        return len(jobs)
+
+    def drain(self):
+        """معالجة كل المهام المستحقة حالياً"""
+        total = 0
+        while True:
+            processed = self.process_batch()
+            total += processed
+            if processed < self.batch_size:
+                return total
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+            try:
+                with self.app.app_context():
+                    self.drain()
+            except Exception as e:
+                self.app.logger.error(f"خطأ في معالجة طابور حذف الصور: {str(e)}")
+
+
+image_queue = ImageDeletionQueue()
+
+
+@event.listens_for(Session, 'after_commit')
+def wake_image_queue(session):
+    if session.info.pop('image_jobs_queued', False):
+        image_queue.wake()
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_image_jobs(session):
+    session.info.pop('image_jobs_queued', None)
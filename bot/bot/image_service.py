@@ -1,124 +1,419 @@
 import os
 import uuid
 import base64
-import requests
-import json
+import hashlib
 from flask import current_app
 import logging
 from werkzeug.utils import secure_filename
 import mimetypes
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from .cache import TTLCache
+from .cloudflare_client import get_cloudflare_client
+
+
+# نتيجة التحقق من وجود صور Cloudflare (True/False) بعد الرفع، حتى لا يُرسل أي طلب أثناء عرض الصفحات
+image_existence = TTLCache(max_size=50000, ttl=3600)
+# خيوط الأعمال الخلفية للصور: التحقق من Cloudflare وإنشاء النسخ المصغرة الناقصة
+_verify_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='image-verify')
+
+# حجم الأجزاء عند نسخ الملفات المرفوعة، وعدد البايتات الأولى المستخدمة لتحديد نوع الصورة
+STREAM_CHUNK_SIZE = 64 * 1024
+SNIFF_SIZE = 1024
+
+# مدة حماية الصورة المعاد استخدامها من الحذف حتى يُحفظ السجل الذي سيشير إليها
+DEDUP_GRACE_SECONDS = 600
+
+# المقاسات المشتقة من كل صورة (أقصى عرض/ارتفاع بالبكسل)
+IMAGE_SIZES = {
+    'thumbnail': 200,
+    'card': 480,
+    'full': 1280,
+}
+
+# رفع الصور المتعددة بالتوازي بعدد خيوط محدود، يُنشأ عند أول استخدام
+_upload_executor = None
+_upload_executor_lock = threading.Lock()
+
+# الصور التي فشل إنشاء نسخها المصغرة، حتى لا تُعاد المحاولة في كل عرض
+_derivative_failures = TTLCache(max_size=10000, ttl=3600)
+# النسخ المصغرة المطلوبة في الخلفية ولم تُنشأ بعد، حتى لا تُضاف نفس الصورة للطابور مع كل عرض
+_pending_derivatives = set()
+_pending_derivatives_lock = threading.Lock()
+
+# فهرس (معرف الصورة -> اسم الملف) لكل مجلد محلي، يُبنى مرة واحدة ويُحدّث عند الرفع والحذف
+_local_index = {}
+_local_index_lock = threading.Lock()
+
 
 class ImageService:
+    @staticmethod
+    def image_folder(folder):
+        return os.path.join(current_app.static_folder, 'images', folder)
+
+    @staticmethod
+    def _build_local_index(folder):
+        """مسح المجلد مرة واحدة وبناء فهرس المعرفات، مع حفظ وقت تعديله لاكتشاف تغييرات العمليات الأخرى"""
+        image_folder = ImageService.image_folder(folder)
+        files = {}
+        mtime = None
+
+        if os.path.isdir(image_folder):
+            mtime = os.stat(image_folder).st_mtime_ns
+            with os.scandir(image_folder) as entries:
+                for entry in entries:
+                    # الملفات المخفية ملفات مؤقتة لرفع لم يكتمل
+                    if entry.is_file() and not entry.name.startswith('.'):
+                        files.setdefault(entry.name.split('.', 1)[0], entry.name)
+
+        _local_index[folder] = {'files': files, 'mtime': mtime}
+        current_app.logger.debug(f"تم بناء فهرس الصور المحلية للمجلد {folder}: {len(files)} ملف")
+        return _local_index[folder]
+
+    @staticmethod
+    def find_local_image(image_id, folder='uploads'):
+        """البحث عن اسم ملف الصورة في الفهرس بدلاً من مسح المجلد"""
+        with _local_index_lock:
+            index = _local_index.get(folder) or ImageService._build_local_index(folder)
+            filename = index['files'].get(image_id)
+
+            if filename is None:
+                # قد تكون عملية أخرى أضافت الملف: نعيد البناء فقط إذا تغير المجلد فعلاً
+                image_folder = ImageService.image_folder(folder)
+                mtime = os.stat(image_folder).st_mtime_ns if os.path.isdir(image_folder) else None
+                if mtime != index['mtime']:
+                    filename = ImageService._build_local_index(folder)['files'].get(image_id)
+
+            return filename
+
+    @staticmethod
+    def _index_add(folder, image_id, filename):
+        with _local_index_lock:
+            index = _local_index.get(folder)
+            if index is not None:
+                index['files'][image_id] = filename
+
+    @staticmethod
+    def _index_remove(folder, image_id):
+        with _local_index_lock:
+            index = _local_index.get(folder)
+            if index is not None:
+                index['files'].pop(image_id, None)
+
+    @staticmethod
+    def derivative_id(image_id, size):
+        return f"{image_id}_{size}"
+
+    @staticmethod
+    def create_derivatives(image_id, folder='uploads', sizes=None):
+        """إنشاء نسخ مصغرة (WebP أو JPEG) من الصورة المحلية الأصلية وحفظها بجانبها"""
+        if _derivative_failures.get((folder, image_id)):
+            return {}
+
+        try:
+            from PIL import Image, ImageOps, features
+        except ImportError:
+            current_app.logger.warning("مكتبة Pillow غير متوفرة، سيتم عرض الصور بحجمها الأصلي")
+            _derivative_failures.set((folder, image_id), True)
+            return {}
+
+        filename = ImageService.find_local_image(image_id, folder)
+        if not filename:
+            return {}
+
+        image_folder = ImageService.image_folder(folder)
+        use_webp = features.check('webp')
+        created = {}
+
+        try:
+            with Image.open(os.path.join(image_folder, filename)) as source:
+                original = ImageOps.exif_transpose(source)
+
+                for size in sizes or IMAGE_SIZES:
+                    image = original.copy()
+                    image.thumbnail((IMAGE_SIZES[size], IMAGE_SIZES[size]))
+
+                    derivative_id = ImageService.derivative_id(image_id, size)
+                    if use_webp:
+                        has_alpha = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+                        image = image.convert('RGBA' if has_alpha else 'RGB')
+                        derivative_filename = f"{derivative_id}.webp"
+                        image.save(os.path.join(image_folder, derivative_filename), 'WEBP', quality=80, method=4)
+                    else:
+                        image = image.convert('RGB')
+                        derivative_filename = f"{derivative_id}.jpg"
+                        image.save(os.path.join(image_folder, derivative_filename), 'JPEG', quality=80, optimize=True, progressive=True)
+
+                    ImageService._index_add(folder, derivative_id, derivative_filename)
+                    created[size] = derivative_filename
+        except Exception as e:
+            current_app.logger.error(f"فشل في إنشاء النسخ المصغرة للصورة {image_id}: {str(e)}")
+            _derivative_failures.set((folder, image_id), True)
+
+        return created
+
+    @staticmethod
+    def stored_image_url(image):
+        """الرابط المخزن ومعرف الصورة من كائن ProductImage أو User (أو قاموس مماثل)"""
+        def value(name):
+            return image.get(name) if isinstance(image, dict) else getattr(image, name, None)
+
+        if value('cloudflare_id') is not None or value('url'):
+            return value('url'), value('cloudflare_id')
+        return value('profile_image_url'), value('profile_image')
+
     @staticmethod
     def allowed_file(filename):
         allowed_extensions = current_app.config.get('IMAGES_CONFIG', {}).get('allowed_extensions', ['jpg', 'jpeg', 'png', 'gif'])
         return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
     
     @staticmethod
-    def upload_image(image_data, folder='uploads'):
+    def find_duplicate(sha256, folder):
+        """صورة مخزنة مسبقاً بنفس المحتوى في نفس المجلد، مع تسجيل وقت إعادة استخدامها"""
+        from . import db
+        from .models import StoredImage
+
+        stored = StoredImage.query.filter_by(sha256=sha256, folder=folder).first()
+        if stored is None:
+            return None
+
+        if stored.url.startswith('/static/') and ImageService.find_local_image(stored.image_id, folder) is None:
+            return None
+
+        table = StoredImage.__table__
+        with db.engine.begin() as connection:
+            connection.execute(
+                table.update().where(table.c.id == stored.id).values(last_used_at=datetime.utcnow())
+            )
+
+        current_app.logger.info(f"إعادة استخدام صورة مخزنة بنفس المحتوى: {stored.image_id}")
+        return {'id': stored.image_id, 'url': stored.url, 'sha256': sha256, 'deduplicated': True}
+
+    @staticmethod
+    def remember_image(sha256, folder, image_id, image_url):
+        """تسجيل بصمة الصورة المرفوعة لإعادة استخدامها عند رفع نفس المحتوى مرة أخرى"""
+        from . import db
+        from .models import StoredImage
+        from sqlalchemy.exc import IntegrityError
+
         try:
-            cloudflare_config = current_app.config.get('CLOUDFLARE_CONFIG', {})
-            image_id = str(uuid.uuid4())
+            # معاملة مستقلة: الرفع قد يتم في خيط آخر بجلسة لن تُحفظ
+            with db.engine.begin() as connection:
+                connection.execute(StoredImage.__table__.insert().values(
+                    sha256=sha256, folder=folder, image_id=image_id, url=image_url, created_at=datetime.utcnow()
+                ))
+        except IntegrityError:
+            # رفع متزامن لنفس المحتوى سبقنا إلى التسجيل، وتبقى هذه النسخة غير مفهرسة
+            pass
 
-            if isinstance(image_data, str) and ',' in image_data:
-                file_data = base64.b64decode(image_data.split(',')[1])
-            elif isinstance(image_data, str):
-                file_data = base64.b64decode(image_data)
-            else:
-                file_data = image_data
+        return {'id': image_id, 'url': image_url, 'sha256': sha256}
 
-            current_app.logger.info(f"معالجة صورة جديدة بمعرف: {image_id}")
-            current_app.logger.info(f"نوع بيانات الصورة: {type(image_data)}")
+    @staticmethod
+    def reference_count(image_id):
+        """عدد صور المنتجات وصور المستخدمين التي تشير إلى الصورة"""
+        from .models import ProductImage, User
 
-            account_id = cloudflare_config.get('account_id')
-            api_token = cloudflare_config.get('api_token')
-            image_delivery_url = cloudflare_config.get('image_delivery_url')
+        return (
+            ProductImage.query.filter_by(cloudflare_id=image_id).count()
+            + User.query.filter_by(profile_image=image_id).count()
+        )
 
-            if account_id and api_token and image_delivery_url:
-                current_app.logger.info("محاولة رفع الصورة إلى Cloudflare")
-                try:
-                    headers = {
-                        'Authorization': f'Bearer {api_token}'
-                    }
-                    
-                    files = {
-                        'file': (f'{image_id}.jpg', file_data, 'image/jpeg')
-                    }
-                    
-                    metadata = {
-                        'id': image_id
-                    }
-                    
-                    response = requests.post(
-                        f'https://api.cloudflare.com/client/v4/accounts/{account_id}/images/v1',
-                        headers=headers,
-                        files=files,
-                        data={'metadata': json.dumps(metadata)}
-                    )
-                    
-                    if response.status_code == 200:
-                        result = response.json()
-                        if result.get('success'):
-                            image_data = result.get('result', {})
-                            current_app.logger.info(f"تم رفع الصورة بنجاح إلى Cloudflare: {image_data.get('id')}")
-                            return {
-                                'id': image_data.get('id'),
-                                'url': f"{image_delivery_url}/{image_data.get('id')}/public"
-                            }
-                        else:
-                            current_app.logger.error(f"استجابة Cloudflare غير ناجحة: {result}")
-                except Exception as cloudflare_error:
-                    current_app.logger.error(f"فشل في رفع الصورة إلى Cloudflare: {str(cloudflare_error)}")
-            else:
-                current_app.logger.info("لم يتم تكوين Cloudflare بشكل كامل، سيتم استخدام التخزين المحلي")
-            
+    @staticmethod
+    def reused_until(image_id):
+        """نهاية فترة حماية الصورة إذا أُعيد استخدامها مؤخراً لرفع لم يُحفظ بعد، وإلا None"""
+        from .models import StoredImage
 
-            if file_data:
-                try:
-                    static_folder = current_app.static_folder
-                    image_path = os.path.join(static_folder, 'images', folder)
-                    os.makedirs(image_path, exist_ok=True)
+        last_used_at = StoredImage.query.with_entities(StoredImage.last_used_at).filter_by(
+            image_id=image_id
+        ).order_by(StoredImage.last_used_at.desc()).limit(1).scalar()
 
-                    image_extension = '.jpg'
+        if last_used_at is None:
+            return None
+        until = last_used_at + timedelta(seconds=DEDUP_GRACE_SECONDS)
+        return until if until > datetime.utcnow() else None
 
-                    try:
-                       
-                        import magic  
-                        mime = magic.Magic(mime=True)
-                        mime_type = mime.from_buffer(file_data[:1024])
-                        if mime_type:
-                            ext = mimetypes.guess_extension(mime_type)
-                            if ext:
-                                image_extension = ext
-                    except ImportError:
-                        if file_data.startswith(b'\xff\xd8'):
-                            image_extension = '.jpg'
-                        elif file_data.startswith(b'\x89PNG\r\n\x1a\n'):
-                            image_extension = '.png'
-                        elif file_data.startswith(b'GIF87a') or file_data.startswith(b'GIF89a'):
-                            image_extension = '.gif'
-                        elif file_data.startswith(b'RIFF') and file_data[8:12] == b'WEBP':
-                            image_extension = '.webp'
-                    
-                    image_filename = f"{image_id}{image_extension}"
-                    local_path = os.path.join(image_path, image_filename)
-                    
-                    current_app.logger.info(f"حفظ الصورة محلياً في: {local_path}")
-                    
-                    with open(local_path, 'wb') as f:
-                        f.write(file_data)
-                    
-                    image_url = f"/static/images/{folder}/{image_filename}"
-                    current_app.logger.info(f"تم حفظ الصورة محلياً بنجاح. URL: {image_url}")
-                    
-                    return {
-                        'id': image_id,
-                        'url': image_url
-                    }
-                except Exception as local_error:
-                    current_app.logger.error(f"فشل في حفظ الصورة محلياً: {str(local_error)}")
-                    current_app.logger.error(f"تفاصيل الخطأ المحلي: {str(local_error)}", exc_info=True)
+    @staticmethod
+    def release_image(image_id, folder='uploads'):
+        """حذف الصورة فقط إذا لم يعد أي سجل يشير إليها ولم يُعد استخدامها مؤخراً"""
+        if ImageService.reference_count(image_id) or ImageService.reused_until(image_id):
+            current_app.logger.info(f"الصورة {image_id} مستخدمة في مكان آخر، لن يتم حذفها")
+            return False
+        return ImageService.delete_image(image_id, folder)
+
+    @staticmethod
+    def detect_extension(head):
+        """تحديد امتداد الصورة من بايتاتها الأولى"""
+        try:
+            import magic
+            mime_type = magic.Magic(mime=True).from_buffer(head)
+            if mime_type:
+                ext = mimetypes.guess_extension(mime_type)
+                if ext:
+                    return ext
+        except ImportError:
+            if head.startswith(b'\x89PNG\r\n\x1a\n'):
+                return '.png'
+            if head.startswith(b'GIF87a') or head.startswith(b'GIF89a'):
+                return '.gif'
+            if head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+                return '.webp'
+        return '.jpg'
+
+    @staticmethod
+    def hash_stream(stream):
+        """حساب SHA-256 وحجم ملف مفتوح بقراءته على أجزاء، ثم إرجاعه إلى بدايته"""
+        digest = hashlib.sha256()
+        size = 0
+        stream.seek(0)
+        for chunk in iter(lambda: stream.read(STREAM_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+        stream.seek(0)
+        return digest.hexdigest(), size
+
+    @staticmethod
+    def _store_stream(stream, folder='uploads'):
+        """حفظ صورة من ملف مفتوح في Cloudflare أو محلياً على أجزاء، وإرجاع {'id', 'url'} أو None
+
+        عمليات تخزين فقط دون أي كتابة في قاعدة البيانات، فيصلح تشغيلها في خيوط upload_many.
+        """
+        image_id = str(uuid.uuid4())
+        stream.seek(0)
+        image_extension = ImageService.detect_extension(stream.read(SNIFF_SIZE))
+        stream.seek(0)
+        image_filename = f"{image_id}{image_extension}"
+
+        image_delivery_url = current_app.config.get('CLOUDFLARE_CONFIG', {}).get('image_delivery_url')
+        client = get_cloudflare_client()
+
+        if client and image_delivery_url:
+            try:
+                content_type = mimetypes.guess_type(image_filename)[0] or 'image/jpeg'
+                image_data = client.upload_stream(image_id, stream, image_filename, content_type)
+                if image_data:
+                    current_app.logger.info(f"تم رفع الصورة بنجاح إلى Cloudflare: {image_data.get('id')}")
+                    image_url = f"{image_delivery_url}/{image_data.get('id')}/public"
+                    ImageService.verify_image_async(image_data.get('id'), image_url)
+                    return {'id': image_data.get('id'), 'url': image_url}
+            except Exception as cloudflare_error:
+                current_app.logger.error(f"فشل في رفع الصورة إلى Cloudflare: {str(cloudflare_error)}")
+            stream.seek(0)
+
+        image_path = ImageService.image_folder(folder)
+        os.makedirs(image_path, exist_ok=True)
+        local_path = os.path.join(image_path, image_filename)
+        temp_path = os.path.join(image_path, f".{image_filename}.tmp")
+
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in iter(lambda: stream.read(STREAM_CHUNK_SIZE), b''):
+                    f.write(chunk)
+            os.replace(temp_path, local_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        ImageService._index_add(folder, image_id, image_filename)
+        ImageService.create_derivatives(image_id, folder)
+
+        image_url = f"/static/images/{folder}/{image_filename}"
+        current_app.logger.info(f"تم حفظ الصورة محلياً بنجاح. URL: {image_url}")
+        return {'id': image_id, 'url': image_url}
+
+    @staticmethod
+    def upload_stream(stream, folder='uploads'):
+        """رفع صورة من ملف مفتوح (مثل FileStorage.stream) على أجزاء، بذاكرة ثابتة مهما كان حجم الملف"""
+        try:
+            sha256, size = ImageService.hash_stream(stream)
+            if not size:
+                return None
+
+            duplicate = ImageService.find_duplicate(sha256, folder)
+            if duplicate:
+                return duplicate
+
+            stored = ImageService._store_stream(stream, folder)
+            return ImageService.remember_image(sha256, folder, stored['id'], stored['url']) if stored else None
+
+        except Exception as e:
+            current_app.logger.error(f"خطأ في رفع الصورة: {str(e)}", exc_info=True)
             return None
+
+    @staticmethod
+    def _decode_image_data(image_data):
+        """بايتات الصورة من نص base64 (مع بادئة data: أو بدونها) أو من بايتات مباشرة"""
+        if isinstance(image_data, str) and ',' in image_data:
+            return base64.b64decode(image_data.split(',')[1])
+        if isinstance(image_data, str):
+            return base64.b64decode(image_data)
+        return image_data
+
+    @staticmethod
+    def _store_bytes(file_data, folder='uploads'):
+        """حفظ بايتات صورة في Cloudflare أو محلياً وإرجاع {'id', 'url'} أو None، دون الكتابة في قاعدة البيانات"""
+        cloudflare_config = current_app.config.get('CLOUDFLARE_CONFIG', {})
+        image_id = str(uuid.uuid4())
+
+        current_app.logger.info(f"معالجة صورة جديدة بمعرف: {image_id}")
+
+        image_delivery_url = cloudflare_config.get('image_delivery_url')
+        client = get_cloudflare_client()
+
+        if client and image_delivery_url:
+            current_app.logger.info("محاولة رفع الصورة إلى Cloudflare")
+            try:
+                image_data = client.upload(image_id, file_data)
+                if image_data:
+                    current_app.logger.info(f"تم رفع الصورة بنجاح إلى Cloudflare: {image_data.get('id')}")
+                    image_url = f"{image_delivery_url}/{image_data.get('id')}/public"
+                    ImageService.verify_image_async(image_data.get('id'), image_url)
+                    return {'id': image_data.get('id'), 'url': image_url}
+            except Exception as cloudflare_error:
+                current_app.logger.error(f"فشل في رفع الصورة إلى Cloudflare: {str(cloudflare_error)}")
+        else:
+            current_app.logger.info("لم يتم تكوين Cloudflare بشكل كامل، سيتم استخدام التخزين المحلي")
+        
+
+        if file_data:
+            try:
+                static_folder = current_app.static_folder
+                image_path = os.path.join(static_folder, 'images', folder)
+                os.makedirs(image_path, exist_ok=True)
+
+                image_extension = ImageService.detect_extension(file_data[:SNIFF_SIZE])
+                image_filename = f"{image_id}{image_extension}"
+                local_path = os.path.join(image_path, image_filename)
+                
+                current_app.logger.info(f"حفظ الصورة محلياً في: {local_path}")
+                
+                with open(local_path, 'wb') as f:
+                    f.write(file_data)
+                ImageService._index_add(folder, image_id, image_filename)
+                ImageService.create_derivatives(image_id, folder)
+                
+                image_url = f"/static/images/{folder}/{image_filename}"
+                current_app.logger.info(f"تم حفظ الصورة محلياً بنجاح. URL: {image_url}")
+                
+                return {'id': image_id, 'url': image_url}
+            except Exception as local_error:
+                current_app.logger.error(f"فشل في حفظ الصورة محلياً: {str(local_error)}")
+                current_app.logger.error(f"تفاصيل الخطأ المحلي: {str(local_error)}", exc_info=True)
+        return None
+
+    @staticmethod
+    def upload_image(image_data, folder='uploads'):
+        try:
+            current_app.logger.info(f"نوع بيانات الصورة: {type(image_data)}")
+            file_data = ImageService._decode_image_data(image_data)
+
+            sha256 = hashlib.sha256(file_data).hexdigest()
+            duplicate = ImageService.find_duplicate(sha256, folder)
+            if duplicate:
+                return duplicate
+
+            stored = ImageService._store_bytes(file_data, folder)
+            return ImageService.remember_image(sha256, folder, stored['id'], stored['url']) if stored else None
             
         except Exception as e:
             current_app.logger.error(f"خطأ عام في رفع الصورة: {str(e)}")
@@ -126,8 +421,54 @@ class ImageService:
             return None
     
     @staticmethod
-    def get_image_url(image_id, default_image=None, folder='uploads'):
-        """الحصول على URL لصورة بناءً على المعرف"""
+    def create_derivatives_async(image_id, folder='uploads'):
+        """إنشاء النسخ المصغرة الناقصة في الخلفية دون إبطاء عرض الصفحة"""
+        key = (folder, image_id)
+        if _derivative_failures.get(key):
+            return
+
+        with _pending_derivatives_lock:
+            if key in _pending_derivatives:
+                return
+            _pending_derivatives.add(key)
+
+        app = current_app._get_current_object()
+
+        def create():
+            try:
+                with app.app_context():
+                    ImageService.create_derivatives(image_id, folder)
+            except Exception as e:
+                app.logger.error(f"فشل في إنشاء النسخ المصغرة للصورة {image_id}: {str(e)}")
+            finally:
+                with _pending_derivatives_lock:
+                    _pending_derivatives.discard(key)
+
+        _verify_executor.submit(create)
+
+    @staticmethod
+    def verify_image_async(image_id, image_url):
+        """التحقق في الخلفية من أن الصورة أصبحت متاحة على رابط التوزيع، وتخزين النتيجة"""
+        app = current_app._get_current_object()
+        client = get_cloudflare_client(app)
+        if client is None:
+            return
+
+        def verify():
+            exists = client.exists(image_url)
+            if exists is None:
+                app.logger.warning(f"فشل في التحقق من وجود الصورة في Cloudflare: {image_id}")
+                return
+
+            image_existence.set(image_id, exists)
+            if not exists:
+                app.logger.warning(f"الصورة غير متاحة في Cloudflare بعد الرفع: {image_id}")
+
+        _verify_executor.submit(verify)
+
+    @staticmethod
+    def get_image_url(image_id, default_image=None, folder='uploads', size=None):
+        """الحصول على URL لصورة بناءً على المعرف، أو لنسخة مصغرة منها عند تحديد size"""
         current_app.logger.debug(f"طلب الحصول على URL للصورة بمعرف: {image_id} من مجلد: {folder}")
         
         if not image_id:
@@ -146,42 +487,32 @@ class ImageService:
         api_token = cloudflare_config.get('api_token')
 
         if image_delivery_url and account_id and api_token:
-            cloudflare_url = f"{image_delivery_url}/{image_id}/public"
-            current_app.logger.debug(f"استخدام URL الصورة من Cloudflare: {cloudflare_url}")
+            # لا طلبات شبكة أثناء العرض: فقط الصور التي ثبت عدم وجودها تُستبدل بالافتراضية
+            if image_existence.get(image_id) is False and default_image:
+                current_app.logger.debug(f"الصورة غير موجودة في Cloudflare، استخدام الصورة الافتراضية: {image_id}")
+                return default_image
 
-            try:
-                headers = {'Authorization': f'Bearer {api_token}'}
-                response = requests.head(cloudflare_url, headers=headers)
-                if response.status_code == 200:
-                    return cloudflare_url
-            except Exception as e:
-                current_app.logger.warning(f"فشل في التحقق من وجود الصورة في Cloudflare: {str(e)}")
-            
-       
+            variant = cloudflare_config.get('variants', {}).get(size, 'public')
+            cloudflare_url = f"{image_delivery_url}/{image_id}/{variant}"
+            current_app.logger.debug(f"استخدام URL الصورة من Cloudflare: {cloudflare_url}")
             return cloudflare_url
 
 
-        static_folder = current_app.static_folder
-        image_folder = os.path.join(static_folder, 'images', folder)
-        
         try:
-            if os.path.exists(image_folder):
-   
-                for filename in os.listdir(image_folder):
-                    if filename.startswith(f"{image_id}."):
-                        local_url = f"/static/images/{folder}/{filename}"
-                        current_app.logger.debug(f"تم العثور على صورة محلية: {local_url}")
-                        return local_url
-                
-  
-                if os.path.exists(os.path.join(image_folder, image_id)):
-                    local_url = f"/static/images/{folder}/{image_id}"
-                    current_app.logger.debug(f"تم العثور على صورة محلية بدون امتداد: {local_url}")
-                    return local_url
-                
-                current_app.logger.warning(f"لم يتم العثور على صورة بمعرف {image_id} في مجلد {folder}")
-            else:
-                current_app.logger.warning(f"مجلد الصور غير موجود: {image_folder}")
+            if size in IMAGE_SIZES:
+                filename = ImageService.find_local_image(ImageService.derivative_id(image_id, size), folder)
+                if filename:
+                    return f"/static/images/{folder}/{filename}"
+                # صور رُفعت قبل إضافة النسخ المصغرة: تُنشأ في الخلفية وتُعرض الأصلية حتى ذلك الحين
+                ImageService.create_derivatives_async(image_id, folder)
+
+            filename = ImageService.find_local_image(image_id, folder)
+            if filename:
+                local_url = f"/static/images/{folder}/{filename}"
+                current_app.logger.debug(f"تم العثور على صورة محلية: {local_url}")
+                return local_url
+
+            current_app.logger.warning(f"لم يتم العثور على صورة بمعرف {image_id} في مجلد {folder}")
         except Exception as e:
             current_app.logger.error(f"خطأ أثناء البحث عن الصورة المحلية: {str(e)}")
 
@@ -202,52 +533,48 @@ class ImageService:
             
             current_app.logger.info(f"تم استخراج معرف الصورة من URL: {image_id}")
         
-        cloudflare_config = current_app.config.get('CLOUDFLARE_CONFIG', {})
-        account_id = cloudflare_config.get('account_id')
-        api_token = cloudflare_config.get('api_token')
-
+        client = get_cloudflare_client()
 
-        if account_id and api_token:
+        if client:
             current_app.logger.info(f"محاولة حذف الصورة من Cloudflare: {image_id}")
             try:
-                headers = {
-                    'Authorization': f'Bearer {api_token}'
-                }
-                
-                response = requests.delete(
-                    f'https://api.cloudflare.com/client/v4/accounts/{account_id}/images/v1/{image_id}',
-                    headers=headers
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    if result.get('success'):
-                        success = True
-                        current_app.logger.info(f"تم حذف الصورة من Cloudflare: {image_id}")
-                else:
-                    current_app.logger.warning(f"استجابة Cloudflare حذف الصورة: {response.status_code} - {response.text}")
+                if client.delete(image_id):
+                    success = True
+                    image_existence.set(image_id, False)
+                    current_app.logger.info(f"تم حذف الصورة من Cloudflare: {image_id}")
             except Exception as cloudflare_error:
                 current_app.logger.error(f"فشل في حذف الصورة من Cloudflare: {str(cloudflare_error)}")
 
 
         try:
-            static_folder = current_app.static_folder
-            image_folder = os.path.join(static_folder, 'images', folder)
-            
-            if os.path.exists(image_folder):
-        
-                for filename in os.listdir(image_folder):
-                    if filename.startswith(f"{image_id}.") or filename == image_id:
-                        local_path = os.path.join(image_folder, filename)
-                        os.remove(local_path)
-                        current_app.logger.info(f"تم حذف الصورة المحلية: {local_path}")
-                        success = True
-                        break
-            else:
-                current_app.logger.warning(f"مجلد الصور غير موجود: {image_folder}")
+            filename = ImageService.find_local_image(image_id, folder)
+            if filename:
+                local_path = os.path.join(ImageService.image_folder(folder), filename)
+                if os.path.exists(local_path):
+                    os.remove(local_path)
+                    current_app.logger.info(f"تم حذف الصورة المحلية: {local_path}")
+                    success = True
+                ImageService._index_remove(folder, image_id)
+
+            for size in IMAGE_SIZES:
+                derivative_id = ImageService.derivative_id(image_id, size)
+                filename = ImageService.find_local_image(derivative_id, folder)
+                if filename:
+                    derivative_path = os.path.join(ImageService.image_folder(folder), filename)
+                    if os.path.exists(derivative_path):
+                        os.remove(derivative_path)
+                    ImageService._index_remove(folder, derivative_id)
         except Exception as local_error:
             current_app.logger.error(f"فشل في حذف الصورة المحلية: {str(local_error)}")
-            
+
+        if success:
+            from . import db
+            from .models import StoredImage
+
+            table = StoredImage.__table__
+            with db.engine.begin() as connection:
+                connection.execute(table.delete().where(table.c.image_id == image_id))
+
         return success
     
     @staticmethod
@@ -296,20 +623,111 @@ class ImageService:
         except Exception as e:
             current_app.logger.error(f"فشل في إنشاء مجلدات وصور وهمية: {str(e)}")
             
+    @staticmethod
+    def _get_upload_executor():
+        global _upload_executor
+        with _upload_executor_lock:
+            if _upload_executor is None:
+                workers = current_app.config.get('IMAGES_CONFIG', {}).get('upload_workers', 4)
+                _upload_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-upload')
+            return _upload_executor
+
+    @staticmethod
+    def prepare_file(file):
+        """التحقق من ملف FileStorage وحساب بصمته: (sha256, دالة الحفظ) أو None إذا كان الملف غير صالح"""
+        if not (file and ImageService.allowed_file(file.filename)):
+            current_app.logger.warning(f"نوع الملف غير مسموح: {file.filename if file else 'لا يوجد ملف'}")
+            return None
+
+        sha256, size = ImageService.hash_stream(file.stream)
+        if not size:
+            return None
+        return sha256, lambda folder: ImageService._store_stream(file.stream, folder)
+
+    @staticmethod
+    def prepare_image(image_data):
+        """فك صورة base64 أو بايتات وحساب بصمتها: (sha256, دالة الحفظ) أو None إذا كانت فارغة"""
+        file_data = ImageService._decode_image_data(image_data)
+        if not file_data:
+            return None
+        return hashlib.sha256(file_data).hexdigest(), lambda folder: ImageService._store_bytes(file_data, folder)
+
+    @staticmethod
+    def upload_many(items, folder='uploads', prepare=None):
+        """رفع عدة صور بالتوازي مع الحفاظ على ترتيبها، وحذف ما رُفع منها إذا فشل أي واحد
+
+        خيوط الرفع تنفذ عمليات التخزين فقط (Cloudflare أو القرص). التحقق والبصمات وقراءة stored_image
+        وتسجيل الصور الجديدة فيه تتم في خيط الطلب، فلا تتزاحم عدة خيوط على الكتابة في قاعدة البيانات
+        (SQLite: database is locked). prepare تحول كل عنصر إلى (sha256, دالة الحفظ)، افتراضياً prepare_file.
+        """
+        prepare = prepare or ImageService.prepare_file
+        if not items:
+            return []
+
+        app = current_app._get_current_object()
+
+        results = [None] * len(items)
+        pending = {}
+        for index, item in enumerate(items):
+            try:
+                prepared = prepare(item)
+            except Exception as e:
+                app.logger.error(f"خطأ في تجهيز صورة ضمن مجموعة: {str(e)}")
+                prepared = None
+            if prepared is None:
+                app.logger.error(f"صورة غير صالحة ضمن مجموعة ({index + 1} من {len(items)})، لن يتم رفع المجموعة")
+                return None
+
+            sha256, store = prepared
+            if sha256 in pending:
+                # نفس المحتوى مكرر في نفس المجموعة: يُرفع مرة واحدة
+                pending[sha256][1].append(index)
+                continue
+
+            duplicate = ImageService.find_duplicate(sha256, folder)
+            if duplicate:
+                results[index] = duplicate
+            else:
+                pending[sha256] = (store, [index])
+
+        def run(store):
+            with app.app_context():
+                return store(folder)
+
+        executor = ImageService._get_upload_executor()
+        futures = {sha256: executor.submit(run, store) for sha256, (store, _) in pending.items()}
+
+        for sha256, future in futures.items():
+            try:
+                stored = future.result()
+            except Exception as e:
+                app.logger.error(f"خطأ في رفع صورة ضمن مجموعة: {str(e)}")
+                stored = None
+
+            if stored:
+                result = ImageService.remember_image(sha256, folder, stored['id'], stored['url'])
+                for index in pending[sha256][1]:
+                    results[index] = dict(result)
+
+        failed = sum(1 for result in results if not result)
+        if failed:
+            app.logger.error(f"فشل رفع {failed} من {len(items)} صور، سيتم حذف الصور التي رُفعت")
+            for result in results:
+                if result:
+                    ImageService.release_image(result['id'], folder)
+            return None
+
+        return results
+
     @staticmethod
     def upload_file(file, folder='uploads'):
         """تحميل ملف من نوع werkzeug.FileStorage"""
         try:
             if file and ImageService.allowed_file(file.filename):
-              
-                file_data = file.read()
-                file.seek(0) 
-                
-        
-                current_app.logger.info(f"تحميل ملف جديد: {file.filename}, حجم: {len(file_data)} بايت، نوع: {file.content_type}")
-                
-           
-                result = ImageService.upload_image(file_data, folder)
+                current_app.logger.info(f"تحميل ملف جديد: {file.filename}, نوع: {file.content_type}")
+
+                # werkzeug يحفظ الملفات الكبيرة في ملف مؤقت، فلا تُقرأ الصورة كاملة في الذاكرة
+                result = ImageService.upload_stream(file.stream, folder)
                 
      
                 if result:
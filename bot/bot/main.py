@@ -101,35 +101,29 @@ def log_activity(user_id, action, entity_type, entity_id, details=None, request=
     db.session.add(log)
     db.session.commit()
 
+def get_request_identity():
+    from flask import g
+    from .identity import load_current_user
+
+    if not hasattr(g, 'current_user') or g.current_user is None:
+        g.current_user = load_current_user()
+    return g.current_user
+
+def auth_error_response(identity):
+    if identity.auth_error == 'missing_token':
+        return jsonify({'success': False, 'message': 'يجب تسجيل الدخول للوصول إلى هذه الخدمة'}), 401
+    if identity.auth_error == 'user_not_found':
+        return jsonify({'success': False, 'message': 'المستخدم غير موجود'}), 401
+    if identity.auth_error == 'banned':
+        return jsonify({'success': False, 'message': 'تم حظر حسابك. يرجى التواصل مع الإدارة'}), 403
+    return jsonify({'success': False, 'message': 'التوكن غير صالح أو منتهي الصلاحية'}), 401
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-   
-        from .models import User
-        from flask import current_app
-        
-        token = None
-
-        if 'Authorization' in request.headers:
-            auth_header = request.headers['Authorization']
-            if auth_header.startswith('Bearer '):
-                token = auth_header.split(' ')[1]
-        if not token and 'auth_token' in session:
-            token = session['auth_token']
-            
-        if not token:
-            return jsonify({'success': False, 'message': 'يجب تسجيل الدخول للوصول إلى هذه الخدمة'}), 401
-        
-        try:
-            data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
-            current_user = User.query.get(data['user_id'])
-            if not current_user:
-                return jsonify({'success': False, 'message': 'المستخدم غير موجود'}), 401
-
-            if current_user.is_banned:
-                return jsonify({'success': False, 'message': 'تم حظر حسابك. يرجى التواصل مع الإدارة'}), 403
-        except:
-            return jsonify({'success': False, 'message': 'التوكن غير صالح أو منتهي الصلاحية'}), 401
+        current_user = get_request_identity()
+        if not current_user.is_authenticated:
+            return auth_error_response(current_user)
             
         return f(current_user, *args, **kwargs)
     
@@ -138,31 +132,12 @@ def token_required(f):
 def admin_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        from .models import User
-        from flask import current_app
-        
-        token = None
-
-        if 'Authorization' in request.headers:
-            auth_header = request.headers['Authorization']
-            if auth_header.startswith('Bearer '):
-                token = auth_header.split(' ')[1]
-        if not token and 'auth_token' in session:
-            token = session['auth_token']
-            
-        if not token:
-            return jsonify({'success': False, 'message': 'يجب تسجيل الدخول للوصول إلى هذه الخدمة'}), 401
-        
-        try:
-            data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
-            current_user = User.query.get(data['user_id'])
-            if not current_user:
-                return jsonify({'success': False, 'message': 'المستخدم غير موجود'}), 401
+        current_user = get_request_identity()
+        if not current_user.is_authenticated:
+            return auth_error_response(current_user)
 
-            if not current_user.is_admin:
-                return jsonify({'success': False, 'message': 'ليس لديك صلاحية للوصول إلى هذه الخدمة'}), 403
-        except:
-            return jsonify({'success': False, 'message': 'التوكن غير صالح أو منتهي الصلاحية'}), 401
+        if not current_user.is_admin:
+            return jsonify({'success': False, 'message': 'ليس لديك صلاحية للوصول إلى هذه الخدمة'}), 403
             
         return f(current_user, *args, **kwargs)
     
@@ -0,0 +1,109 @@
+from sqlalchemy import and_, or_, select
+from . import db
+
+
+# عدد الرسائل في كل نافذة من سجل المحادثة، والحد الأقصى المسموح به في الطلب
+CHAT_PAGE_SIZE = 50
+MAX_CHAT_PAGE_SIZE = 200
+
+
+def conversation_filter(user_id, other_user_id, product_id=None):
+    """شرط رسائل المحادثة بين مستخدمين في الاتجاهين، مع تقييدها بمنتج عند تحديده"""
+    from .models import Message
+
+    condition = or_(
+        and_(Message.sender_id == user_id, Message.receiver_id == other_user_id),
+        and_(Message.sender_id == other_user_id, Message.receiver_id == user_id)
+    )
+    if product_id:
+        condition = and_(condition, Message.product_id == product_id)
+    return condition
+
+
+def get_history(user_id, other_user_id, product_id=None, before_id=None, after_id=None, limit=CHAT_PAGE_SIZE):
+    """نافذة من سجل المحادثة مرتبة من الأقدم للأحدث، مع ما إذا كانت هناك رسائل أخرى خارجها
+
+    بدون مؤشر: آخر limit رسالة. before_id: الرسائل الأقدم منها (تحميل السجل للأعلى).
+    after_id: الرسائل الأحدث منها بالترتيب (جلب الجديد منذ آخر رسالة معروضة).
+    """
+    from .models import Message
+
+    limit = max(1, min(limit or CHAT_PAGE_SIZE, MAX_CHAT_PAGE_SIZE))
+    query = Message.query.filter(conversation_filter(user_id, other_user_id, product_id))
+
+    if after_id is not None:
+        rows = query.filter(Message.id > after_id).order_by(Message.id.asc()).limit(limit + 1).all()
+        return rows[:limit], len(rows) > limit
+
+    if before_id is not None:
+        query = query.filter(Message.id < before_id)
+
+    rows = query.order_by(Message.id.desc()).limit(limit + 1).all()
+    messages = rows[:limit]
+    messages.reverse()
+    return messages, len(rows) > limit
+
+
+def has_unread(receiver_id, sender_id, product_id=None):
+    """هل توجد رسائل غير مقروءة من sender_id إلى receiver_id؟ قراءة بالمفتاح من عدادات جدول المحادثات
+
+    تُستخدم قبل mark_read في الطلبات المتكررة (مثل الاستطلاع كل بضع ثوانٍ) لتجنب عبارة UPDATE لا تغير شيئاً.
+    """
+    from .conversations import conversation_key
+    from .models import Conversation
+
+    user_low_id, user_high_id, product_key = conversation_key(receiver_id, sender_id, product_id)
+    side = Conversation.unread_low if receiver_id == user_low_id else Conversation.unread_high
+
+    query = db.session.query(Conversation.product_key).filter(
+        Conversation.user_low_id == user_low_id,
+        Conversation.user_high_id == user_high_id,
+        side > 0
+    )
+    if product_id:
+        query = query.filter(Conversation.product_key == product_key)
+    return query.first() is not None
+
+
+def mark_read(receiver_id, *conditions):
+    """تحديد الرسائل الواردة غير المقروءة كمقروءة بعبارة UPDATE واحدة، وإرجاع [(id, sender_id, product_id)] للرسائل التي تغيرت
+
+    يُنفذ على اتصال الجلسة الحالية مع تحديث عدادات غير المقروء، فيُحفظ كل ذلك مع db.session.commit().
+    """
+    from .models import Message
+    from .unread import apply_unread_deltas, read_deltas
+
+    table = Message.__table__
+    where = and_(table.c.receiver_id == receiver_id, table.c.is_read == False, *conditions)
+    connection = db.session.connection()
+
+    columns = (table.c.id, table.c.sender_id, table.c.product_id)
+
+    if getattr(connection.dialect, 'update_returning', False):
+        result = connection.execute(table.update().where(where).values(is_read=True).returning(*columns))
+        rows = [tuple(row) for row in result]
+    else:
+        # قواعد بيانات بدون UPDATE ... RETURNING (مثل SQLite قبل 3.35): قراءة المعرفات ثم تحديثها داخل نفس المعاملة
+        rows = [tuple(row) for row in connection.execute(select(*columns).where(where))]
+        if rows:
+            connection.execute(
+                table.update()
+                .where(table.c.id.in_([row[0] for row in rows]), table.c.is_read == False)
+                .values(is_read=True)
+            )
+
+    if rows:
+        apply_unread_deltas(connection, read_deltas(receiver_id, rows))
+    return rows
+
+
+def serialize_message(message):
+    return {
+        'id': message.id,
+        'content': message.content,
+        'sender_id': message.sender_id,
+        'receiver_id': message.receiver_id,
+        'product_id': message.product_id,
+        'created_at': message.created_at.isoformat(),
+        'is_read': message.is_read
+    }
@@ -16,7 +16,7 @@ class User(db.Model):
     password = db.Column(db.String(200), nullable=False)
     name = db.Column(db.String(100), nullable=False)
     phone = db.Column(db.String(20), nullable=True)
-    profile_image = db.Column(db.String(500), nullable=True)
+    profile_image = db.Column(db.String(500), nullable=True, index=True)
     profile_image_url = db.Column(db.String(500), nullable=True)
     bio = db.Column(db.Text, nullable=True)
     location = db.Column(db.String(100), nullable=True)
@@ -28,6 +28,7 @@ class User(db.Model):
     is_banned = db.Column(db.Boolean, default=False)
     is_online = db.Column(db.Boolean, default=False)
     new_email_pending = db.Column(db.String(150), nullable=True)
+    search_text = db.Column(db.Text, nullable=True)
 
     @property
     def is_authenticated(self):
@@ -82,11 +83,7 @@ class User(db.Model):
     audit_logs = db.relationship('AuditLog', backref='user', lazy=True)
     
     def calculate_rating(self):
-        reviews = UserReview.query.filter_by(reviewed_user_id=self.id).all()
-        if not reviews:
-            return 0
-        total = sum(review.rating for review in reviews)
-        return round((total / len(reviews)) * 20, 1)
+        return get_ratings([self.id])[self.id][0]
 
 
 class UserReview(db.Model):
@@ -105,6 +102,43 @@ class UserReview(db.Model):
             raise ValueError("يجب أن يكون التقييم بين 1 و 5")
 
 
+class UserRating(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class UnreadCount(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class Conversation(db.Model):
+    __table_args__ = (
+        db.Index('ix_conversation_low_activity', 'user_low_id', 'last_activity_at'),
+        db.Index('ix_conversation_high_activity', 'user_high_id', 'last_activity_at'),
+    )
+
+    # الطرفان مرتبان (الأصغر معرفاً أولاً) لتكون المحادثة صفاً واحداً في الاتجاهين
+    user_low_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    user_high_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    # معرف المنتج، أو 0 للمحادثات غير المرتبطة بمنتج
+    product_key = db.Column(db.Integer, primary_key=True)
+    last_message_id = db.Column(db.Integer, nullable=True)
+    last_activity_at = db.Column(db.DateTime, nullable=True)
+    unread_low = db.Column(db.Integer, nullable=False, default=0)
+    unread_high = db.Column(db.Integer, nullable=False, default=0)
+
+    user_low = db.relationship('User', foreign_keys=[user_low_id])
+    user_high = db.relationship('User', foreign_keys=[user_high_id])
+    product = db.relationship(
+        'Product', primaryjoin='foreign(Conversation.product_key) == Product.id', viewonly=True
+    )
+    last_message = db.relationship(
+        'Message', primaryjoin='foreign(Conversation.last_message_id) == Message.id', viewonly=True
+    )
+
+
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -133,6 +167,7 @@ class Product(db.Model):
     is_featured = db.Column(db.Boolean, default=False)
     is_sold = db.Column(db.Boolean, default=False)
     buyer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    search_text = db.Column(db.Text, nullable=True)
 
     images = db.relationship('ProductImage', backref='product', lazy=True, cascade="all, delete-orphan")
     attributes = db.relationship('ProductAttribute', backref='product', lazy=True, cascade="all, delete-orphan")
@@ -142,7 +177,7 @@ class Product(db.Model):
 
 class ProductImage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    cloudflare_id = db.Column(db.String(100), nullable=False)
+    cloudflare_id = db.Column(db.String(100), nullable=False, index=True)
     url = db.Column(db.String(500), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     is_primary = db.Column(db.Boolean, default=False)
@@ -157,6 +192,8 @@ class ProductAttribute(db.Model):
 
 
 class Message(db.Model):
+    __table_args__ = (db.Index('ix_message_conversation', 'sender_id', 'receiver_id', 'id'),)
+
     id = db.Column(db.Integer, primary_key=True)
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     receiver_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -189,6 +226,83 @@ class AuditLog(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
+class ImageDeletionJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    image_id = db.Column(db.String(500), nullable=False)
+    folder = db.Column(db.String(50), nullable=False, default='uploads')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class StoredImage(db.Model):
+    __table_args__ = (db.UniqueConstraint('sha256', 'folder'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False)
+    folder = db.Column(db.String(50), nullable=False)
+    image_id = db.Column(db.String(500), nullable=False, index=True)
+    url = db.Column(db.String(500), nullable=False)
+    last_used_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class SiteCounter(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class SearchIndexState(db.Model):
+    """إصدار قواعد توحيد النص التي بُنيت بها أعمدة search_text والفهرس النصي"""
+    name = db.Column(db.String(50), primary_key=True)
+    normalizer_version = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+def get_ratings(user_ids):
+    """التقييم (من 100) وعدد المراجعات لمجموعة مستخدمين من جدول user_rating في استعلام واحد"""
+    ratings = {user_id: (0, 0) for user_id in user_ids}
+    if not ratings:
+        return ratings
+
+    rows = db.session.query(
+        UserRating.user_id,
+        UserRating.rating_sum,
+        UserRating.rating_count
+    ).filter(UserRating.user_id.in_(list(ratings))).all()
+
+    for user_id, rating_sum, rating_count in rows:
+        if rating_count:
+            ratings[user_id] = (round((rating_sum / rating_count) * 20, 1), rating_count)
+
+    return ratings
+
+
+def _fields_changed(target, *fields):
+    state = db.inspect(target)
+    return any(state.attrs[field].history.has_changes() for field in fields)
+
+
+@db.event.listens_for(Product, 'before_insert')
+@db.event.listens_for(Product, 'before_update')
+def update_product_search_text(mapper, connection, target):
+    """حساب النص الموحد للبحث عند إنشاء المنتج أو تعديل عنوانه ووصفه"""
+    from .text_normalization import build_search_text
+    if target.search_text is None or _fields_changed(target, 'title', 'description'):
+        target.search_text = build_search_text(target.title, target.description)
+
+
+@db.event.listens_for(User, 'before_insert')
+@db.event.listens_for(User, 'before_update')
+def update_user_search_text(mapper, connection, target):
+    """حساب النص الموحد للبحث عند إنشاء المستخدم أو تعديل اسمه وبريده"""
+    from .text_normalization import build_search_text
+    if target.search_text is None or _fields_changed(target, 'name', 'email'):
+        target.search_text = build_search_text(target.name, target.email)
+
+
 def get_profile_image_url(self):
     from flask import current_app
     from .image_service import ImageService
@@ -213,12 +327,16 @@ def update_profile_image(self, image_data):
         
         if result:
             if self.profile_image:
-                ImageService.delete_image(self.profile_image, 'users')
+                from .image_queue import image_queue
+                image_queue.enqueue(self.profile_image, 'users')
             
             self.profile_image = result['id']
             self.profile_image_url = result['url']
             
             db.session.commit()
+
+            from .identity import invalidate_user
+            invalidate_user(self.id)
             return True
             
         return False
@@ -245,6 +363,8 @@ def get_main_image_url(self):
             primary_image = self.images[0]
     
     if primary_image:
+        if primary_image.url:
+            return primary_image.url
         return ImageService.get_image_url(primary_image.cloudflare_id, default_image, 'products')
     
     return default_image
@@ -256,7 +376,8 @@ def add_product_image(self, image_data, is_primary=False):
     from . import db
     
     try:
-        result = ImageService.upload_image(image_data, 'products')
+        results = ImageService.upload_many([image_data], 'products', prepare=ImageService.prepare_image)
+        result = results[0] if results else None
         
         if result:
             if is_primary and self.images:
@@ -282,7 +403,7 @@ def add_product_image(self, image_data, is_primary=False):
 
 
 def delete_product_image(self, image_id):
-    from .image_service import ImageService
+    from .image_queue import image_queue
     from . import db
     
     try:
@@ -294,7 +415,7 @@ def delete_product_image(self, image_id):
                 
         if not image:
             return False
-        ImageService.delete_image(image.cloudflare_id, 'products')
+        image_queue.enqueue(image.cloudflare_id, 'products')
         
         db.session.delete(image)
     
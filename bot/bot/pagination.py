@@ -0,0 +1,190 @@
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from flask import request
+from sqlalchemy import and_, or_, func
+from . import db
+from .cache import TTLCache
+
+
+# أعداد تقريبية للنتائج لتجنب COUNT(*) كامل في كل صفحة
+count_cache = TTLCache(max_size=1000, ttl=60)
+
+# القيمة التي تحل محل NULL في أعمدة الترتيب التي تقبلها، بحسب نوع العمود (أصغر من أي قيمة حقيقية)
+NULL_SORT_VALUES = {
+    datetime: datetime.min,
+    date: date.min,
+    int: 0,
+    float: 0.0,
+    Decimal: Decimal(0),
+    str: '',
+}
+
+
+class KeysetPagination:
+    """صفحة نتائج مبنية على مؤشر (cursor) بدلاً من OFFSET"""
+
+    is_keyset = True
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+def _encode_value(value):
+    """القيم التي لا يدعمها JSON تُخزن في المؤشر كنص مع نوعها"""
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'date': value.isoformat()}
+    if isinstance(value, Decimal):
+        return {'dec': str(value)}
+    return value
+
+
+def _decode_value(value):
+    if not isinstance(value, dict):
+        return value
+    if 'dt' in value:
+        return datetime.fromisoformat(value['dt'])
+    if 'date' in value:
+        return date.fromisoformat(value['date'])
+    return Decimal(value['dec'])
+
+
+def encode_cursor(direction, values):
+    payload = {
+        'd': direction,
+        'k': [_encode_value(value) for value in values]
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """فك المؤشر، مع إرجاع None عند أي مؤشر تالف للبدء من الصفحة الأولى"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        values = [_decode_value(value) for value in payload['k']]
+        if payload['d'] not in ('next', 'prev'):
+            return None
+        return payload['d'], values
+    except (ValueError, KeyError, TypeError, ArithmeticError):
+        return None
+
+
+def _null_sort_value(column):
+    """بديل NULL للعمود، أو None إذا كان العمود لا يقبل NULL"""
+    if not column.expression.nullable:
+        return None
+    try:
+        return NULL_SORT_VALUES[column.type.python_type]
+    except (KeyError, NotImplementedError):
+        raise ValueError(f"نوع عمود الترتيب {column.type} ({column.key}) غير مدعوم في التقسيم بالمؤشر") from None
+
+
+def _sort_expression(column):
+    """العمود كما يُرتب ويُقارن: coalesce للأعمدة التي تقبل NULL، لأن مقارنة المؤشر مع NULL تُسقط الصف"""
+    null_value = _null_sort_value(column)
+    return column if null_value is None else func.coalesce(column, null_value)
+
+
+def _keyset_condition(columns, values, descending):
+    """شرط (c1, c2, ...) < (v1, v2, ...) أو > بحسب اتجاه الترتيب، بصيغة متوافقة مع كل قواعد البيانات"""
+    clauses = []
+    for index, column in enumerate(columns):
+        compare = column < values[index] if descending else column > values[index]
+        clauses.append(and_(*[columns[i] == values[i] for i in range(index)], compare))
+    return or_(*clauses)
+
+
+def _order_clauses(columns, descending):
+    return [column.desc() if descending else column.asc() for column in columns]
+
+
+def approximate_count(query):
+    """عدد تقريبي للنتائج: COUNT(*) يُحسب مرة واحدة لكل مجموعة فلاتر ويُخزن مؤقتاً لمدة قصيرة"""
+    compiled = query.order_by(None).statement.compile(db.engine)
+    key = (str(compiled), tuple(sorted((k, str(v)) for k, v in compiled.params.items())))
+    total = count_cache.get(key)
+    if total is None:
+        total = query.order_by(None).count()
+        count_cache.set(key, total)
+    return total
+
+
+def keyset_paginate(query, columns, descending=True, cursor=None, per_page=20, with_total=False, total=None):
+    """تقسيم النتائج باستخدام مفتاح الترتيب (مثل created_at, id) بدلاً من OFFSET
+
+    يجب أن يكون آخر عمود في columns فريداً (عادة المعرف) ليكون الترتيب ثابتاً.
+    """
+    base_query = query
+    attributes, columns = columns, [_sort_expression(column) for column in columns]
+    decoded = decode_cursor(cursor) if cursor else None
+    direction, values = decoded if decoded else ('next', None)
+
+    if values is not None and len(values) == len(columns):
+        # الرجوع للخلف يعني البحث بالاتجاه المعاكس ثم عكس النتائج
+        query = query.filter(_keyset_condition(columns, values, descending if direction == 'next' else not descending))
+    else:
+        direction, values = 'next', None
+
+    query_descending = descending if direction == 'next' else not descending
+    rows = query.order_by(None).order_by(*_order_clauses(columns, query_descending)).limit(per_page + 1).all()
+
+    has_more = len(rows) > per_page
+    items = rows[:per_page]
+
+    if direction == 'prev':
+        items.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, values is not None
+
+    def key(item):
+        values = []
+        for attribute in attributes:
+            value = getattr(item, attribute.key)
+            values.append(_null_sort_value(attribute) if value is None else value)
+        return values
+
+    next_cursor = encode_cursor('next', key(items[-1])) if items and has_next else None
+    prev_cursor = encode_cursor('prev', key(items[0])) if items and has_prev else None
+
+    if total is None and with_total:
+        total = approximate_count(base_query)
+
+    return KeysetPagination(items, per_page, next_cursor, prev_cursor, total)
+
+
+def paginate(query, columns, descending=True, per_page=20, with_total=False, total=None):
+    """تقسيم بالمؤشر افتراضياً، مع الإبقاء على ?page= للروابط القديمة"""
+    page = request.args.get('page', type=int)
+    if page:
+        sort_columns = [_sort_expression(column) for column in columns]
+        return query.order_by(*_order_clauses(sort_columns, descending)).paginate(page=page, per_page=per_page)
+
+    return keyset_paginate(
+        query,
+        columns,
+        descending=descending,
+        cursor=request.args.get('cursor'),
+        per_page=per_page,
+        with_total=with_total,
+        total=total
+    )
@@ -0,0 +1,119 @@
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+from . import db
+from .upsert import upsert
+
+
+def _committed(obj, field):
+    """قيمة الحقل كما هي في قاعدة البيانات قبل تعديلات هذه الجلسة"""
+    history = db.inspect(obj).attrs[field].history
+    if history.has_changes():
+        return history.deleted[0] if history.deleted else None
+    return getattr(obj, field)
+
+
+def collect_rating_deltas(session):
+    """حساب التغير في (مجموع، عدد) التقييمات لكل مستخدم من المراجعات المضافة والمحذوفة والمعدلة"""
+    from .models import UserReview
+
+    deltas = {}
+
+    def add(user_id, rating, count):
+        if user_id is None or rating is None:
+            return
+        rating_sum, rating_count = deltas.get(user_id, (0, 0))
+        deltas[user_id] = (rating_sum + rating * count, rating_count + count)
+
+    for review in session.new:
+        if isinstance(review, UserReview):
+            add(review.reviewed_user_id, review.rating, 1)
+
+    for review in session.deleted:
+        if isinstance(review, UserReview):
+            add(_committed(review, 'reviewed_user_id'), _committed(review, 'rating'), -1)
+
+    for review in session.dirty:
+        if isinstance(review, UserReview) and session.is_modified(review):
+            add(_committed(review, 'reviewed_user_id'), _committed(review, 'rating'), -1)
+            add(review.reviewed_user_id, review.rating, 1)
+
+    return {user_id: delta for user_id, delta in deltas.items() if delta != (0, 0)}
+
+
+@event.listens_for(Session, 'before_flush')
+def apply_rating_deltas(session, flush_context, instances):
+    """تحديث جدول user_rating داخل نفس المعاملة التي تضيف المراجعة أو تحذفها"""
+    from .models import User, UserRating
+
+    deleted_users = {obj.id for obj in session.deleted if isinstance(obj, User)}
+    deltas = collect_rating_deltas(session)
+    if not deltas and not deleted_users:
+        return
+
+    table = UserRating.__table__
+    connection = session.connection()
+
+    for user_id, (rating_sum, rating_count) in deltas.items():
+        if user_id in deleted_users:
+            continue
+
+        upsert(
+            connection, table, {'user_id': user_id},
+            {'rating_sum': table.c.rating_sum + rating_sum, 'rating_count': table.c.rating_count + rating_count},
+            {'rating_sum': rating_sum, 'rating_count': rating_count}
+        )
+
+    # يجب حذف ملخص التقييم قبل حذف المستخدم نفسه بسبب المفتاح الأجنبي
+    if deleted_users:
+        connection.execute(table.delete().where(table.c.user_id.in_(deleted_users)))
+
+
+def compute_ratings():
+    """حساب مجموع وعدد التقييمات لكل مستخدم من جدول المراجعات مباشرة"""
+    from .models import UserReview
+
+    rows = db.session.query(
+        UserReview.reviewed_user_id,
+        func.sum(UserReview.rating),
+        func.count(UserReview.id)
+    ).group_by(UserReview.reviewed_user_id).all()
+
+    return {user_id: (int(rating_sum), rating_count) for user_id, rating_sum, rating_count in rows}
+
+
+def reconcile_ratings():
+    """مقارنة الملخصات المخزنة بالمراجعات الفعلية وإعادة كتابة الجدول، مع إرجاع عدد المستخدمين المصححين"""
+    from .models import UserRating
+
+    expected = compute_ratings()
+    stored = {
+        user_id: (rating_sum, rating_count)
+        for user_id, rating_sum, rating_count in db.session.query(
+            UserRating.user_id, UserRating.rating_sum, UserRating.rating_count
+        )
+    }
+
+    mismatched = {
+        user_id for user_id in set(expected) | set(stored)
+        if expected.get(user_id, (0, 0)) != stored.get(user_id, (0, 0))
+    }
+
+    table = UserRating.__table__
+    with db.engine.begin() as connection:
+        connection.execute(table.delete())
+        if expected:
+            connection.execute(table.insert(), [
+                {'user_id': user_id, 'rating_sum': rating_sum, 'rating_count': rating_count}
+                for user_id, (rating_sum, rating_count) in expected.items()
+            ])
+
+    return len(mismatched)
+
+
+def init_ratings(app):
+    """ملء جدول user_rating عند أول تشغيل بعد إضافته إذا كانت هناك مراجعات سابقة"""
+    from .models import UserRating, UserReview
+
+    if UserRating.query.first() is None and UserReview.query.first() is not None:
+        fixed = reconcile_ratings()
+        app.logger.info(f"تم حساب ملخص التقييمات لـ {fixed} مستخدم")
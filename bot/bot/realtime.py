@@ -0,0 +1,91 @@
+from flask import current_app
+
+
+class LocalAdapter:
+    """محول داخل العملية: الأحداث تصل فقط لعملاء نفس العملية (للتطوير والاختبارات وعامل واحد)"""
+
+    name = 'local'
+
+    def socketio_options(self):
+        return {}
+
+
+class MessageQueueAdapter:
+    """محول طابور رسائل (redis:// أو amqp:// أو kafka://): كل عملية تنشر الأحداث في الطابور وتستقبل منه
+
+    بذلك يصل emit(..., room=f"user_{id}") للمستخدم أياً كانت العملية المتصل بها.
+    """
+
+    name = 'message_queue'
+
+    def __init__(self, url, channel='flask-socketio'):
+        self.url = url
+        self.channel = channel
+
+    def socketio_options(self):
+        return {'message_queue': self.url, 'channel': self.channel}
+
+
+def create_adapter(config):
+    """اختيار المحول من الإعدادات: local أو رابط طابور الرسائل"""
+    message_queue = config.get('message_queue') or 'local'
+    if message_queue == 'local':
+        return LocalAdapter()
+    return MessageQueueAdapter(message_queue, channel=config.get('channel') or 'flask-socketio')
+
+
+def init_realtime(app):
+    """ربط Socket.IO بالتطبيق مع المحول المحدد وتسجيل معالجات الأحداث"""
+    from . import socketio
+
+    if socketio is None:
+        app.logger.warning("Flask-SocketIO غير مثبت، سيتم الاعتماد على الاستطلاع (polling) فقط")
+        return None
+
+    config = app.config.get('REALTIME_CONFIG', {})
+    adapter = create_adapter(config)
+
+    options = adapter.socketio_options()
+    if config.get('async_mode'):
+        options['async_mode'] = config['async_mode']
+    if config.get('cors_allowed_origins'):
+        options['cors_allowed_origins'] = config['cors_allowed_origins']
+
+    socketio.init_app(app, **options)
+    app.extensions['realtime_adapter'] = adapter
+
+    from . import socket_events  # noqa: F401 تسجيل معالجات الأحداث
+
+    app.logger.info(f"تم تفعيل Socket.IO بمحول: {adapter.name}")
+    return adapter
+
+
+def emit_to_user(user_id, event, data):
+    """إرسال حدث لكل اتصالات المستخدم (غرفة user_<id>) من أي مكان في التطبيق، مع تجاهل الأخطاء"""
+    from . import socketio
+
+    if socketio is None or 'realtime_adapter' not in current_app.extensions:
+        return False
+
+    try:
+        socketio.emit(event, data, room=f"user_{user_id}")
+        return True
+    except Exception as e:
+        current_app.logger.warning(f"فشل إرسال الحدث {event} للمستخدم {user_id}: {str(e)}")
+        return False
+
+
+def emit_unread_count(user_id):
+    from .unread import unread_total
+
+    emit_to_user(user_id, 'unread_count', {'unread_count': unread_total(user_id)})
+
+
+def notify_read(reader_id, rows):
+    """بعد حفظ messaging.mark_read: إشعار المرسلين بقراءة رسائلهم وتحديث عداد القارئ في كل تبويباته"""
+    if not rows:
+        return
+
+    for message_id, sender_id, _ in rows:
+        emit_to_user(sender_id, 'message_read', {'message_id': message_id})
+    emit_unread_count(reader_id)
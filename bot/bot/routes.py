@@ -41,107 +41,30 @@ admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 def index():
     """الصفحة الرئيسية"""
  
-    from .models import Category, Product, User, Message
-    from sqlalchemy import func, desc
-    from sqlalchemy.sql import text
-    
-
-    categories = Category.query.filter_by(parent_id=None).all()
-    
+    from .homepage import get_homepage_data
 
-    featured_products = Product.query.filter_by(is_active=True, is_sold=False, is_featured=True).order_by(Product.created_at.desc()).limit(4).all()
-    
-
-    latest_products = Product.query.filter_by(is_active=True, is_sold=False).order_by(Product.created_at.desc()).limit(8).all()
-    location_counts = db.session.query(
-        Product.location, 
-        func.count(Product.id).label('count')
-    ).filter_by(
-        is_active=True, 
-        is_sold=False
-    ).group_by(
-        Product.location
-    ).order_by(
-        desc('count')
-    ).limit(14).all()
-    popular_locations = [
-        {'id': location, 'name': get_location_name(location), 'count': count}
-        for location, count in location_counts
-    ]
+    # البيانات العامة من الذاكرة، والمفضلة فقط تُحسب لكل مستخدم
+    data = get_homepage_data()
     
-
-    if len(popular_locations) < 14:
-     
-        all_syrian_locations = [
-            {'id': 'damascus', 'name': 'دمشق'},
-            {'id': 'aleppo', 'name': 'حلب'},
-            {'id': 'homs', 'name': 'حمص'},
-            {'id': 'latakia', 'name': 'اللاذقية'},
-            {'id': 'tartus', 'name': 'طرطوس'},
-            {'id': 'hama', 'name': 'حماة'},
-            {'id': 'daraa', 'name': 'درعا'},
-            {'id': 'idlib', 'name': 'إدلب'},
-            {'id': 'hasaka', 'name': 'الحسكة'},
-            {'id': 'suwayda', 'name': 'السويداء'},
-            {'id': 'deir-ez-zor', 'name': 'دير الزور'},
-            {'id': 'raqqa', 'name': 'الرقة'},
-            {'id': 'quneitra', 'name': 'القنيطرة'},
-            {'id': 'rif-dimashq', 'name': 'ريف دمشق'}
-        ]
-        
-       
-        existing_locations = {loc['id'] for loc in popular_locations}
-        for loc in all_syrian_locations:
-            if loc['id'] not in existing_locations and len(popular_locations) < 14:
-             
-                count = Product.query.filter_by(
-                    location=loc['id'], 
-                    is_active=True, 
-                    is_sold=False
-                ).count()
-                
-                popular_locations.append({
-                    'id': loc['id'],
-                    'name': loc['name'],
-                    'count': count
-                })
-    
-    stats = {
-        'users_count': User.query.count(),
-        'products_count': Product.query.filter_by(is_active=True).count(),
-        'sales_count': Product.query.filter_by(is_sold=True).count(),
-        'regions_count': len(set([p.location for p in Product.query.with_entities(Product.location).distinct()]))
-    }
+    favorite_ids = set()
+    if g.current_user and g.current_user.is_authenticated:
+        from .models import favorites
+        favorite_ids = {
+            product_id for (product_id,) in db.session.query(favorites.c.product_id).filter(
+                favorites.c.user_id == g.current_user.id
+            )
+        }
     
-    token_user = None
-    token = None
-    if 'auth_token' in session:
-        token = session['auth_token']
-    elif 'Authorization' in request.headers:
-        auth_header = request.headers['Authorization']
-        if auth_header.startswith('Bearer '):
-            token = auth_header.split(' ')[1]
-    if token:
-        try:
-            data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
-            token_user = User.query.get(data['user_id'])
-        except:
-            pass
-    
-    if token_user:
-        for product in featured_products + latest_products:
-            product.is_favorite = product in token_user.favorites_products
-    else:
-        for product in featured_products + latest_products:
-            product.is_favorite = False
+    featured_products = [dict(product, is_favorite=product['id'] in favorite_ids) for product in data['featured_products']]
+    latest_products = [dict(product, is_favorite=product['id'] in favorite_ids) for product in data['latest_products']]
     
     return render_template(
         'index.html', 
-        categories=categories, 
+        categories=data['categories'], 
         featured_products=featured_products, 
         latest_products=latest_products,
-        popular_locations=popular_locations,
-        site_stats=stats
+        popular_locations=data['popular_locations'],
+        site_stats=data['site_stats']
     )
 
 def get_location_name(location_id):
@@ -186,6 +109,14 @@ def api_send_message():
     
     db.session.add(message)
     db.session.commit()
+
+    from .messaging import serialize_message
+    from .realtime import emit_to_user, emit_unread_count
+
+    pushed = dict(serialize_message(message), sender_name=g.current_user.name)
+    emit_to_user(message.sender_id, 'receive_message', pushed)
+    emit_to_user(message.receiver_id, 'receive_message', pushed)
+    emit_unread_count(message.receiver_id)
     
     return jsonify({
         'success': True,
@@ -308,6 +239,19 @@ def report(product_id):
         flash('حدث خطأ أثناء إرسال البلاغ. يرجى المحاولة مرة أخرى.', 'danger')
         return redirect(url_for('products.view', product_id=product_id))
     
+@admin_bp.route('/api/cloudflare_metrics', methods=['GET'])
+@admin_required
+def api_cloudflare_metrics(current_user):
+    """API لمقاييس طلبات Cloudflare في هذه العملية (زمن الاستجابة ونسبة الأخطاء)"""
+    from .cloudflare_client import get_cloudflare_client
+    
+    client = get_cloudflare_client()
+    if client is None:
+        return jsonify({'success': False, 'message': 'Cloudflare غير مكوّن'}), 404
+    
+    return jsonify({'success': True, 'metrics': client.metrics()})
+
+
 @admin_bp.route('/api/reports/<int:report_id>/status', methods=['POST'])
 @admin_required
 def api_update_report_status(current_user, report_id):
@@ -418,6 +362,9 @@ def api_ban_user(current_user, user_id):
     )
     
     db.session.commit()
+
+    from .identity import invalidate_user
+    invalidate_user(user.id)
     
     return jsonify({'success': True, 'message': 'تم حظر المستخدم بنجاح'})
 
@@ -443,6 +390,9 @@ def api_unban_user(current_user, user_id):
     )
     
     db.session.commit()
+
+    from .identity import invalidate_user
+    invalidate_user(user.id)
     
     return jsonify({'success': True, 'message': 'تم إلغاء حظر المستخدم بنجاح'})
 
@@ -481,31 +431,34 @@ def api_get_messages(user_id):
         return jsonify({'success': False, 'message': 'غير مصرح'}), 401
     
 
-    last_id = request.args.get('last_id', 0, type=int)
-    
-    messages = Message.query.filter(
-        ((Message.sender_id == g.current_user.id) & (Message.receiver_id == user_id)) |
-        ((Message.sender_id == user_id) & (Message.receiver_id == g.current_user.id)),
-        Message.id > last_id
-    ).order_by(Message.created_at).all()
-    
+    from .messaging import conversation_filter, get_history, has_unread, mark_read, serialize_message, CHAT_PAGE_SIZE
+    from .realtime import notify_read
 
-    for message in messages:
-        if message.receiver_id == g.current_user.id and not message.is_read:
-            message.is_read = True
-    
-    db.session.commit()
+    # last_id (الاسم القديم) يعادل after_id: جلب الرسائل الجديدة منذ آخر رسالة معروضة
+    after_id = request.args.get('after_id', type=int)
+    if after_id is None:
+        after_id = request.args.get('last_id', type=int)
+
+    product_id = request.args.get('product_id', type=int)
+    # يُستدعى كل بضع ثوانٍ، فلا يُنفذ التحديث إلا إذا وُجدت رسائل واردة غير مقروءة
+    if has_unread(g.current_user.id, user_id, product_id):
+        rows = mark_read(g.current_user.id, conversation_filter(g.current_user.id, user_id, product_id))
+        db.session.commit()
+        notify_read(g.current_user.id, rows)
+
+    messages, has_more = get_history(
+        g.current_user.id,
+        user_id,
+        product_id=product_id,
+        before_id=request.args.get('before_id', type=int),
+        after_id=after_id,
+        limit=request.args.get('limit', CHAT_PAGE_SIZE, type=int)
+    )
     
     return jsonify({
         'success': True,
-        'messages': [{
-            'id': msg.id,
-            'content': msg.content,
-            'sender_id': msg.sender_id,
-            'receiver_id': msg.receiver_id,
-            'created_at': msg.created_at.isoformat(),
-            'is_read': msg.is_read
-        } for msg in messages]
+        'messages': [serialize_message(msg) for msg in messages],
+        'has_more': has_more
     })
 
 @main_bp.route('/categories')
@@ -551,10 +504,14 @@ def index():
     """صفحة عرض جميع المنتجات"""
     from .models import Product
     
-    page = request.args.get('page', 1, type=int)
     per_page = 20
     
-    products = Product.query.filter_by(is_active=True, is_sold=False).paginate(page=page, per_page=per_page)
+    from .pagination import paginate
+    products = paginate(
+        Product.query.filter_by(is_active=True, is_sold=False),
+        (Product.created_at, Product.id),
+        per_page=per_page
+    )
     
     return render_template('products/index.html', products=products)
 
@@ -570,34 +527,35 @@ def search():
     max_price = request.args.get('max_price', type=float)
     condition = request.args.getlist('condition')
     featured_only = request.args.get('featured') == 'true'
-    sort_by = request.args.get('sort_by', 'created_at')
+    sort_by = request.args.get('sort_by', 'relevance' if search_query else 'created_at')
     sort_dir = request.args.get('sort_dir', 'desc')
     page = request.args.get('page', 1, type=int)
     per_page = 20
     
     query = Product.query.filter_by(is_active=True, is_sold=False)
     
+    relevance_order = None
     if search_query:
-        query = query.filter(Product.title.ilike(f'%{search_query}%') | Product.description.ilike(f'%{search_query}%'))
-    
-    if category_id:
-        query = query.filter_by(category_id=category_id)
-    
-    if location:
-        query = query.filter_by(location=location)
-    
-    if min_price is not None:
-        query = query.filter(Product.price >= min_price)
-    
-    if max_price is not None:
-        query = query.filter(Product.price <= max_price)
-    
-    if condition:
-        query = query.filter(Product.condition.in_(condition))
+        from .search import search_products
+        query, relevance_order = search_products(query, search_query)
     
     if featured_only:
         query = query.filter_by(is_featured=True)
     
+    # العدادات تُحسب قبل فلاتر التصنيف والموقع والحالة والسعر، وكل عداد يتجاهل فلتره فقط
+    from .facets import get_facets, apply_facet_filters
+    filters = {
+        'q': search_query,
+        'category_id': category_id,
+        'location': location,
+        'min_price': min_price,
+        'max_price': max_price,
+        'condition': condition,
+        'featured': featured_only
+    }
+    facets = get_facets(query, filters)
+    query = apply_facet_filters(query, filters)
+    
     if sort_by == 'price':
         order_column = Product.price
     elif sort_by == 'views':
@@ -605,12 +563,19 @@ def search():
     else:
         order_column = Product.created_at
     
-    if sort_dir == 'asc':
-        query = query.order_by(order_column.asc())
+    if sort_by == 'relevance' and relevance_order is not None:
+        # ترتيب الصلة محسوب لكل استعلام فلا يصلح كمفتاح مؤشر
+        query = query.order_by(relevance_order, Product.created_at.desc())
+        products_paginated = query.paginate(page=page, per_page=per_page)
     else:
-        query = query.order_by(order_column.desc())
-    
-    products_paginated = query.paginate(page=page, per_page=per_page)
+        from .pagination import paginate
+        products_paginated = paginate(
+            query,
+            (order_column, Product.id),
+            descending=sort_dir != 'asc',
+            per_page=per_page,
+            total=facets['total']
+        )
     
     categories = Category.query.all()
     
@@ -665,6 +630,7 @@ def search():
         categories=categories,
         conditions=conditions,
         locations=locations,
+        facets=facets,
         page_title=page_title
     )
 
@@ -676,16 +642,63 @@ def category(category_id):
     return redirect(url_for('products.search', category_id=category_id))
 
 
+def load_product_page(product_id):
+    """تحميل المنتج والمنتجات المشابهة مع الصور والبائع والتصنيف وتقييمات البائعين بعدد ثابت من الاستعلامات"""
+    from .models import Product, get_ratings
+    from sqlalchemy.orm import joinedload, selectinload
+    
+    product = Product.query.options(
+        joinedload(Product.seller),
+        joinedload(Product.category_rel),
+        selectinload(Product.images),
+        selectinload(Product.attributes)
+    ).filter(Product.id == product_id).first_or_404()
+    
+    similar_products = Product.query.options(
+        joinedload(Product.seller),
+        selectinload(Product.images)
+    ).filter(
+        Product.category_id == product.category_id,
+        Product.id != product.id,
+        Product.is_active == True,
+        Product.is_sold == False
+    ).order_by(Product.created_at.desc()).limit(4).all()
+    
+    favorite_ids = set()
+    if g.current_user and g.current_user.is_authenticated:
+        from .models import favorites
+        favorite_ids = {
+            favorite_id for (favorite_id,) in db.session.query(favorites.c.product_id).filter(
+                favorites.c.user_id == g.current_user.id,
+                favorites.c.product_id.in_([product.id] + [p.id for p in similar_products])
+            )
+        }
+    
+    ratings = get_ratings({p.seller_id for p in [product] + similar_products})
+    
+    for p in [product] + similar_products:
+        p.is_favorite = p.id in favorite_ids
+        p.seller.rating, p.seller.reviews_count = ratings[p.seller_id]
+    
+    product.category_name = product.category_rel.name if product.category_rel else ''
+    
+    return product, similar_products
+
+
 @products_bp.route('/view/<int:product_id>')
 def view(product_id):
     """عرض تفاصيل منتج"""
-    from .models import Product, Category
     from flask import current_app
     
-    product = Product.query.get_or_404(product_id)
+    product, similar_products = load_product_page(product_id)
     
-    product.views_count += 1
-    db.session.commit()
+    # تُحفظ المشاهدات دفعة واحدة في الخلفية، فتبقى هذه الصفحة قراءة فقط
+    from .view_counter import view_counter
+    if g.current_user and g.current_user.is_authenticated:
+        viewer_key = f"user:{g.current_user.id}"
+    else:
+        viewer_key = f"ip:{request.remote_addr}"
+    view_counter.record(product.id, viewer_key)
     
     current_app.logger.info(f"عرض تفاصيل المنتج: {product.id} - {product.title}")
     current_app.logger.info(f"عدد صور المنتج: {len(product.images)}")
@@ -695,31 +708,6 @@ def view(product_id):
             current_app.logger.debug(f"صورة {i+1}: ID={image.id}, CloudflareID={image.cloudflare_id}, is_primary={image.is_primary}")
     else:
         current_app.logger.warning(f"المنتج {product.id} ليس له صور")
-
-    similar_products = Product.query.filter(
-        Product.category_id == product.category_id,
-        Product.id != product.id,
-        Product.is_active == True,
-        Product.is_sold == False
-    ).order_by(Product.created_at.desc()).limit(4).all()
-
-    if g.current_user and g.current_user.is_authenticated:
-        product.is_favorite = product in g.current_user.favorites_products
-        for p in similar_products:
-            p.is_favorite = p in g.current_user.favorites_products
-    else:
-        product.is_favorite = False
-        for p in similar_products:
-            p.is_favorite = False
-
-    product.category_name = Category.query.get(product.category_id).name
-    
-    product.seller.rating = product.seller.calculate_rating()
-    product.seller.reviews_count = len(product.seller.reviews_received)
-
-    for p in similar_products:
-        p.seller.rating = p.seller.calculate_rating()
-        p.seller.reviews_count = len(p.seller.reviews_received)
     
     return render_template(
         'product_view.html',
@@ -787,6 +775,7 @@ def create():
     ]
     
     if request.method == 'POST':
+        uploaded_images = []
         try:
             title = request.form.get('title')
             category_id = request.form.get('category_id')
@@ -807,6 +796,27 @@ def create():
                 )
                 
             current_app.logger.info(f"بدء إنشاء منتج جديد: {title}")
+
+            files = request.files.getlist('product_images[]')
+            primary_image_index = request.form.get('primary_image', '0')
+            
+            current_app.logger.info(f"عدد الصور المرفقة: {len(files)}")
+            
+            # رفع كل الصور بالتوازي قبل إنشاء المنتج، مع الاحتفاظ بترتيبها الأصلي لتحديد الصورة الرئيسية
+            indexed_files = [(i, file) for i, file in enumerate(files) if file and file.filename]
+            current_app.logger.info(f"أسماء الملفات المرفقة: {[file.filename for _, file in indexed_files]}")
+            
+            results = ImageService.upload_many([file for _, file in indexed_files], folder='products')
+            if results is None:
+                flash('فشل رفع بعض الصور، يرجى المحاولة مرة أخرى', 'danger')
+                return render_template(
+                    'create_product.html',
+                    categories=categories,
+                    conditions=conditions,
+                    locations=locations,
+                    get_condition_name=get_condition_name
+                )
+            uploaded_images = results
             
             new_product = Product(
                 title=title,
@@ -820,45 +830,21 @@ def create():
             )
             
             db.session.add(new_product)
-            db.session.commit()
+            db.session.flush()
             
             current_app.logger.info(f"تم إنشاء المنتج بنجاح بمعرف: {new_product.id}")
-
-            files = request.files.getlist('product_images[]')
-            primary_image_index = request.form.get('primary_image', '0')
-            
-            current_app.logger.info(f"عدد الصور المرفقة: {len(files)}")
             
-
-            file_names = [f.filename for f in files if f and f.filename]
-            current_app.logger.info(f"أسماء الملفات المرفقة: {file_names}")
-            
-            has_images = False
-            
-            for i, file in enumerate(files):
-                if file and file.filename:
-                    has_images = True
-                    current_app.logger.info(f"معالجة الصورة {i+1} من {len(files)}: {file.filename}")
-         
-                    result = ImageService.upload_file(file, folder='products')
-                    
-                    if result:
-                        current_app.logger.info(f"تم رفع الصورة {i+1} بنجاح: {result['id']}")
-                        
-              
-                        is_primary = (str(i) == primary_image_index)
-                        
-                        image = ProductImage(
-                            cloudflare_id=result['id'],
-                            url=result['url'],
-                            product_id=new_product.id,
-                            is_primary=is_primary
-                        )
-                        db.session.add(image)
-                    else:
-                        current_app.logger.error(f"فشل في رفع الصورة {i+1}: {file.filename}")
+            for (i, file), result in zip(indexed_files, results):
+                current_app.logger.info(f"تم رفع الصورة {i+1} بنجاح: {result['id']}")
+                image = ProductImage(
+                    cloudflare_id=result['id'],
+                    url=result['url'],
+                    product_id=new_product.id,
+                    is_primary=(str(i) == primary_image_index)
+                )
+                db.session.add(image)
             
-            if not has_images:
+            if not indexed_files:
                 current_app.logger.warning(f"المنتج {new_product.id} ليس له صور")
 
             for i in range(20):
@@ -890,6 +876,8 @@ def create():
         
         except Exception as e:
             db.session.rollback()
+            for result in uploaded_images:
+                ImageService.release_image(result['id'], folder='products')
             current_app.logger.error(f"خطأ في إضافة المنتج: {str(e)}", exc_info=True)
             flash('حدث خطأ أثناء إضافة المنتج. يرجى المحاولة مرة أخرى.', 'danger')
     
@@ -918,6 +906,28 @@ def edit(product_id):
         return redirect(url_for('products.view', product_id=product_id))
 
     if request.method == 'POST':
+        from .models import ProductImage
+        from .image_service import ImageService
+        
+        # الصور الجديدة تُرفع بالتوازي بنفس مسار إنشاء المنتج
+        indexed_files = [(i, file) for i, file in enumerate(request.files.getlist('product_images[]')) if file and file.filename]
+        if indexed_files:
+            results = ImageService.upload_many([file for _, file in indexed_files], folder='products')
+            if results is None:
+                flash('فشل رفع بعض الصور، يرجى المحاولة مرة أخرى', 'danger')
+                return redirect(url_for('products.edit', product_id=product_id))
+            
+            primary_image_index = request.form.get('primary_image', '0')
+            has_primary = any(image.is_primary for image in product.images)
+            for (i, file), result in zip(indexed_files, results):
+                db.session.add(ProductImage(
+                    cloudflare_id=result['id'],
+                    url=result['url'],
+                    product_id=product.id,
+                    is_primary=not has_primary and str(i) == primary_image_index
+                ))
+            db.session.commit()
+        
         flash('تم تعديل المنتج بنجاح', 'success')
         return redirect(url_for('products.view', product_id=product_id))
 
@@ -1117,6 +1127,9 @@ def verify_email(code):
         
         from .main import db
         db.session.commit()
+
+        from .identity import invalidate_user
+        invalidate_user(g.current_user.id)
         
         # تسجيل النشاط
         from .main import log_activity
@@ -1157,9 +1170,9 @@ def profile():
         flash('يجب تسجيل الدخول لعرض الملف الشخصي', 'warning')
         return redirect(url_for('auth.login', next=request.path))
 
+    from .models import get_ratings
     user = g.current_user
-    user.rating = user.calculate_rating()
-    user.reviews_count = len(user.reviews_received)
+    user.rating, user.reviews_count = get_ratings([user.id])[user.id]
     user.active_products_count = len([p for p in user.products if p.is_active and not p.is_sold])
     user.sold_products_count = len([p for p in user.products if p.is_sold])
     
@@ -1180,8 +1193,8 @@ def public_profile(user_id):
 
     user_products = Product.query.filter_by(seller_id=user_id, is_active=True, is_sold=False).order_by(Product.created_at.desc()).limit(6).all()
 
-    user.rating = user.calculate_rating()
-    user.reviews_count = len(user.reviews_received)
+    from .models import get_ratings
+    user.rating, user.reviews_count = get_ratings([user.id])[user.id]
     user.active_products_count = len([p for p in user.products if p.is_active and not p.is_sold])
     user.sold_products_count = len([p for p in user.products if p.is_sold])
 
@@ -1344,13 +1357,11 @@ def update_profile():
                 
                 current_app.logger.info(f"تم رفع الصورة بنجاح: معرّف={result['id']}, رابط={result['url']}")
                 
-                # حذف الصورة القديمة
+                # حذف الصورة القديمة في الخلفية بعد حفظ التغييرات
                 if old_image_id:
-                    try:
-                        ImageService.delete_image(old_image_id, folder='users')
-                        current_app.logger.info(f"تم حذف الصورة القديمة: {old_image_id}")
-                    except Exception as e:
-                        current_app.logger.warning(f"فشل في حذف الصورة القديمة: {str(e)}")
+                    from .image_queue import image_queue
+                    image_queue.enqueue(old_image_id, folder='users')
+                    current_app.logger.info(f"تمت جدولة حذف الصورة القديمة: {old_image_id}")
                 
                 # تسجيل النشاط
                 from .main import log_activity
@@ -1378,6 +1389,9 @@ def update_profile():
     # حفظ التغييرات في قاعدة البيانات
     from .main import db
     db.session.commit()
+
+    from .identity import invalidate_user
+    invalidate_user(g.current_user.id)
     
     flash('تم تحديث الملف الشخصي بنجاح', 'success')
     return redirect(url_for('user.profile'))
@@ -1524,16 +1538,17 @@ def change_profile_image():
             # لتصحيح المشكلة: نحتفظ أيضًا برابط URL بشكل مباشر لمدة مؤقتة للتحقق
             g.current_user.profile_image_url = result['url']
             
+            # حذف الصورة القديمة في الخلفية بعد حفظ التغييرات
+            if old_image_id:
+                from .image_queue import image_queue
+                image_queue.enqueue(old_image_id, folder='users')
+                current_app.logger.info(f"تمت جدولة حذف الصورة القديمة: {old_image_id}")
+            
             # حفظ التغييرات في قاعدة البيانات
             db.session.commit()
-            
-            # حذف الصورة القديمة
-            if old_image_id:
-                try:
-                    ImageService.delete_image(old_image_id, folder='users')
-                    current_app.logger.info(f"تم حذف الصورة القديمة: {old_image_id}")
-                except Exception as e:
-                    current_app.logger.warning(f"فشل في حذف الصورة القديمة: {str(e)}")
+
+            from .identity import invalidate_user
+            invalidate_user(g.current_user.id)
             
             # تسجيل النشاط
             from .main import log_activity
@@ -1589,9 +1604,12 @@ def delete_account():
         
     
         from .models import Product
+        from .image_queue import image_queue
         products = Product.query.filter_by(seller_id=user_id).all()
         for product in products:
         
+            for image in product.images:
+                image_queue.enqueue(image.cloudflare_id, folder='products')
             product.is_active = False
             db.session.delete(product)  # اختياري: حذف المنتجات بالكامل
         
@@ -1616,8 +1634,7 @@ def delete_account():
         
   
         if g.current_user.profile_image:
-            from .image_service import ImageService
-            ImageService.delete_image(g.current_user.profile_image, folder='users')
+            image_queue.enqueue(g.current_user.profile_image, folder='users')
 
         from .main import log_activity
         log_activity(
@@ -1630,11 +1647,13 @@ def delete_account():
         )
         
 
-        db.session.delete(g.current_user)
+        db.session.delete(g.current_user.load())
         db.session.commit()
         
 
-        session.pop('auth_token', None)
+        from .identity import forget_token, invalidate_user
+        invalidate_user(user_id)
+        forget_token(session.pop('auth_token', None))
         
         flash('تم حذف الحساب بنجاح', 'success')
         return redirect(url_for('main.index'))
@@ -1915,7 +1934,9 @@ def mark_as_sold(product_id):
 @auth_bp.route('/logout', methods=['POST'])
 def logout():
     """تسجيل الخروج"""
-    session.pop('auth_token', None)
+    from .identity import forget_token, invalidate_user
+    forget_token(session.pop('auth_token', None))
+    invalidate_user(g.current_user.id)
     
     flash('تم تسجيل الخروج بنجاح', 'success')
     return redirect(url_for('main.index'))
@@ -2115,25 +2136,26 @@ def chat(user_id):
     if product_id:
         product = Product.query.get(product_id)
     
-    # جلب الرسائل بين المستخدمين والمتعلقة بالمنتج المحدد
-    messages_query = Message.query.filter(
-        ((Message.sender_id == g.current_user.id) & (Message.receiver_id == user_id)) |
-        ((Message.sender_id == user_id) & (Message.receiver_id == g.current_user.id))
-    )
-    
-    if product_id:
-        messages_query = messages_query.filter(Message.product_id == product_id)
-    
-    messages = messages_query.order_by(Message.created_at).all()
-    
+    from .messaging import conversation_filter, get_history, has_unread, mark_read
+    from .realtime import notify_read
+
     # تحديث حالة القراءة للرسائل الواردة
-    for message in messages:
-        if message.receiver_id == g.current_user.id and not message.is_read:
-            message.is_read = True
-    
-    db.session.commit()
+    if has_unread(g.current_user.id, user_id, product_id):
+        rows = mark_read(g.current_user.id, conversation_filter(g.current_user.id, user_id, product_id))
+        db.session.commit()
+        notify_read(g.current_user.id, rows)
+
+    # آخر رسائل المحادثة فقط، والأقدم منها تُحمّل عند الطلب
+    messages, has_older = get_history(g.current_user.id, user_id, product_id=product_id)
     
-    return render_template('messages/chat.html', user=user, messages=messages, product_id=product_id, product=product)
+    return render_template(
+        'messages/chat.html',
+        user=user,
+        messages=messages,
+        has_older=has_older,
+        product_id=product_id,
+        product=product
+    )
 
 
 @messages_bp.route('/conversations')
@@ -2143,61 +2165,10 @@ def conversations():
         flash('يجب تسجيل الدخول للوصول إلى المراسلات', 'warning')
         return redirect(url_for('auth.login', next=request.path))
     
-    from .models import User, Message, Product
-    from sqlalchemy import func, desc, or_, case, distinct
-    
-    # استعلام لجلب محادثات فريدة بناءً على المستخدم والمنتج
-    subquery = db.session.query(
-        func.max(Message.id).label('msg_id'),
-        case(
-            (Message.sender_id == g.current_user.id, Message.receiver_id),
-            else_=Message.sender_id
-        ).label('other_user_id'),
-        Message.product_id.label('product_id')
-    ).filter(
-        or_(Message.sender_id == g.current_user.id, Message.receiver_id == g.current_user.id)
-    ).group_by(
-        case(
-            (Message.sender_id == g.current_user.id, Message.receiver_id),
-            else_=Message.sender_id
-        ),
-        Message.product_id
-    ).subquery()
-    
-    # استعلام لجلب معلومات المحادثات
-    conversations_query = db.session.query(
-        User,
-        Message,
-        func.count(Message.id).filter(
-            Message.receiver_id == g.current_user.id,
-            Message.is_read == False,
-            Message.product_id == subquery.c.product_id
-        ).label('unread_count')
-    ).join(
-        subquery, subquery.c.other_user_id == User.id
-    ).join(
-        Message, Message.id == subquery.c.msg_id
-    ).order_by(
-        desc(Message.created_at)
-    )
+    from .conversations import get_inbox
     
-    conversations = []
-    for user, last_message, unread_count in conversations_query.all():
-        # Skip conversations where user is None
-        if not user:
-            continue
-            
-        # جلب معلومات المنتج المرتبط إذا وجد
-        product = None
-        if last_message and last_message.product_id:
-            product = Product.query.get(last_message.product_id)
-        
-        conversations.append({
-            'other_user': user,
-            'last_message': last_message,
-            'unread_count': unread_count,
-            'product': product
-        })
+    # المحادثات من جدول الملخص: آخر رسالة وعدد غير المقروء محفوظان مع كل محادثة
+    conversations = get_inbox(g.current_user.id)
     
     return render_template('messages/conversations.html', conversations=conversations)
 
@@ -2248,18 +2219,14 @@ def mark_as_read():
         return jsonify({'success': False, 'message': 'لم يتم تحديد رسائل'}), 400
     
     from .models import Message
-    messages = Message.query.filter(
-        Message.id.in_(message_ids),
-        Message.receiver_id == g.current_user.id,
-        Message.is_read == False
-    ).all()
-    
-    for message in messages:
-        message.is_read = True
-    
+    from .messaging import mark_read
+    from .realtime import notify_read
+
+    rows = mark_read(g.current_user.id, Message.id.in_(message_ids))
     db.session.commit()
+    notify_read(g.current_user.id, rows)
     
-    return jsonify({'success': True, 'count': len(messages)})
+    return jsonify({'success': True, 'count': len(rows)})
 
 
 
@@ -2269,11 +2236,8 @@ def get_unread_count():
     if not g.current_user or not g.current_user.is_authenticated:
         return jsonify({'success': False, 'message': 'غير مصرح'})
     
-    from .models import Message
-    count = Message.query.filter_by(
-        receiver_id=g.current_user.id,
-        is_read=False
-    ).count()
+    from .unread import unread_total
+    count = unread_total(g.current_user.id)
     
     return jsonify({'success': True, 'unread_count': count})
 
@@ -2283,11 +2247,8 @@ def get_unread_message_count_v2():  # Changed function name
     if not g.current_user or not g.current_user.is_authenticated:
         return jsonify({'success': False, 'message': 'غير مصرح'})
     
-    from .models import Message
-    count = Message.query.filter_by(
-        receiver_id=g.current_user.id,
-        is_read=False
-    ).count()
+    from .unread import unread_total
+    count = unread_total(g.current_user.id)
     
     return jsonify({'success': True, 'unread_count': count})
 
@@ -2296,7 +2257,9 @@ def unread_count():
     """عدد الرسائل غير المقروءة"""
     if not g.current_user or not g.current_user.is_authenticated:
         return jsonify({'success': False, 'message': 'غير مصرح'})
-    unread_count = 0
+
+    from .unread import unread_total
+    unread_count = unread_total(g.current_user.id)
     
     return jsonify({'success': True, 'unread_count': unread_count})
 
@@ -2306,14 +2269,16 @@ def unread_count():
 def dashboard(current_user):
     """لوحة التحكم الرئيسية"""
     # إحصائيات عامة
-    from .models import User, Product, Report, Message, AuditLog
+    from .models import Report, AuditLog
+    from .counters import get_counters
+    counters = get_counters()
     stats = {
-        'users_count': User.query.count(),
-        'products_count': Product.query.count(),
-        'reports_count': Report.query.count(),
-        'sales_count': Product.query.filter_by(is_sold=True).count(),
-        'active_users': User.query.filter_by(is_online=True).count(),
-        'pending_reports': Report.query.filter_by(status='pending').count()
+        'users_count': counters['users'],
+        'products_count': counters['products'],
+        'reports_count': counters['reports'],
+        'sales_count': counters['sold_products'],
+        'active_users': counters['online_users'],
+        'pending_reports': counters['pending_reports']
     }
     
     # آخر النشاطات
@@ -2331,7 +2296,6 @@ def dashboard(current_user):
 @admin_required
 def users(current_user):
     """إدارة المستخدمين"""
-    page = request.args.get('page', 1, type=int)
     per_page = 20
     search_query = request.args.get('search', '')
     status = request.args.get('status', '')
@@ -2342,10 +2306,14 @@ def users(current_user):
     
     # تطبيق الفلاتر
     if search_query:
-        query = query.filter(db.or_(
-            User.name.like(f'%{search_query}%'),
-            User.email.like(f'%{search_query}%')
-        ))
+        from .search import search_text_filter
+        condition = search_text_filter(User.search_text, search_query)
+        if condition is None:
+            condition = db.or_(
+                User.name.like(f'%{search_query}%'),
+                User.email.like(f'%{search_query}%')
+            )
+        query = query.filter(condition)
     
     if status == 'active':
         query = query.filter_by(is_banned=False)
@@ -2359,11 +2327,9 @@ def users(current_user):
     elif verified == '0':
         query = query.filter_by(is_verified=False)
     
-    # ترتيب النتائج
-    query = query.order_by(User.created_at.desc())
-    
-    # تقسيم النتائج
-    users_paginated = query.paginate(page=page, per_page=per_page)
+    # تقسيم النتائج بالمؤشر مرتبة من الأحدث
+    from .pagination import paginate
+    users_paginated = paginate(query, (User.created_at, User.id), per_page=per_page, with_total=True)
     
     return render_template(
         'admin/users.html', 
@@ -2379,7 +2345,6 @@ def users(current_user):
 @admin_required
 def products(current_user):
     """إدارة المنتجات"""
-    page = request.args.get('page', 1, type=int)
     per_page = 20
     search_query = request.args.get('search', '')
     selected_category_id = request.args.get('category_id')
@@ -2391,10 +2356,14 @@ def products(current_user):
     
     # تطبيق الفلاتر
     if search_query:
-        query = query.filter(db.or_(
-            Product.title.like(f'%{search_query}%'),
-            Product.description.like(f'%{search_query}%')
-        ))
+        from .search import search_text_filter
+        condition = search_text_filter(Product.search_text, search_query)
+        if condition is None:
+            condition = db.or_(
+                Product.title.like(f'%{search_query}%'),
+                Product.description.like(f'%{search_query}%')
+            )
+        query = query.filter(condition)
     
     if selected_category_id:
         query = query.filter_by(category_id=selected_category_id)
@@ -2410,14 +2379,21 @@ def products(current_user):
     
     # ترتيب النتائج
     if sort_by == 'price':
-        query = query.order_by(Product.price.asc())
+        order_column, descending = Product.price, False
     elif sort_by == 'views':
-        query = query.order_by(Product.views_count.desc())
+        order_column, descending = Product.views_count, True
     else:  # created_at
-        query = query.order_by(Product.created_at.desc())
+        order_column, descending = Product.created_at, True
     
     # تقسيم النتائج
-    products_paginated = query.paginate(page=page, per_page=per_page)
+    from .pagination import paginate
+    products_paginated = paginate(
+        query,
+        (order_column, Product.id),
+        descending=descending,
+        per_page=per_page,
+        with_total=True
+    )
     
     # الحصول على التصنيفات للفلتر
     categories = Category.query.filter_by(parent_id=None).all()
@@ -2632,6 +2608,9 @@ def ban_user(current_user):
     )
     
     db.session.commit()
+
+    from .identity import invalidate_user
+    invalidate_user(user.id)
     
     flash('تم حظر المستخدم بنجاح', 'success')
     return redirect(url_for('admin.users'))
@@ -2663,6 +2642,9 @@ def unban_user(current_user):
     )
     
     db.session.commit()
+
+    from .identity import invalidate_user
+    invalidate_user(user.id)
     
     flash('تم إلغاء حظر المستخدم بنجاح', 'success')
     return redirect(url_for('admin.users'))
@@ -2702,7 +2684,6 @@ def verify_user(current_user):
 @admin_required
 def logs(current_user):
     """سجلات النظام"""
-    page = request.args.get('page', 1, type=int)
     per_page = 20
     action = request.args.get('action')
     entity_type = request.args.get('entity_type')
@@ -2730,11 +2711,9 @@ def logs(current_user):
         next_day = date_obj + timedelta(days=1)
         query = query.filter(AuditLog.created_at >= date_obj, AuditLog.created_at < next_day)
     
-    # ترتيب النتائج
-    query = query.order_by(AuditLog.created_at.desc())
-    
-    # تقسيم النتائج
-    logs_paginated = query.paginate(page=page, per_page=per_page)
+    # تقسيم النتائج بالمؤشر مرتبة من الأحدث
+    from .pagination import paginate
+    logs_paginated = paginate(query, (AuditLog.created_at, AuditLog.id), per_page=per_page)
     
     return render_template(
         'admin/logs.html', 
@@ -2821,7 +2800,6 @@ def delete_category(current_user):
 @admin_required
 def reports(current_user):
     """إدارة البلاغات"""
-    page = request.args.get('page', 1, type=int)
     per_page = 20
     status = request.args.get('status')
     type = request.args.get('type')
@@ -2850,11 +2828,9 @@ def reports(current_user):
                          Product.title.like(f'%{search_query}%')
                      )))
     
-    # ترتيب النتائج
-    query = query.order_by(Report.created_at.desc())
-    
-    # تقسيم النتائج
-    reports_paginated = query.paginate(page=page, per_page=per_page)
+    # تقسيم النتائج بالمؤشر مرتبة من الأحدث
+    from .pagination import paginate
+    reports_paginated = paginate(query, (Report.created_at, Report.id), per_page=per_page, with_total=True)
     
     return render_template(
         'admin/reports.html',
@@ -2882,36 +2858,8 @@ def report_details(current_user, report_id):
 @main_bp.before_app_request
 def before_request():
     """التحقق من المستخدم الحالي قبل كل طلب"""
-    g.current_user = None
-    
-
-    token = None
-    if 'auth_token' in session:
-        token = session['auth_token']
-    elif 'Authorization' in request.headers:
-        auth_header = request.headers['Authorization']
-        if auth_header.startswith('Bearer '):
-            token = auth_header.split(' ')[1]
-
-    if token:
-        try:
-            from .models import User
-            data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
-            user = User.query.get(data['user_id'])
-            
-            if user and not user.is_banned:
-                g.current_user = user
-                return
-        except:
-            pass
-    g.current_user = type('AnonymousUser', (), {
-        'is_authenticated': False,
-        'id': None,
-        'is_admin': False,
-        'name': 'زائر',
-        'profile_image': None,
-        'location': None
-    })()
+    from .identity import load_current_user
+    g.current_user = load_current_user()
 
 
 @auth_bp.route('/facebook_login')
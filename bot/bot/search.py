@@ -0,0 +1,224 @@
+from datetime import datetime
+from sqlalchemy import text, func, select, table, column, literal_column, and_
+from . import db
+from .text_normalization import NORMALIZER_VERSION, tokenize
+from .upsert import upsert
+
+
+class LikeSearchBackend:
+    """بحث احتياطي باستخدام LIKE عند عدم توفر فهرس نصي في قاعدة البيانات"""
+
+    name = 'like'
+
+    def setup(self, connection):
+        pass
+
+    def rebuild(self, connection):
+        pass
+
+    def apply(self, query, search_query):
+        from .models import Product
+
+        condition = search_text_filter(Product.search_text, search_query)
+        if condition is None:
+            return query.filter(
+                Product.title.ilike(f'%{search_query}%') | Product.description.ilike(f'%{search_query}%')
+            ), None
+
+        return query.filter(condition), None
+
+
+class SQLiteFTSSearchBackend:
+    """فهرس FTS5 في SQLite على عمود search_text الموحد، متزامن مع جدول المنتجات عبر المشغلات (triggers)"""
+
+    name = 'sqlite_fts5'
+
+    triggers = ('product_fts_ai', 'product_fts_ad', 'product_fts_au')
+
+    statements = [
+        """CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5(
+            search_text,
+            content='product', content_rowid='id',
+            tokenize='unicode61'
+        )""",
+        """CREATE TRIGGER IF NOT EXISTS product_fts_ai AFTER INSERT ON product BEGIN
+            INSERT INTO product_fts(rowid, search_text) VALUES (new.id, new.search_text);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS product_fts_ad AFTER DELETE ON product BEGIN
+            INSERT INTO product_fts(product_fts, rowid, search_text) VALUES ('delete', old.id, old.search_text);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS product_fts_au AFTER UPDATE OF search_text ON product BEGIN
+            INSERT INTO product_fts(product_fts, rowid, search_text) VALUES ('delete', old.id, old.search_text);
+            INSERT INTO product_fts(rowid, search_text) VALUES (new.id, new.search_text);
+        END""",
+    ]
+
+    def setup(self, connection):
+        exists = connection.execute(
+            text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'product_fts'")
+        ).first()
+
+        # الفهرس القديم كان على العنوان والوصف مباشرة قبل إضافة search_text
+        if exists and 'search_text' not in exists[0]:
+            for trigger in self.triggers:
+                connection.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+            connection.execute(text("DROP TABLE product_fts"))
+            exists = None
+
+        for statement in self.statements:
+            connection.execute(text(statement))
+
+        if not exists:
+            self.rebuild(connection)
+
+    def rebuild(self, connection):
+        connection.execute(text("INSERT INTO product_fts(product_fts) VALUES ('rebuild')"))
+
+    def apply(self, query, search_query):
+        from .models import Product
+
+        terms = tokenize(search_query)
+        if not terms:
+            return LikeSearchBackend().apply(query, search_query)
+
+        match = ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+        fts = table('product_fts', column('rowid'))
+        ranked = select(
+            fts.c.rowid.label('product_id'),
+            func.bm25(literal_column('product_fts')).label('rank')
+        ).where(literal_column('product_fts').op('MATCH')(match)).subquery()
+
+        query = query.join(ranked, ranked.c.product_id == Product.id)
+        return query, ranked.c.rank.asc()
+
+
+class PostgresSearchBackend:
+    """بحث نصي في PostgreSQL باستخدام tsvector وفهرس GIN على عمود search_text الموحد"""
+
+    name = 'postgres_tsvector'
+
+    def document_sql(self, prefix=''):
+        return f"to_tsvector('simple', coalesce({prefix}search_text, ''))"
+
+    def setup(self, connection):
+        connection.execute(text("DROP INDEX IF EXISTS ix_product_search_document"))
+        connection.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_product_search_text ON product USING GIN ({self.document_sql()})"
+        ))
+
+    def rebuild(self, connection):
+        connection.execute(text("REINDEX INDEX ix_product_search_text"))
+
+    def apply(self, query, search_query):
+        terms = tokenize(search_query)
+        if not terms:
+            return LikeSearchBackend().apply(query, search_query)
+
+        document = literal_column(self.document_sql('product.'))
+        ts_query = func.to_tsquery('simple', ' & '.join(f'{term}:*' for term in terms))
+
+        query = query.filter(document.op('@@')(ts_query))
+        return query, func.ts_rank(document, ts_query).desc()
+
+
+_backend = LikeSearchBackend()
+
+
+def search_text_filter(column, search_query):
+    """شرط LIKE على عمود search_text الموحد لكل كلمة من كلمات البحث"""
+    terms = tokenize(search_query)
+    if not terms:
+        return None
+    return and_(*[column.like(f'%{term}%') for term in terms])
+
+
+def get_search_backend():
+    return _backend
+
+
+def init_search(app):
+    """اختيار محرك البحث المناسب لقاعدة البيانات وتهيئة الفهرس"""
+    global _backend
+
+    backend_name = app.config.get('SEARCH_BACKEND', 'auto')
+    dialect = db.engine.dialect.name
+
+    if backend_name == 'like':
+        backend = LikeSearchBackend()
+    elif dialect == 'sqlite':
+        backend = SQLiteFTSSearchBackend()
+    elif dialect == 'postgresql':
+        backend = PostgresSearchBackend()
+    else:
+        backend = LikeSearchBackend()
+
+    try:
+        with db.engine.begin() as connection:
+            backend.setup(connection)
+        _backend = backend
+        app.logger.info(f"تم تهيئة محرك البحث: {backend.name}")
+    except Exception as e:
+        _backend = LikeSearchBackend()
+        app.logger.warning(f"تعذر تهيئة الفهرس النصي ({backend.name})، سيتم استخدام LIKE: {str(e)}")
+
+    try:
+        sync_normalizer_version(app)
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"فشل في إعادة بناء نصوص البحث بعد تغيير قواعد التوحيد: {str(e)}")
+
+
+def sync_normalizer_version(app):
+    """إعادة بناء search_text والفهرس إذا بُنيت بإصدار مختلف من قواعد التوحيد، حتى لا تختلف جذوع الفهرس عن جذوع البحث"""
+    from .models import Product, SearchIndexState, User
+
+    stored = db.session.query(SearchIndexState.normalizer_version).filter_by(name='product').scalar()
+    if stored == NORMALIZER_VERSION:
+        return
+
+    if Product.query.first() is not None or User.query.first() is not None:
+        app.logger.info(f"تغير إصدار توحيد النص ({stored} -> {NORMALIZER_VERSION})، جاري إعادة بناء نصوص البحث")
+        rebuild_search_index()
+
+    table = SearchIndexState.__table__
+    with db.engine.begin() as connection:
+        upsert(connection, table, {'name': 'product'}, {
+            'normalizer_version': NORMALIZER_VERSION,
+            'updated_at': datetime.utcnow()
+        })
+
+
+def refresh_search_text(batch_size=500):
+    """إعادة حساب أعمدة search_text الموحدة للمنتجات والمستخدمين"""
+    from .models import Product, User
+    from .text_normalization import build_search_text
+
+    updated = 0
+    for model, fields in ((Product, ('title', 'description')), (User, ('name', 'email'))):
+        columns = [getattr(model, field) for field in fields]
+        rows = db.session.query(model.id, model.search_text, *columns).yield_per(batch_size)
+
+        changes = []
+        for row in rows:
+            search_text = build_search_text(*row[2:])
+            if search_text != row.search_text:
+                changes.append({'id': row.id, 'search_text': search_text})
+
+        for start in range(0, len(changes), batch_size):
+            db.session.bulk_update_mappings(model, changes[start:start + batch_size])
+        db.session.commit()
+        updated += len(changes)
+
+    return updated
+
+
+def rebuild_search_index():
+    """إعادة بناء الفهرس النصي للمنتجات بالكامل"""
+    refresh_search_text()
+    with db.engine.begin() as connection:
+        _backend.rebuild(connection)
+
+
+def search_products(query, search_query):
+    """تطبيق البحث النصي على استعلام المنتجات، مع إرجاع ترتيب الصلة إن وجد"""
+    return _backend.apply(query, search_query)
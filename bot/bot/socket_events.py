@@ -2,6 +2,8 @@ from flask import request, session, g
 from flask_socketio import emit, join_room, leave_room
 from . import socketio, db
 from .models import User, Message
+from .messaging import mark_read
+from .realtime import emit_unread_count
 from datetime import datetime
 
 @socketio.on('connect')
@@ -102,6 +104,7 @@ def handle_send_message(data):
           
             emit('receive_message', formatted_message, room=f"user_{sender_id}")
             emit('receive_message', formatted_message, room=f"user_{receiver_id}")
+            emit_unread_count(receiver_id)
             
             return {"status": "success", "message": formatted_message}
         except Exception as e:
@@ -129,21 +132,15 @@ def handle_mark_as_read(data):
                 return {"status": "error", "message": "No se proporcionaron IDs de mensajes"}
             
         
-            messages = Message.query.filter(
-                Message.id.in_(message_ids),
-                Message.receiver_id == user_id,
-                Message.is_read == False
-            ).all()
-            
-            for message in messages:
-                message.is_read = True
-            
+            rows = mark_read(user_id, Message.id.in_(message_ids))
             db.session.commit()
 
-            for message in messages:
-                emit('message_read', {'message_id': message.id}, room=f"user_{message.sender_id}")
+            for message_id, sender_id, _ in rows:
+                emit('message_read', {'message_id': message_id}, room=f"user_{sender_id}")
+            if rows:
+                emit_unread_count(user_id)
             
-            return {"status": "success", "count": len(messages)}
+            return {"status": "success", "count": len(rows)}
         except Exception as e:
             from flask import current_app
             current_app.logger.error(f"Error al marcar mensajes como leídos: {str(e)}")
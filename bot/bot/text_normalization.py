@@ -0,0 +1,84 @@
+import re
+import unicodedata
+
+
+# التشكيل وعلامات القرآن والمدة الخنجرية
+DIACRITICS_RE = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed]')
+TATWEEL = '\u0640'
+TOKEN_RE = re.compile(r'\w+')
+
+# يجب زيادته عند أي تغيير في قواعد التوحيد أو التجذيع، ليُعاد حساب search_text والفهرس تلقائياً عند التشغيل
+NORMALIZER_VERSION = 2
+
+LETTER_MAP = str.maketrans({
+    'أ': 'ا',
+    'إ': 'ا',
+    'آ': 'ا',
+    'ٱ': 'ا',
+    'ى': 'ي',
+    'ئ': 'ي',
+    'ی': 'ي',
+    'ؤ': 'و',
+    'ة': 'ه',
+    'ک': 'ك',
+    '٠': '0', '١': '1', '٢': '2', '٣': '3', '٤': '4',
+    '٥': '5', '٦': '6', '٧': '7', '٨': '8', '٩': '9',
+})
+
+# أدوات التعريف وحروف الجر المتصلة بها، مرتبة من الأطول إلى الأقصر
+ARTICLE_PREFIXES = ('بال', 'كال', 'فال', 'لل', 'ال')
+CONJUNCTION = 'و'
+
+# أقل طول للجذع بعد إزالة سابقة مركبة (بال، لل، و+ال...) وبعد إزالة ال وحدها
+MIN_STEM_LENGTH = 3
+MIN_ARTICLE_STEM_LENGTH = 2
+# لا تُزال الواو إلا إذا بقيت بعدها كلمة من 4 أحرف على الأقل، لأنها غالباً من أصل الكلمة في الكلمات الأقصر (ورد، ولد، وكيل)
+MIN_CONJUNCTION_STEM_LENGTH = 4
+
+
+def normalize_text(text):
+    """توحيد النص العربي: إزالة التشكيل والتطويل وتوحيد أشكال الألف والياء والتاء المربوطة"""
+    if not text:
+        return ''
+
+    text = unicodedata.normalize('NFKC', text)
+    text = DIACRITICS_RE.sub('', text).replace(TATWEEL, '')
+    return text.translate(LETTER_MAP).casefold()
+
+
+def _strip_article(token):
+    for prefix in ARTICLE_PREFIXES:
+        min_length = MIN_ARTICLE_STEM_LENGTH if prefix == 'ال' else MIN_STEM_LENGTH
+        if token.startswith(prefix) and len(token) - len(prefix) >= min_length:
+            return token[len(prefix):]
+    return token
+
+
+def _strip_conjunction(token):
+    rest = token[len(CONJUNCTION):]
+    if token.startswith(CONJUNCTION) and len(rest) >= MIN_CONJUNCTION_STEM_LENGTH and not rest.startswith('ال'):
+        return rest
+    return token
+
+
+def stem_token(token):
+    """تجذيع خفيف بإزالة أداة التعريف (ال، بال، لل...) وواو العطف، بنفس القواعد سواء سبقت الواو ال أم لا"""
+    stem = _strip_article(token)
+
+    if stem == token and token.startswith(CONJUNCTION + 'ال'):
+        # واو العطف قبل أداة التعريف (والسيارة)، بشرط أن يبقى جذع صالح وإلا فالواو من أصل الكلمة (والد)
+        rest = _strip_article(token[len(CONJUNCTION):])
+        if rest != token[len(CONJUNCTION):] and len(rest) >= MIN_STEM_LENGTH:
+            stem = rest
+
+    return _strip_conjunction(stem)
+
+
+def tokenize(text):
+    """تقسيم النص إلى كلمات موحدة ومجذعة، يستخدم عند الفهرسة وعند البحث"""
+    return [stem_token(token) for token in TOKEN_RE.findall(normalize_text(text))]
+
+
+def build_search_text(*parts):
+    """بناء النص الموحد المخزن في أعمدة search_text"""
+    return ' '.join(tokenize(' '.join(part for part in parts if part)))
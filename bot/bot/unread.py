@@ -0,0 +1,161 @@
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+from . import db
+from .conversations import conversation_key, upsert_conversation
+from .upsert import upsert
+
+
+def _committed(obj, field):
+    """قيمة الحقل كما هي في قاعدة البيانات قبل تعديلات هذه الجلسة"""
+    history = db.inspect(obj).attrs[field].history
+    if history.has_changes():
+        return history.deleted[0] if history.deleted else None
+    return getattr(obj, field)
+
+
+def collect_unread_deltas(session):
+    """حساب التغير في عدد الرسائل غير المقروءة لكل (مستقبل، مرسل، منتج) من الرسائل المضافة والمحذوفة والمعدلة"""
+    from .models import Message
+
+    deltas = {}
+
+    def add(receiver_id, sender_id, product_id, is_read, count):
+        if receiver_id is None or is_read:
+            return
+        key = (receiver_id, sender_id, product_id or 0)
+        deltas[key] = deltas.get(key, 0) + count
+
+    for message in session.new:
+        if isinstance(message, Message):
+            add(message.receiver_id, message.sender_id, message.product_id, message.is_read, 1)
+
+    for message in session.deleted:
+        if isinstance(message, Message):
+            add(
+                _committed(message, 'receiver_id'), _committed(message, 'sender_id'),
+                _committed(message, 'product_id'), _committed(message, 'is_read'), -1
+            )
+
+    for message in session.dirty:
+        if isinstance(message, Message) and session.is_modified(message):
+            add(
+                _committed(message, 'receiver_id'), _committed(message, 'sender_id'),
+                _committed(message, 'product_id'), _committed(message, 'is_read'), -1
+            )
+            add(message.receiver_id, message.sender_id, message.product_id, message.is_read, 1)
+
+    return {key: delta for key, delta in deltas.items() if delta}
+
+
+def apply_unread_deltas(connection, deltas, deleted_users=()):
+    """تطبيق التغيرات على عداد طرف المستقبل في جدول المحادثات وعلى المجموع لكل مستخدم
+
+    deleted_users: مستخدمون يُحذفون في نفس الدفعة، تُحذف محادثاتهم وعداداتهم بالكامل فلا تُحدّث،
+    لكن المجموع يبقى يُحدّث للمستقبل الباقي عند حذف رسائل مرسل محذوف.
+    """
+    from .models import Conversation, UnreadCount
+
+    totals = {}
+    conversation_table = Conversation.__table__
+
+    for (receiver_id, sender_id, product_key), delta in deltas.items():
+        if receiver_id not in deleted_users:
+            totals[receiver_id] = totals.get(receiver_id, 0) + delta
+        if receiver_id in deleted_users or sender_id in deleted_users:
+            continue
+        key = conversation_key(receiver_id, sender_id, product_key)
+        side = 'unread_low' if receiver_id == key[0] else 'unread_high'
+        upsert_conversation(
+            connection, key,
+            {side: conversation_table.c[side] + delta},
+            {side: delta}
+        )
+
+    total_table = UnreadCount.__table__
+    for user_id, delta in totals.items():
+        if not delta:
+            continue
+        upsert(connection, total_table, {'user_id': user_id}, {'count': total_table.c.count + delta}, {'count': delta})
+
+
+def read_deltas(receiver_id, rows):
+    """التغيرات الناتجة عن تحديد رسائل [(id, sender_id, product_id)] كمقروءة"""
+    deltas = {}
+    for _, sender_id, product_id in rows:
+        key = (receiver_id, sender_id, product_id or 0)
+        deltas[key] = deltas.get(key, 0) - 1
+    return deltas
+
+
+@event.listens_for(Session, 'before_flush')
+def track_unread_messages(session, flush_context, instances):
+    """تحديث عدادات الرسائل غير المقروءة داخل نفس المعاملة التي تضيف الرسالة أو تقرؤها أو تحذفها"""
+    from .models import UnreadCount, User
+
+    deleted_users = {obj.id for obj in session.deleted if isinstance(obj, User)}
+    deltas = collect_unread_deltas(session)
+    if not deltas and not deleted_users:
+        return
+
+    connection = session.connection()
+    # محادثات المستخدمين المحذوفين تُحذف بالكامل (conversations.remove_deleted_users_conversations)
+    apply_unread_deltas(connection, deltas, deleted_users)
+
+    # يجب حذف العداد قبل حذف المستخدم نفسه بسبب المفتاح الأجنبي
+    if deleted_users:
+        table = UnreadCount.__table__
+        connection.execute(table.delete().where(table.c.user_id.in_(deleted_users)))
+
+
+def unread_total(user_id):
+    """عدد الرسائل غير المقروءة للمستخدم من جدول العدادات (قراءة بالمفتاح الأساسي)"""
+    from .models import UnreadCount
+
+    count = db.session.query(UnreadCount.count).filter(UnreadCount.user_id == user_id).scalar()
+    return max(count or 0, 0)
+
+
+def compute_unread():
+    """حساب عدد الرسائل غير المقروءة لكل مستخدم من جدول الرسائل مباشرة"""
+    from .models import Message
+
+    return dict(
+        db.session.query(Message.receiver_id, func.count(Message.id))
+        .filter(Message.is_read == False)
+        .group_by(Message.receiver_id)
+        .all()
+    )
+
+
+def reconcile_unread():
+    """مقارنة العدادات المخزنة بالرسائل الفعلية وإعادة كتابتها مع عدادات المحادثات، مع إرجاع عدد المستخدمين المصححين"""
+    from .models import UnreadCount
+    from .conversations import rebuild_conversations
+
+    expected = compute_unread()
+    stored = dict(db.session.query(UnreadCount.user_id, UnreadCount.count))
+    mismatched = {
+        user_id for user_id in set(expected) | set(stored)
+        if expected.get(user_id, 0) != stored.get(user_id, 0)
+    }
+
+    table = UnreadCount.__table__
+    with db.engine.begin() as connection:
+        connection.execute(table.delete())
+        if expected:
+            connection.execute(table.insert(), [
+                {'user_id': user_id, 'count': count}
+                for user_id, count in expected.items()
+            ])
+
+    rebuild_conversations()
+    return len(mismatched)
+
+
+def init_unread(app):
+    """ملء جداول العدادات عند أول تشغيل بعد إضافتها إذا كانت هناك رسائل غير مقروءة سابقة"""
+    from .models import Message, UnreadCount
+
+    if UnreadCount.query.first() is None and Message.query.filter_by(is_read=False).first() is not None:
+        fixed = reconcile_unread()
+        app.logger.info(f"تم حساب عدادات الرسائل غير المقروءة لـ {fixed} مستخدم")
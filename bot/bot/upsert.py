@@ -0,0 +1,38 @@
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+
+# قواعد البيانات التي تدعم INSERT ... ON CONFLICT DO UPDATE
+ON_CONFLICT_INSERTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+}
+
+
+def upsert(connection, table, keys, values, insert_values=None):
+    """تحديث الصف ذي المفتاح keys بالقيم values، أو إنشاؤه بـ insert_values (أو values) إذا لم يكن موجوداً
+
+    يبقى صحيحاً عند التزامن: طلبان ينشئان نفس الصف في اللحظة نفسها لا يفشل أحدهما بتكرار المفتاح.
+    values قد تشير إلى القيم الحالية للصف (مثل table.c.count + 1).
+    """
+    insert_values = values if insert_values is None else insert_values
+
+    insert = ON_CONFLICT_INSERTS.get(connection.dialect.name)
+    if insert is not None:
+        connection.execute(
+            insert(table)
+            .values(**keys, **insert_values)
+            .on_conflict_do_update(index_elements=list(keys), set_=values)
+        )
+        return
+
+    where = [table.c[name] == value for name, value in keys.items()]
+    if connection.execute(table.update().where(*where).values(**values)).rowcount:
+        return
+
+    try:
+        with connection.begin_nested():
+            connection.execute(table.insert().values(**keys, **insert_values))
+    except IntegrityError:
+        # طلب آخر أنشأ الصف بين UPDATE و INSERT
+        connection.execute(table.update().where(*where).values(**values))
@@ -0,0 +1,105 @@
+import atexit
+import threading
+from sqlalchemy import bindparam, func
+from . import db
+from .cache import TTLCache
+
+
+# create_app قد يُستدعى أكثر من مرة في نفس العملية (الاختبارات، أوامر CLI)، فيُسجل الحفظ عند الإغلاق مرة واحدة
+_shutdown_registered = False
+
+
+class ViewCounter:
+    """عداد مشاهدات المنتجات بالكتابة المؤجلة: تُجمع الزيادات في الذاكرة وتُحفظ دفعة واحدة كل بضع ثوان"""
+
+    def __init__(self, flush_interval=5, dedup_window=1800, max_viewers=100000):
+        self.flush_interval = flush_interval
+        self.app = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._seen = TTLCache(max_size=max_viewers, ttl=dedup_window)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def init_app(self, app):
+        config = app.config.get('VIEW_COUNTER_CONFIG', {})
+        self.flush_interval = config.get('flush_interval', self.flush_interval)
+        self._seen.configure(max_size=config.get('max_viewers'), ttl=config.get('dedup_window'))
+        self.app = app
+
+        global _shutdown_registered
+        if not _shutdown_registered:
+            atexit.register(self.shutdown)
+            _shutdown_registered = True
+
+    def record(self, product_id, viewer_key):
+        """تسجيل مشاهدة، مع تجاهل تكرارها من نفس الزائر خلال نافذة dedup_window"""
+        key = (viewer_key, product_id)
+        if self._seen.get(key):
+            return False
+        self._seen.set(key, True)
+
+        with self._lock:
+            self._pending[product_id] = self._pending.get(product_id, 0) + 1
+
+        self._ensure_worker()
+        return True
+
+    def pending(self, product_id):
+        with self._lock:
+            return self._pending.get(product_id, 0)
+
+    def flush(self):
+        """حفظ الزيادات المتراكمة بتحديث مجمّع واحد: views_count = views_count + n"""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+
+        if not batch or self.app is None:
+            return 0
+
+        from .models import Product
+
+        table = Product.__table__
+        statement = table.update().where(table.c.id == bindparam('product_id')).values(
+            views_count=func.coalesce(table.c.views_count, 0) + bindparam('increment'),
+            # المشاهدة ليست تعديلاً على المنتج
+            updated_at=table.c.updated_at
+        )
+
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as connection:
+                    connection.execute(statement, [
+                        {'product_id': product_id, 'increment': increment}
+                        for product_id, increment in batch.items()
+                    ])
+        except Exception as e:
+            # إعادة الزيادات لمحاولة الحفظ في الدفعة التالية
+            with self._lock:
+                for product_id, increment in batch.items():
+                    self._pending[product_id] = self._pending.get(product_id, 0) + increment
+            self.app.logger.error(f"خطأ في حفظ عدادات المشاهدات: {str(e)}")
+            return 0
+
+        return sum(batch.values())
+
+    def shutdown(self):
+        """إيقاف الخيط الخلفي وحفظ ما تبقى عند إغلاق العملية"""
+        self._stop.set()
+        self.flush()
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='view-counter', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+
+view_counter = ViewCounter()
@@ -1,12 +1,13 @@
 import sys
 import os
 import traceback
+import click
 
 
 sys.path.append(os.path.abspath(os.path.dirname(__file__)))
 
 try:
-    from bot import create_app, db
+    from bot import create_app, db, socketio
 
     print("Intentando crear la aplicación Flask...")
     
@@ -31,6 +32,65 @@ try:
         create_initial_data()
         print("تم إنشاء البيانات الأولية بنجاح")
 
+    @app.cli.command("search-reindex")
+    def search_reindex():
+        """إعادة بناء فهرس البحث النصي للمنتجات"""
+        from bot.search import rebuild_search_index
+        rebuild_search_index()
+        print("تم إعادة بناء فهرس البحث بنجاح")
+
+    @app.cli.command("counters-rebuild")
+    def counters_rebuild():
+        """إعادة حساب عدادات إحصائيات الموقع من الجداول"""
+        from bot.counters import rebuild_counters
+        for name, value in rebuild_counters().items():
+            print(f"{name}: {value}")
+        print("تم إعادة بناء العدادات بنجاح")
+
+    @app.cli.command("images-delete-pending")
+    def images_delete_pending():
+        """تنفيذ مهام حذف الصور المستحقة في الطابور مباشرة"""
+        from bot.image_queue import image_queue
+        processed = image_queue.drain()
+        print(f"تمت معالجة {processed} مهمة حذف")
+
+    @app.cli.command("images-gc")
+    @click.option('--delete', is_flag=True, help='حذف الصور اليتيمة بدلاً من عرضها فقط')
+    @click.option('--cloudflare', is_flag=True, help='فحص صور Cloudflare أيضاً')
+    @click.option('--batch-size', default=100, show_default=True, help='عدد الصور في كل دفعة')
+    @click.option('--min-age', default=3600, show_default=True, help='تجاهل الصور الأحدث من هذا العدد من الثواني')
+    def images_gc(delete, cloudflare, batch_size, min_age):
+        """البحث عن الصور التي لا يشير إليها أي منتج أو مستخدم وحذفها"""
+        from bot.image_gc import collect_garbage
+        summary = collect_garbage(
+            dry_run=not delete,
+            include_cloudflare=cloudflare,
+            batch_size=batch_size,
+            min_age=min_age,
+            report=print
+        )
+        print(f"صور محلية يتيمة: {summary['local']} ({summary['local_bytes']} بايت)")
+        if cloudflare:
+            print(f"صور Cloudflare يتيمة: {summary['cloudflare']}")
+        if delete:
+            print(f"تم حذف {summary['deleted']} صورة")
+        else:
+            print("وضع العرض فقط، استخدم --delete للحذف")
+
+    @app.cli.command("ratings-rebuild")
+    def ratings_rebuild():
+        """إعادة حساب ملخص تقييمات المستخدمين من جدول المراجعات"""
+        from bot.ratings import reconcile_ratings
+        fixed = reconcile_ratings()
+        print(f"تم تصحيح تقييمات {fixed} مستخدم")
+
+    @app.cli.command("unread-rebuild")
+    def unread_rebuild():
+        """إعادة حساب عدادات الرسائل غير المقروءة وملخص المحادثات من جدول الرسائل"""
+        from bot.unread import reconcile_unread
+        fixed = reconcile_unread()
+        print(f"تم تصحيح عدادات {fixed} مستخدم")
+
     if __name__ == '__main__':
 
         with app.app_context():
@@ -40,7 +100,10 @@ try:
         # تشغيل التطبيق
         port = app.config.get('PORT', 5000)
         debug = app.config.get('DEBUG', True)
-        app.run(debug=debug, host='0.0.0.0', port=port)
+        if socketio is not None:
+            socketio.run(app, debug=debug, host='0.0.0.0', port=port)
+        else:
+            app.run(debug=debug, host='0.0.0.0', port=port)
 
 except Exception as e:
     print(f"Error al inicializar la aplicación: {e}")
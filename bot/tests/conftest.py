@@ -0,0 +1,21 @@
+import pytest
+
+from bot import create_app, db
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'test.db'}")
+    app = create_app()
+    assert app is not None, 'create_app() failed'
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,172 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from bot import cloudflare_client
+from bot.cloudflare_client import CloudflareImagesClient
+
+
+class StubServer:
+    """خادم HTTP محلي يرد بالاستجابات المحددة بالترتيب ويسجل الطلبات التي وصلته"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _handle(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                stub.requests.append((self.command, self.path, self.rfile.read(length)))
+                status, headers, body, delay = stub.responses.pop(0)
+                if delay:
+                    threading.Event().wait(delay)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = do_DELETE = do_HEAD = _handle
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def reply(status, body=b'{"success": true, "result": {}}', headers=None, delay=0):
+    return status, headers or {}, body, delay
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    recorded = []
+    monkeypatch.setattr(cloudflare_client.time, 'sleep', recorded.append)
+    return recorded
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(*responses):
+        server = StubServer(responses)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def make_client(url, **kwargs):
+    kwargs.setdefault('max_retries', 3)
+    kwargs.setdefault('read_timeout', 2)
+    return CloudflareImagesClient('account', 'token', base_url=url, **kwargs)
+
+
+def test_idempotent_request_is_retried_until_success(stub, sleeps):
+    server = stub(reply(503), reply(502), reply(200))
+    client = make_client(server.url)
+
+    response = client.request('head', 'GET', f'{server.url}/image')
+
+    assert response.status_code == 200
+    assert len(server.requests) == 3
+    assert len(sleeps) == 2
+    metrics = client.metrics()['head']
+    assert metrics['calls'] == 3
+    assert metrics['errors'] == 2
+    assert metrics['retries'] == 2
+    assert metrics['error_rate'] == pytest.approx(2 / 3)
+    assert metrics['max_latency'] >= metrics['avg_latency'] > 0
+
+
+def test_retries_stop_at_max_retries(stub, sleeps):
+    server = stub(*[reply(500)] * 3)
+    client = make_client(server.url, max_retries=2)
+
+    response = client.request('list', 'GET', f'{server.url}/images')
+
+    assert response.status_code == 500
+    assert len(server.requests) == 3
+    assert client.metrics()['list']['retries'] == 2
+    assert client.metrics()['list']['errors'] == 3
+
+
+def test_backoff_grows_exponentially_and_is_capped(stub, sleeps, monkeypatch):
+    monkeypatch.setattr(cloudflare_client.random, 'uniform', lambda low, high: high)
+    server = stub(*[reply(503)] * 5)
+    client = make_client(server.url, max_retries=4, backoff=0.5, max_backoff=3)
+
+    client.request('list', 'GET', f'{server.url}/images')
+
+    assert sleeps == [0.5, 1.0, 2.0, 3]
+
+
+def test_retry_after_is_capped_by_max_backoff(stub, sleeps):
+    server = stub(reply(429, headers={'Retry-After': '3600'}), reply(200))
+    client = make_client(server.url, max_backoff=5)
+
+    response = client.request('list', 'GET', f'{server.url}/images')
+
+    assert response.status_code == 200
+    assert sleeps == [5]
+
+
+def test_upload_is_not_retried_after_server_error(stub, sleeps):
+    server = stub(reply(500), reply(200))
+    client = make_client(server.url)
+
+    assert client.upload('img-1', b'data') is None
+    assert len(server.requests) == 1
+    assert sleeps == []
+    assert client.metrics()['upload']['retries'] == 0
+
+
+def test_upload_is_not_retried_after_read_timeout(stub, sleeps):
+    server = stub(reply(200, delay=1), reply(200))
+    client = make_client(server.url, read_timeout=0.2)
+
+    assert client.upload('img-1', b'data') is None
+    assert len(server.requests) == 1
+    assert client.metrics()['upload']['errors'] == 1
+
+
+def test_upload_stream_is_retried_after_rate_limit_with_full_body(stub, sleeps, tmp_path):
+    path = tmp_path / 'image.jpg'
+    path.write_bytes(b'\xff\xd8' + b'x' * 200000)
+    server = stub(reply(429), reply(200, body=b'{"success": true, "result": {"id": "img-1"}}'))
+    client = make_client(server.url)
+
+    with open(path, 'rb') as stream:
+        result = client.upload_stream('img-1', stream, 'image.jpg')
+
+    assert result == {'id': 'img-1'}
+    assert len(server.requests) == 2
+    first, second = (body for _, _, body in server.requests)
+    assert first == second
+    assert path.read_bytes() in first
+
+
+def test_connection_error_is_retried_for_upload(sleeps):
+    server = StubServer([])
+    url = server.url
+    server.close()
+    client = make_client(url, max_retries=2)
+
+    assert client.upload('img-1', b'data') is None
+    metrics = client.metrics()['upload']
+    assert metrics['calls'] == 3
+    assert metrics['errors'] == 3
+    assert metrics['retries'] == 2
@@ -0,0 +1,56 @@
+from bot import db
+from bot.facets import PRICE_BUCKETS, apply_facet_filters, compute_facets
+from bot.models import Category, Product, User
+
+
+def create_products(*rows):
+    seller = User(name='seller', email='seller@example.com', password='x')
+    db.session.add(seller)
+    for title, category, location, condition, price in rows:
+        db.session.add(Product(
+            title=title, description='وصف', price=price, condition=condition,
+            category_id=category.id, location=location, seller=seller
+        ))
+    db.session.commit()
+
+
+def bucket_count(facets, lower):
+    return next(bucket['count'] for bucket in facets['price_buckets'] if bucket['min_price'] == lower)
+
+
+def test_each_facet_ignores_its_own_filter(app):
+    phones, cars = Category.query.order_by(Category.id).limit(2).all()
+    create_products(
+        ('هاتف', phones, 'damascus', 'new', 50000),
+        ('هاتف مستعمل', phones, 'aleppo', 'good', 80000),
+        ('سيارة', cars, 'damascus', 'good', 3000000),
+    )
+    filters = {'category_id': phones.id, 'location': 'damascus'}
+    available = Product.query.filter_by(is_active=True, is_sold=False)
+
+    facets = compute_facets(available, filters)
+
+    assert facets['total'] == apply_facet_filters(available, filters).count() == 1
+    # التصنيفات الأخرى في دمشق تبقى معدودة رغم اختيار تصنيف
+    assert facets['categories'] == {phones.id: 1, cars.id: 1}
+    assert facets['locations'] == {'damascus': 1, 'aleppo': 1}
+    assert facets['conditions'] == {'new': 1}
+
+
+def test_price_bucket_counts_match_bucket_links(app):
+    category = Category.query.first()
+    lower, upper = PRICE_BUCKETS[1]
+    create_products(
+        ('أقل من الشريحة', category, 'damascus', 'new', lower - 1),
+        ('على الحد الأدنى', category, 'damascus', 'new', lower),
+        ('داخل الشريحة', category, 'damascus', 'new', (lower + upper) / 2),
+        ('على الحد الأعلى', category, 'damascus', 'new', upper),
+    )
+    available = Product.query.filter_by(is_active=True, is_sold=False)
+    facets = compute_facets(available)
+
+    for bucket_lower, bucket_upper in PRICE_BUCKETS:
+        linked = apply_facet_filters(available, {'min_price': bucket_lower, 'max_price': bucket_upper})
+        assert bucket_count(facets, bucket_lower) == linked.count()
+
+    assert bucket_count(facets, lower) == 3
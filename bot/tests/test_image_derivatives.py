@@ -0,0 +1,30 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image
+
+from bot import image_service
+from bot.image_service import ImageService
+
+
+@pytest.fixture(autouse=True)
+def static_folder(app, tmp_path, monkeypatch):
+    """حفظ الصور المحلية في مجلد مؤقت بدلاً من مجلد static الخاص بالتطبيق"""
+    monkeypatch.setattr(app, 'static_folder', str(tmp_path / 'static'))
+
+
+def test_missing_derivative_is_created_in_background(app, monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(image_service, '_verify_executor', executor)
+
+    folder = ImageService.image_folder('uploads')
+    os.makedirs(folder)
+    Image.new('RGB', (800, 600), 'red').save(os.path.join(folder, 'legacy.png'))
+
+    # الصفحة تُعرض بالصورة الأصلية دون انتظار إنشاء النسخة المصغرة
+    assert ImageService.get_image_url('legacy', size='thumbnail') == '/static/images/uploads/legacy.png'
+
+    executor.shutdown(wait=True)
+    thumbnail = ImageService.get_image_url('legacy', size='thumbnail')
+    assert thumbnail.startswith('/static/images/uploads/legacy_thumbnail.')
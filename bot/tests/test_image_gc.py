@@ -0,0 +1,20 @@
+import pytest
+
+from bot.image_gc import _image_id
+
+
+IMAGE_ID = '2cdc28f0-017a-49c4-9ed7-87056c83901a'
+
+
+@pytest.mark.parametrize('value', [
+    IMAGE_ID,
+    f'https://imagedelivery.net/Vi7wi5KSItxGFsWRG2Us6Q/{IMAGE_ID}/public',
+    f'https://imagedelivery.net/Vi7wi5KSItxGFsWRG2Us6Q/{IMAGE_ID}/thumbnail',
+    f'https://imagedelivery.net/Vi7wi5KSItxGFsWRG2Us6Q/{IMAGE_ID}/w=480,fit=cover',
+    f'https://imagedelivery.net/Vi7wi5KSItxGFsWRG2Us6Q/{IMAGE_ID}',
+    f'https://example.com/cdn-cgi/imagedelivery/Vi7wi5KSItxGFsWRG2Us6Q/{IMAGE_ID}/card',
+    f'/static/images/products/{IMAGE_ID}.jpg',
+    f'/static/images/products/{IMAGE_ID}_thumbnail.webp',
+])
+def test_image_id_from_stored_value(value):
+    assert _image_id(value) == IMAGE_ID
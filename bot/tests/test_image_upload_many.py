@@ -0,0 +1,70 @@
+import io
+import threading
+
+import pytest
+from PIL import Image
+from sqlalchemy import event
+from werkzeug.datastructures import FileStorage
+
+from bot import db
+from bot.image_service import ImageService
+from bot.models import StoredImage
+
+
+def png_bytes(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def upload(data, name):
+    return FileStorage(stream=io.BytesIO(data), filename=name, content_type='image/png')
+
+
+@pytest.fixture(autouse=True)
+def static_folder(app, tmp_path, monkeypatch):
+    """حفظ الصور المحلية في مجلد مؤقت بدلاً من مجلد static الخاص بالتطبيق"""
+    monkeypatch.setattr(app, 'static_folder', str(tmp_path / 'static'))
+
+
+@pytest.fixture
+def write_threads(app):
+    """الخيوط التي نفذت عبارات كتابة في قاعدة البيانات"""
+    threads = set()
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not statement.lstrip().upper().startswith('SELECT'):
+            threads.add(threading.current_thread().name)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    yield threads
+    event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def test_upload_many_writes_to_the_database_only_from_the_request_thread(app, write_threads):
+    red, green, blue = png_bytes('red'), png_bytes('green'), png_bytes('blue')
+    existing = ImageService.upload_file(upload(blue, 'blue.png'), folder='products')
+    write_threads.clear()
+
+    results = ImageService.upload_many([
+        upload(red, 'red.png'),
+        upload(green, 'green.png'),
+        upload(red, 'red-again.png'),
+        upload(blue, 'blue-again.png'),
+    ], folder='products')
+
+    assert write_threads == {threading.current_thread().name}
+    assert [result['id'] for result in results[:3]] == [results[0]['id'], results[1]['id'], results[0]['id']]
+    assert results[0]['id'] != results[1]['id']
+    assert results[3]['id'] == existing['id'] and results[3]['deduplicated']
+    assert StoredImage.query.filter_by(folder='products').count() == 3
+
+
+def test_upload_many_rejects_the_batch_when_one_file_is_invalid(app):
+    results = ImageService.upload_many(
+        [upload(png_bytes('red'), 'red.png'), upload(b'text', 'notes.txt')],
+        folder='products'
+    )
+
+    assert results is None
+    assert StoredImage.query.count() == 0
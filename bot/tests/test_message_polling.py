@@ -0,0 +1,55 @@
+import pytest
+from sqlalchemy import event
+
+from bot import db
+from bot.models import Message, User
+from bot.utils import create_token
+
+
+@pytest.fixture
+def statements(app):
+    recorded = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        recorded.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    yield recorded
+    event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def message_updates(statements):
+    return [statement for statement in statements if statement.lstrip().upper().startswith('UPDATE MESSAGE')]
+
+
+def test_polling_marks_messages_read_only_when_there_are_unread(client, statements):
+    reader = User(name='reader', email='reader@example.com', password='x')
+    sender = User(name='sender', email='sender@example.com', password='x')
+    db.session.add_all([reader, sender])
+    db.session.flush()
+    db.session.add_all([
+        Message(sender_id=sender.id, receiver_id=reader.id, content='مرحبا'),
+        Message(sender_id=sender.id, receiver_id=reader.id, content='هل المنتج متوفر؟'),
+    ])
+    db.session.commit()
+    reader_id, sender_id = reader.id, sender.id
+    headers = {'Authorization': f'Bearer {create_token(reader_id, False, 1)}'}
+
+    response = client.get(f'/messages/api/get_messages/{sender_id}', headers=headers)
+    assert response.status_code == 200
+    assert len(message_updates(statements)) == 1
+    assert Message.query.filter_by(receiver_id=reader_id, is_read=False).count() == 0
+
+    statements.clear()
+    for _ in range(3):
+        response = client.get(f'/messages/api/get_messages/{sender_id}', headers=headers)
+        assert response.status_code == 200
+        assert len(response.get_json()['messages']) == 2
+    assert message_updates(statements) == []
+
+    db.session.add(Message(sender_id=sender_id, receiver_id=reader_id, content='رسالة جديدة'))
+    db.session.commit()
+    statements.clear()
+
+    client.get(f'/messages/api/get_messages/{sender_id}', headers=headers)
+    assert len(message_updates(statements)) == 1
@@ -0,0 +1,75 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+from bot import db
+from bot.models import Category, Product, User
+from bot.pagination import decode_cursor, encode_cursor, keyset_paginate
+
+
+def create_products(created_at_values, views=None):
+    seller = User(name='seller', email='seller@example.com', password='x')
+    category = Category.query.first()
+    db.session.add(seller)
+    db.session.flush()
+    for index in range(len(created_at_values)):
+        db.session.add(Product(
+            title=f'منتج {index}', description='وصف', price=100, condition='new',
+            category_id=category.id, location='damascus', seller_id=seller.id
+        ))
+    db.session.flush()
+    # القيم الافتراضية تملأ created_at و views_count عند الإضافة، فتُضبط القيم المطلوبة (ومنها NULL) بعدها
+    for index, product in enumerate(Product.query.order_by(Product.id)):
+        product.created_at = created_at_values[index]
+        product.views_count = views[index] if views else 0
+    db.session.commit()
+
+
+def walk(columns, descending=True, per_page=2):
+    """كل المعرفات بالتنقل صفحة صفحة بمؤشر next، ثم بالرجوع بمؤشر prev"""
+    query = Product.query
+    pages = [keyset_paginate(query, columns, descending=descending, per_page=per_page)]
+    while pages[-1].next_cursor:
+        pages.append(keyset_paginate(query, columns, descending=descending, cursor=pages[-1].next_cursor, per_page=per_page))
+
+    forward = [product.id for page in pages for product in page.items]
+
+    backward = []
+    page = pages[-1]
+    while page.prev_cursor:
+        page = keyset_paginate(query, columns, descending=descending, cursor=page.prev_cursor, per_page=per_page)
+        backward = [product.id for product in page.items] + backward
+    backward += [product.id for product in pages[-1].items]
+
+    return forward, backward
+
+
+def test_rows_with_null_sort_values_are_not_dropped(app):
+    now = datetime.utcnow()
+    create_products([now, None, now - timedelta(days=1), None, now, None, now - timedelta(days=2)])
+    ids = [product.id for product in Product.query]
+
+    for descending in (True, False):
+        forward, backward = walk((Product.created_at, Product.id), descending=descending)
+        assert sorted(forward) == sorted(ids)
+        assert backward == forward
+
+
+def test_null_views_count_pages(app):
+    create_products([datetime.utcnow()] * 5, views=[3, None, 0, None, 7])
+
+    forward, backward = walk((Product.views_count, Product.id))
+
+    assert len(forward) == len(set(forward)) == 5
+    assert backward == forward
+
+
+def test_cursor_round_trips_decimal_and_date_values():
+    values = [Decimal('12.50'), date(2024, 3, 1), datetime(2024, 3, 1, 12, 30), 7, 'نص']
+    assert decode_cursor(encode_cursor('next', values)) == ('next', values)
+
+
+def test_unsupported_nullable_sort_column_raises_clear_error(app):
+    with pytest.raises(ValueError, match='is_active'):
+        keyset_paginate(Product.query, (Product.is_active, Product.id))
@@ -0,0 +1,98 @@
+import threading
+
+import pytest
+from sqlalchemy import event
+
+from bot import db
+from bot.models import Category, Product, ProductImage, User, UserReview
+
+
+class QueryCounter:
+    """عدّ جمل SQL التي ينفذها خيط الطلب الحالي فقط (دون خيوط العمل في الخلفية)"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.thread_id = threading.get_ident()
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self.thread_id:
+            self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+
+    def __len__(self):
+        return len(self.statements)
+
+
+def create_user(index, **kwargs):
+    user = User(name=f'user {index}', email=f'user{index}@example.com', password='x', **kwargs)
+    db.session.add(user)
+    return user
+
+
+def create_product(seller, category, title, images):
+    product = Product(
+        title=title, description='وصف المنتج', price=100, condition='new',
+        category_id=category.id, location='دمشق', seller=seller
+    )
+    for index in range(images):
+        product.images.append(ProductImage(
+            cloudflare_id=f'{title}-{index}', url=f'/static/images/products/{title}-{index}.jpg',
+            is_primary=index == 0
+        ))
+    db.session.add(product)
+    return product
+
+
+def seed_product_page(images, similar, reviews):
+    """منتج مع صوره ومنتجات مشابهة من بائعين مختلفين، ولكل بائع عدد من التقييمات"""
+    category = Category.query.first()
+    sellers = [create_user(f'seller-{index}') for index in range(similar + 1)]
+    reviewers = [create_user(f'reviewer-{index}') for index in range(reviews)]
+    db.session.flush()
+
+    product = create_product(sellers[0], category, 'main', images)
+    for index, seller in enumerate(sellers[1:]):
+        create_product(seller, category, f'similar-{index}', images)
+
+    for seller in sellers:
+        for reviewer in reviewers:
+            db.session.add(UserReview(reviewer_id=reviewer.id, reviewed_user_id=seller.id, rating=4))
+
+    db.session.commit()
+    return product.id
+
+
+def count_page_queries(client, product_id):
+    db.session.remove()
+    with QueryCounter(db.engine) as queries:
+        response = client.get(f'/products/view/{product_id}')
+    assert response.status_code == 200
+    return queries
+
+
+# المنتج مع البائع والتصنيف، صوره، خصائصه، المنتجات المشابهة مع بائعيها، صورها، وتقييمات البائعين
+PRODUCT_PAGE_QUERIES = 6
+
+
+def test_product_page_runs_a_fixed_number_of_queries(client):
+    product_id = seed_product_page(images=5, similar=4, reviews=3)
+
+    queries = count_page_queries(client, product_id)
+
+    assert len(queries) == PRODUCT_PAGE_QUERIES, '\n\n'.join(queries.statements)
+
+
+@pytest.mark.parametrize('images,reviews', [(1, 1), (8, 6)])
+def test_product_page_queries_do_not_grow_with_images_or_ratings(client, images, reviews):
+    product_id = seed_product_page(images=images, similar=4, reviews=reviews)
+
+    queries = count_page_queries(client, product_id)
+
+    assert len(queries) == PRODUCT_PAGE_QUERIES, '\n\n'.join(queries.statements)
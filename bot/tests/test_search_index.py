@@ -0,0 +1,28 @@
+from bot import db
+from bot.models import Category, Product, SearchIndexState, User
+from bot.search import init_search, search_products
+from bot.text_normalization import NORMALIZER_VERSION, build_search_text
+
+
+def test_outdated_normalizer_version_rebuilds_search_text(app):
+    category = Category.query.first()
+    seller = User(name='seller', email='seller@example.com', password='x')
+    product = Product(
+        title='السيارات', description='وصف', price=100, condition='new',
+        category_id=category.id, location='damascus', seller=seller
+    )
+    db.session.add(product)
+    db.session.commit()
+
+    # نصوص بحث مبنية بقواعد قديمة لا تطابق جذوع كلمات البحث الحالية
+    product.search_text = 'السيارات وصف'
+    db.session.get(SearchIndexState, 'product').normalizer_version = NORMALIZER_VERSION - 1
+    db.session.commit()
+
+    init_search(app)
+
+    db.session.expire_all()
+    assert product.search_text == build_search_text('السيارات', 'وصف')
+    assert db.session.get(SearchIndexState, 'product').normalizer_version == NORMALIZER_VERSION
+    query, _ = search_products(Product.query, 'سيارات')
+    assert query.all() == [product]
@@ -0,0 +1,56 @@
+from bot import db
+from bot.conversations import get_inbox
+from bot.models import Message, UnreadCount, User, UserRating, UserReview
+from bot.unread import compute_unread, unread_total
+from bot.upsert import upsert
+
+
+def make_users(*names):
+    users = [User(name=name, email=f'{name}@example.com', password='x') for name in names]
+    db.session.add_all(users)
+    db.session.flush()
+    return users
+
+
+def test_deleting_sender_decrements_receiver_total(app):
+    receiver, sender, other = make_users('receiver', 'sender', 'other')
+    db.session.add_all([
+        Message(sender_id=sender.id, receiver_id=receiver.id, content='مرحبا'),
+        Message(sender_id=sender.id, receiver_id=receiver.id, content='هل المنتج متوفر؟'),
+        Message(sender_id=other.id, receiver_id=receiver.id, content='السعر؟'),
+    ])
+    db.session.commit()
+    assert unread_total(receiver.id) == 3
+
+    for message in Message.query.filter_by(sender_id=sender.id).all():
+        db.session.delete(message)
+    db.session.delete(sender)
+    db.session.commit()
+
+    assert unread_total(receiver.id) == 1 == compute_unread()[receiver.id]
+    inbox = get_inbox(receiver.id)
+    assert [item['other_user'].id for item in inbox] == [other.id]
+    assert inbox[0]['unread_count'] == 1
+
+
+def test_upsert_inserts_then_updates(app):
+    user, = make_users('counted')
+    db.session.commit()
+    table = UnreadCount.__table__
+
+    with db.engine.begin() as connection:
+        upsert(connection, table, {'user_id': user.id}, {'count': table.c.count + 2}, {'count': 2})
+        upsert(connection, table, {'user_id': user.id}, {'count': table.c.count + 3}, {'count': 3})
+
+    assert unread_total(user.id) == 5
+
+
+def test_rating_totals_accumulate_across_flushes(app):
+    reviewer, rated = make_users('reviewer', 'rated')
+    db.session.add(UserReview(reviewer_id=reviewer.id, reviewed_user_id=rated.id, rating=4))
+    db.session.commit()
+    db.session.add(UserReview(reviewer_id=reviewer.id, reviewed_user_id=rated.id, rating=2))
+    db.session.commit()
+
+    rating = db.session.get(UserRating, rated.id)
+    assert (rating.rating_sum, rating.rating_count) == (6, 2)
@@ -0,0 +1,13 @@
+import atexit
+
+from bot import create_app
+
+
+def test_shutdown_is_registered_once(app, monkeypatch):
+    registered = []
+    monkeypatch.setattr(atexit, 'register', registered.append)
+
+    create_app()
+    create_app()
+
+    assert registered == []